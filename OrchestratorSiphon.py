@@ -5,8 +5,9 @@ import sys #< Used to exit the script
 from getpass import getpass # Used to get user input without printing it to screen
 import signal #< Used to catch terminal signals to switch to interactive mode
 import argparse #< Used to launch the program locked into interactive mode
+import threading #< Used to keep the workers' round state up to date while a menu is open
 # Import our own libraries
-from lib import Util, Contract, User, State
+from lib import Util, Contract, AsyncContract, User, State, Control, Fleet, Planner, Checkpoint, Stream, Prefetch, Profiler, Workers, Cassette
 
 
 ### Immediately start signal listeners - these are used to switch to interactive mode
@@ -40,19 +41,54 @@ parser = argparse.ArgumentParser(description="Orchestrator Siphon")
 parser.add_argument(
     '-i', '-it', '--interactive', action='store_true', help="Launch the program locked in interactive mode."
 )
+parser.add_argument(
+    '--attach', action='store_true', help="Open the interactive menus of an already running siphon, which keeps siphoning in the meantime."
+)
+parser.add_argument(
+    '--profile', nargs='?', const="1", metavar="CYCLES|governance",
+    help="Sample where time goes during the first CYCLES siphon cycles (default 1) or a full governance scan, and write a flame graph and summary to the data folder."
+)
+parser.add_argument(
+    '--workers', type=int, default=1, metavar="N",
+    help="Split the Orchestrators over N worker processes, with this process keeping the round state up to date for all of them."
+)
 args, unknown = parser.parse_known_args()
 if unknown:
     Util.log(f"Warning: Skipping unknown arguments: {', '.join(unknown)}", 1)
 State.LOCK_INTERACTIVE = getattr(args, 'interactive', False) or getattr(args, 'it', False) or getattr(args, 'i', False)
 State.require_user_input = State.LOCK_INTERACTIVE
+# Attaching does not need any keystores, the running siphon does all the work
+if args.attach:
+    Control.runClient()
+    sys.exit(0)
+Cassette.announce()
+# Amount of siphon cycles left to profile
+profile_cycles = 0
+if args.profile is not None and args.profile != "governance":
+    if args.profile.isdigit():
+        profile_cycles = int(args.profile)
+    else:
+        Util.log("Warning: --profile takes a number of cycles or 'governance', not '{0}'. Not profiling".format(args.profile), 1)
 
 
 ### Orchestrator state
 
 
 # This class initializes an Orchestrator object
+# Balances, timers and reward rounds are stored in the columnar State.fleet
 class Orchestrator:
+    previous_LPT_refresh = Fleet.column("previous_LPT_refresh")
+    balance_LPT_pending = Fleet.column("balance_LPT_pending")
+    previous_ETH_refresh = Fleet.column("previous_ETH_refresh")
+    balance_ETH_pending = Fleet.column("balance_ETH_pending")
+    balance_ETH = Fleet.column("balance_ETH")
+    rate_ETH_pending = Fleet.column("rate_ETH_pending")
+    previous_round_refresh = Fleet.column("previous_round_refresh")
+    previous_reward_round = Fleet.column("previous_reward_round")
+
     def __init__(self, obj):
+        self.fleet = State.fleet
+        self.fleet_idx = State.fleet.add()
         # Orch details
         self.source_address = obj._source_address
         self.srcKeypath = obj._source_key
@@ -84,6 +120,9 @@ class Orchestrator:
         # Round details
         self.previous_round_refresh = 0
         self.previous_reward_round = 0
+        # Reward transaction signed ahead of the next round
+        self.prepared_reward = None
+        self.reward_gas_used = 0
 
 # For each configured keystore, create a Orchestrator object
 for obj in State.KEYSTORE_CONFIGS:
@@ -95,18 +134,37 @@ for i in range(len(State.orchestrators)):
     while State.orchestrators[i].source_private_key == "":
         State.orchestrators[i].source_private_key = Util.getPrivateKey(State.orchestrators[i].srcKeypath, getpass("Enter the password for {0}: ".format(State.orchestrators[i].source_address)))
 
+# Pick up where the previous run left off, so a restart does not re-query everything at once
+Checkpoint.restore()
+
+# Split the fleet over worker processes. Has to happen before any background threads get started
+coordinating = False
+if args.workers > 1:
+    if State.LOCK_INTERACTIVE:
+        Util.log("Warning: --workers has no effect in interactive mode", 1)
+    else:
+        coordinating = Workers.start(args.workers)
+        if Workers.isWorker():
+            Contract.reconnect()
+
 
 ### Main logic
 
 
 """
 @brief Checks all Orchestrators if any cached data needs refreshing or contracts need calling
+Every step first selects the Orchestrators which need action from the fleet state,
+so idle Orchestrators cost next to nothing, no matter how large the fleet is.
 """
 def refreshState():
     if State.require_user_input:
         return
-    # Check for round updates
-    if current_time < State.previous_round_refresh + State.WAIT_TIME_ROUND_REFRESH:
+    fleet = State.fleet
+    # Check for round updates. Once the next round is due, check every cycle so we call reward ASAP
+    if Workers.isWorker():
+        # The coordinator keeps the round state up to date for all workers
+        Workers.syncRound()
+    elif current_time < State.previous_round_refresh + State.WAIT_TIME_ROUND_REFRESH and current_time < State.next_round_eta:
         if State.current_round_is_locked:
             Util.log("(cached) Round status: round {0} (locked). Refreshing in {1:.0f} seconds...".format(State.current_round_num, State.WAIT_TIME_ROUND_REFRESH - (current_time - State.previous_round_refresh)), 3)
         else:
@@ -115,77 +173,141 @@ def refreshState():
         Contract.refreshRound()
         Contract.refreshLock()
 
-    # Now check each Orch keystore for expired cached values and do stuff
-    for i in range(len(State.orchestrators)):
-        Util.log("Refreshing Orchestrator '{0}'".format(State.orchestrators[i].source_address), 2)
-
-        # First check pending LPT
-        if current_time < State.orchestrators[i].previous_LPT_refresh + State.WAIT_TIME_LPT_REFRESH:
-            Util.log("(cached) {0}'s pending stake is {1:.2f} LPT. Refreshing in {2:.0f} seconds...".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_LPT_pending, State.WAIT_TIME_LPT_REFRESH - (current_time - State.orchestrators[i].previous_LPT_refresh)), 3)
+    # First check if we need to call reward, as that is the most time sensitive
+    done = fleet.where("previous_reward_round", ">=", State.current_round_num)
+    Util.log("{0} of {1} Orchestrators have already called reward this round".format(len(done), fleet.size), 3)
+    for i in done:
+        # Get the reward call for the next round signed and ready to go
+        if State.orchestrators[i].prepared_reward is None:
+            Contract.prepareReward(i)
+    # Refresh the last reward round of the rest, if their cached value expired
+    pending = fleet.where("previous_reward_round", "<", State.current_round_num)
+    expired = set(fleet.expired("previous_round_refresh", State.WAIT_TIME_ROUND_REFRESH, current_time))
+    for i in pending:
+        if i in expired:
+            Contract.refreshRewardRound(i)
         else:
-            Contract.refreshStake(i)
+            Util.log("(cached) {0}'s last reward round is {1}".format(State.orchestrators[i].source_address, State.orchestrators[i].previous_reward_round), 3)
+    # Call reward, only for Orchestrators where it would succeed
+    for i, _ in Contract.preflight([(i, "reward") for i in fleet.where("previous_reward_round", "<", State.current_round_num)]):
+        Util.log("Calling reward for {0}...".format(State.orchestrators[i].source_address), 2)
+        Contract.doCallReward(i)
+        Contract.refreshRewardRound(i)
+        Contract.refreshStake(i)
 
-        # Transfer pending LPT at the end of round if threshold is reached
-        if State.orchestrators[i].balance_LPT_pending < State.LPT_THRESHOLD:
-            Util.log("{0} has {1:.2f} LPT in pending stake < threshold of {2:.2f} LPT".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_LPT_pending, State.LPT_THRESHOLD), 3)
-        else:
-            Util.log("{0} has {1:.2f} LPT pending stake > threshold of {2:.2f} LPT".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_LPT_pending, State.LPT_THRESHOLD), 2)
-            if State.LPT_MINVAL > State.orchestrators[i].balance_LPT_pending:
-                Util.log("Cannot transfer LPT, as the minimum value to leave behind is larger than the self-stake", 1)
-            elif State.current_round_is_locked:
-                Contract.doTransferBond(i)
-                Contract.refreshStake(i)
-            else:
-                Util.log("Waiting for round to be locked before transferring bond", 2)
+    # The sweeps below are planned against the current gas price
+    Planner.refreshBaseFee()
 
-        # Then check pending ETH balance
-        if current_time < State.orchestrators[i].previous_ETH_refresh + State.WAIT_TIME_ETH_REFRESH:
-            Util.log("(cached) {0}'s pending fees is {1:.4f} ETH. Refreshing in {2:.0f} seconds...".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_ETH_pending,State.WAIT_TIME_ETH_REFRESH - (current_time - State.orchestrators[i].previous_ETH_refresh)), 3)
-        else:
-            Contract.refreshFees(i)
-            Contract.checkEthBalance(i)
+    # Then check pending LPT, for Orchestrators whose scheduled refresh is due
+    expired = fleet.where("next_LPT_refresh", "<=", current_time)
+    Util.log("(cached) {0} of {1} Orchestrators have a fresh pending stake".format(fleet.size - len(expired), fleet.size), 3)
+    if expired:
+        AsyncContract.run(AsyncContract.refreshFleet, stake=expired)
+
+    # Sweeps get planned first, then checked together in one pre-flight pass
+    planned = []
+
+    # Transfer pending LPT at the end of round if threshold is reached
+    for i in fleet.where("balance_LPT_pending", ">=", State.LPT_THRESHOLD):
+        Util.log("{0} has {1:.2f} LPT pending stake > threshold of {2:.2f} LPT".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_LPT_pending, State.LPT_THRESHOLD), 2)
+        if State.LPT_MINVAL > State.orchestrators[i].balance_LPT_pending:
+            Util.log("Cannot transfer LPT, as the minimum value to leave behind is larger than the self-stake", 1)
+        elif not State.current_round_is_locked:
+            Util.log("Waiting for round to be locked before transferring bond", 2)
+        elif Planner.shouldTransferBond(i):
+            planned.append((i, "transferBond"))
+
+    # Then check pending ETH balance, for Orchestrators whose scheduled refresh is due
+    expired = fleet.where("next_ETH_refresh", "<=", current_time)
+    Util.log("(cached) {0} of {1} Orchestrators have fresh pending fees".format(fleet.size - len(expired), fleet.size), 3)
+    if expired:
+        AsyncContract.run(AsyncContract.refreshFleet, fees=expired)
 
-        # Withdraw pending ETH if threshold is reached 
-        if State.orchestrators[i].balance_ETH_pending < State.ETH_THRESHOLD:
-            Util.log("{0} has {1:.4f} ETH in pending fees < threshold of {2:.4f} ETH".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_ETH_pending, State.ETH_THRESHOLD), 3)
+    # Withdraw pending ETH if threshold is reached and gas is cheap enough, or earlier if gas is very cheap
+    for i in fleet.where("balance_ETH_pending", ">=", State.ETH_THRESHOLD * Planner.BRING_FORWARD_MIN):
+        if not Planner.shouldSweepEth(i, "withdrawFees"):
+            continue
+        Util.log("{0} has {1:.4f} in ETH pending fees, threshold is {2:.4f} ETH, withdrawing fees...".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_ETH_pending, State.ETH_THRESHOLD), 2)
+        planned.append((i, "withdrawFees"))
+
+    for i, action in Contract.preflight(planned):
+        if action == "transferBond":
+            Contract.doTransferBond(i)
+            Contract.refreshStake(i)
         else:
-            Util.log("{0} has {1:.4f} in ETH pending fees > threshold of {2:.4f} ETH, withdrawing fees...".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_ETH_pending, State.ETH_THRESHOLD), 2)
             Contract.doWithdrawFees(i)
             Contract.refreshFees(i)
             Contract.checkEthBalance(i)
 
-        # Transfer ETH to receiver if threshold is reached
-        if State.orchestrators[i].balance_ETH < State.ETH_THRESHOLD:
-            Util.log("{0} has {1:.4f} ETH in their wallet < threshold of {2:.4f} ETH".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_ETH, State.ETH_THRESHOLD), 3)
-        elif State.ETH_MINVAL > State.orchestrators[i].balance_ETH:
-            Util.log("Cannot transfer ETH, as the minimum value to leave behind is larger than the balance", 1)
-        else:
-            Util.log("{0} has {1:.4f} in ETH pending fees > threshold of {2:.4f} ETH, sending some to {3}...".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_ETH, State.ETH_THRESHOLD, State.orchestrators[i].target_address_ETH), 2)
+    # Transfer ETH to receiver if threshold is reached and gas is cheap enough, or earlier if gas is very cheap
+    for i in fleet.where("balance_ETH", ">=", State.ETH_THRESHOLD * Planner.BRING_FORWARD_MIN):
+        if State.ETH_MINVAL > State.orchestrators[i].balance_ETH:
+            if State.orchestrators[i].balance_ETH >= State.ETH_THRESHOLD:
+                Util.log("Cannot transfer ETH, as the minimum value to leave behind is larger than the balance", 1)
+        elif Planner.shouldSweepEth(i, "sendFees"):
+            Util.log("{0} has {1:.4f} ETH in their wallet, threshold is {2:.4f} ETH, sending some to {3}...".format(State.orchestrators[i].source_address, State.orchestrators[i].balance_ETH, State.ETH_THRESHOLD, State.orchestrators[i].target_address_ETH), 2)
             Contract.doSendFees(i)
             Contract.checkEthBalance(i)
 
-        # Lastly: check if we need to call reward
-        
-        # We can continue immediately if the latest round has not changed
-        if State.orchestrators[i].previous_reward_round >= State.current_round_num:
-            Util.log("Done for '{0}' as they have already called reward this round".format(State.orchestrators[i].source_address), 3)
-            continue
 
-        # Refresh Orch reward round
-        if current_time < State.orchestrators[i].previous_round_refresh + State.WAIT_TIME_ROUND_REFRESH:
-            Util.log("(cached) {0}'s last reward round is {1}. Refreshing in {2:.0f} seconds...".format(State.orchestrators[i].source_address, State.orchestrators[i].previous_reward_round, State.WAIT_TIME_ROUND_REFRESH - (current_time - State.orchestrators[i].previous_round_refresh)), 3)
-        else:
-            Contract.refreshRewardRound(i)
+# Profile a full scan for governance proposals and polls, which also warms up the data for the menus
+if args.profile == "governance" and not Workers.isWorker():
+    Profiler.start()
+    Prefetch.refresh()
+    Profiler.write("governance")
 
-        # Call reward
-        if State.orchestrators[i].previous_reward_round < State.current_round_num:
-            Util.log("Calling reward for {0}...".format(State.orchestrators[i].source_address), 2)
-            Contract.doCallReward(i)
-            Contract.refreshRewardRound(i)
-            Contract.refreshStake(i)
-        else:
-            Util.log("{0} has already called reward in round {1}".format(State.orchestrators[i].source_address, State.current_round_num), 3)
+# Let clients started with `--attach` talk to us while we keep siphoning
+# Get new blocks and round changes pushed to us, if a WebSocket endpoint is configured
+# With workers, only the coordinator does either
+if not Workers.isWorker():
+    Control.startServer()
+    Contract.startStream()
+
+"""
+@brief Refreshes the round state once it expired and shares it with all workers
+"""
+def refreshSharedRound():
+    now = datetime.now(timezone.utc).timestamp()
+    if now >= State.previous_round_refresh + State.WAIT_TIME_ROUND_REFRESH or now >= State.next_round_eta:
+        Contract.refreshRound()
+        Contract.refreshLock()
+        Workers.publishRound()
+
+"""
+@brief Keeps the round state of all workers up to date from a background thread until stopped
+Used while the interactive menus block the coordinator, as the workers keep siphoning in the meantime
+"""
+def keepRound(stop):
+    while not stop.wait(min(10, State.WAIT_TIME_IDLE)):
+        refreshSharedRound()
+        Checkpoint.loadFleet()
+
+"""
+@brief Main loop of the coordinator: keeps the round state of all workers up to date
+Also runs the interactive menus and control socket for the whole fleet, from the state the workers checkpoint
+"""
+def coordinate():
+    while True:
+        Workers.checkWorkers()
+        Checkpoint.loadFleet()
+        if State.require_user_input:
+            stop = threading.Event()
+            keeper = threading.Thread(target=keepRound, args=(stop,), daemon=True)
+            keeper.start()
+            try:
+                User.handleUserInput()
+            finally:
+                stop.set()
+                keeper.join()
+            continue
+        refreshSharedRound()
+        # Keep governance data warm for the interactive menus
+        Prefetch.refreshInBackground()
+        # Wakes up early if we are subscribed over WebSocket and a new round starts
+        Stream.waitForRound(min(10, State.WAIT_TIME_IDLE))
 
+if coordinating:
+    coordinate()
 
 # Now we have everything set up, endlessly loop
 while True:
@@ -194,7 +316,24 @@ while True:
         User.handleUserInput()
     else:
         # Main logic of refreshing cached variables and calling contract functions
-        refreshState()
+        with State.tx_lock:
+            # All reads of this cycle see the chain as of a single block
+            Contract.pinBlock()
+            if profile_cycles:
+                Profiler.start()
+            try:
+                refreshState()
+            finally:
+                Contract.unpinBlock()
+            Checkpoint.save()
+            if profile_cycles:
+                Profiler.stop()
+                profile_cycles -= 1
+                if not profile_cycles:
+                    Profiler.write("cycles" if State.worker_id is None else "cycles_worker{0}".format(State.worker_id))
+        # Keep governance data warm for the interactive menus
+        if not Workers.isWorker():
+            Prefetch.refreshInBackground()
         # Sleep WAIT_TIME_IDLE seconds until next refresh 
         delay = State.WAIT_TIME_IDLE
         while delay > 0:
@@ -202,9 +341,13 @@ while True:
             if State.require_user_input:
                 break
             Util.log("Sleeping for 10 seconds ({0} idle time left)".format(delay), 3)
-            if (delay > 10):
-                delay = delay - 10
-                time.sleep(10)
+            # Wakes up early if we are subscribed over WebSocket and a new round starts,
+            # or as a worker once the coordinator saw a new round
+            wait = min(delay, 10)
+            delay = delay - wait
+            if Workers.isWorker():
+                new_round = Workers.waitForRound(wait)
             else:
-                time.sleep(delay)
-                delay = 0
\ No newline at end of file
+                new_round = Stream.waitForRound(wait)
+            if new_round:
+                break
\ No newline at end of file
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmarks decoding ProposalCreated logs: web3's generic event decoding vs the raw decoder in lib/Events.py
+Runs offline on synthetic logs shaped like real treasury proposals (long markdown body, a few calls).
+Usage: python3 benchmarks/bench_decoders.py [number of logs]
+"""
+import os
+import sys
+import time
+# Make `lib` importable when running from the benchmarks folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import web3
+from eth_abi import encode
+from lib import Events, State
+
+
+def makeLog(proposal_id, calls=4, body_size=8000):
+    """Builds a raw eth_getLogs entry for a ProposalCreated event."""
+    description = "# LIP-{0}: Treasury request\n".format(proposal_id) + ("Lorem ipsum dolor sit amet. " * (body_size // 28))
+    data = encode(Events.PROPOSAL_CREATED_TYPES, [
+        proposal_id,
+        "0x" + "ab" * 20,
+        ["0x" + "{0:02x}".format(i) * 20 for i in range(calls)],
+        [0] * calls,
+        [""] * calls,
+        [os.urandom(1024) for _ in range(calls)],
+        3000 + proposal_id,
+        3010 + proposal_id,
+        description
+    ])
+    return {
+        "address": "0xcFE4E2879B786C3aa075813F0E364bb5acCb6aa0",
+        "topics": [web3.Web3.to_bytes(hexstr=Events.PROPOSAL_CREATED_TOPIC)],
+        "data": data,
+        "blockNumber": 1000 + proposal_id,
+        "transactionHash": os.urandom(32),
+        "transactionIndex": 0,
+        "blockHash": os.urandom(32),
+        "logIndex": 0,
+        "removed": False
+    }
+
+
+def timeIt(label, fn, logs):
+    start = time.perf_counter()
+    out = [fn(log) for log in logs]
+    elapsed = time.perf_counter() - start
+    print("{0:<28} {1:>8.3f}s {2:>10.1f} logs/s {3:>8.1f} us/log".format(label, elapsed, len(logs) / elapsed, elapsed / len(logs) * 1e6))
+    return out
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with open(os.path.join(State.SIPHON_ROOT, "contracts", "LivepeerGovernor.json")) as f:
+        abi = json.load(f)["abi"]
+    event = web3.Web3().eth.contract(address="0xcFE4E2879B786C3aa075813F0E364bb5acCb6aa0", abi=abi).events.ProposalCreated()
+    logs = [makeLog(i) for i in range(count)]
+
+    # Sanity check: both paths agree on every field we use
+    full = web3.datastructures.AttributeDict.recursive(event.process_log(logs[1]))
+    fast = Events.ProposalCreatedLog(logs[1])
+    assert fast.proposalId == full.args.proposalId and fast.proposer == full.args.proposer
+    assert fast.voteStart == full.args.voteStart and fast.voteEnd == full.args.voteEnd
+    assert fast.targets == list(full.args.targets)
+    assert fast.title == full.args.description.split("\n")[0]
+    assert fast.args.description == full.args.description
+
+    print("Decoding {0} ProposalCreated logs".format(count))
+    timeIt("web3 process_log", lambda log: event.process_log(log)["args"]["description"].split("\n")[0], logs)
+
+    def fastFields(log):
+        proposal = Events.ProposalCreatedLog(log)
+        return (proposal.proposalId, proposal.proposer, proposal.voteStart, proposal.voteEnd, proposal.title)
+    timeIt("raw decoder (used fields)", fastFields, logs)
+    timeIt("raw decoder + lazy args", lambda log: Events.ProposalCreatedLog(log).args, logs)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the threshold and cache expiry checks of one refreshState() pass for a large fleet:
+a loop over per-Orchestrator attribute bags (how the siphon used to work) vs the columnar lib/Fleet.py.
+Runs offline on random balances, with numpy if it is installed.
+Usage: python3 benchmarks/bench_fleet.py [number of Orchestrators]
+"""
+import os
+import sys
+import time
+import random
+from decimal import Decimal
+# Make `lib` importable when running from the benchmarks folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib import Fleet, State
+
+
+class AttributeBag:
+    """The per-Orchestrator attributes as they used to be stored."""
+    pass
+
+
+def loopChecks(orchs, now, current_round):
+    """Same selections as refreshState(), one Orchestrator at a time."""
+    lpt_refresh, lpt_action, eth_refresh, eth_withdraw, eth_send, reward = [], [], [], [], [], []
+    for i, orch in enumerate(orchs):
+        if now >= orch.previous_LPT_refresh + State.WAIT_TIME_LPT_REFRESH:
+            lpt_refresh.append(i)
+        if orch.balance_LPT_pending >= State.LPT_THRESHOLD:
+            lpt_action.append(i)
+        if now >= orch.previous_ETH_refresh + State.WAIT_TIME_ETH_REFRESH:
+            eth_refresh.append(i)
+        if orch.balance_ETH_pending >= State.ETH_THRESHOLD:
+            eth_withdraw.append(i)
+        if orch.balance_ETH >= State.ETH_THRESHOLD:
+            eth_send.append(i)
+        if orch.previous_reward_round < current_round:
+            reward.append(i)
+    return lpt_refresh, lpt_action, eth_refresh, eth_withdraw, eth_send, reward
+
+
+def fleetChecks(fleet, now, current_round):
+    """Same selections, as masks over the fleet columns."""
+    return (
+        fleet.expired("previous_LPT_refresh", State.WAIT_TIME_LPT_REFRESH, now),
+        fleet.where("balance_LPT_pending", ">=", State.LPT_THRESHOLD),
+        fleet.expired("previous_ETH_refresh", State.WAIT_TIME_ETH_REFRESH, now),
+        fleet.where("balance_ETH_pending", ">=", State.ETH_THRESHOLD),
+        fleet.where("balance_ETH", ">=", State.ETH_THRESHOLD),
+        fleet.where("previous_reward_round", "<", current_round)
+    )
+
+
+def timeIt(label, fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print("{0:<34} {1:>9.3f} ms per pass".format(label, elapsed * 1000))
+    return result
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = 20
+    now = time.time()
+    current_round = 4000
+    random.seed(1)
+    orchs = []
+    fleet = Fleet.FleetState()
+    for _ in range(count):
+        values = {
+            "previous_LPT_refresh": now - random.uniform(0, 2 * State.WAIT_TIME_LPT_REFRESH),
+            "balance_LPT_pending": Decimal(random.uniform(0, 2 * State.LPT_THRESHOLD)),
+            "previous_ETH_refresh": now - random.uniform(0, 2 * State.WAIT_TIME_ETH_REFRESH),
+            "balance_ETH_pending": Decimal(random.uniform(0, 2 * State.ETH_THRESHOLD)),
+            "balance_ETH": Decimal(random.uniform(0, 2 * State.ETH_THRESHOLD)),
+            "previous_round_refresh": now,
+            "previous_reward_round": current_round - random.randint(0, 1)
+        }
+        orch = AttributeBag()
+        idx = fleet.add()
+        for name, value in values.items():
+            setattr(orch, name, value)
+            fleet.set(name, idx, value)
+        orchs.append(orch)
+
+    print("Selecting Orchestrators needing action out of {0} ({1})".format(count, "numpy" if Fleet.numpy is not None else "no numpy, plain arrays"))
+    expected = timeIt("attribute bags, per-Orch loop", lambda: loopChecks(orchs, now, current_round), repeat)
+    result = timeIt("columnar fleet state", lambda: fleetChecks(fleet, now, current_round), repeat)
+    assert [list(x) for x in expected] == [list(x) for x in result], "Both paths should select the same Orchestrators"
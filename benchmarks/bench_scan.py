@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the adaptive chunked eth_getLogs scan (iterChunks + ScanTuner) against a local mock RPC provider.
+The mock can emulate what real providers do: reject too large block ranges, answer 429 after too many
+requests per second, time out at random and return more or fewer logs per block.
+Every scenario scans the same window from scratch and reports blocks/s, requests, failures and wall time,
+so changes to the chunking strategy can be compared directly.
+Usage: python3 benchmarks/bench_scan.py [--blocks 5000000] [--scenario NAME ...]
+       python3 benchmarks/bench_scan.py --max-range 10000 --rate 25 --timeouts 0.01 --density 0.001
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+# Make `lib` importable when running from the benchmarks folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Provider behaviours: largest accepted block range, requests per second before 429s,
+# share of requests which time out and logs per block
+SCENARIOS = {
+    "unlimited": {"max_range": None, "rate": None, "timeouts": 0, "density": 0.0005},
+    "range-10k": {"max_range": 10000, "rate": None, "timeouts": 0, "density": 0.0005},
+    "rate-25": {"max_range": 100000, "rate": 25, "timeouts": 0, "density": 0.0005},
+    "flaky": {"max_range": 100000, "rate": None, "timeouts": 0.02, "density": 0.0005},
+    "dense": {"max_range": 50000, "rate": None, "timeouts": 0, "density": 0.01},
+    "public-rpc": {"max_range": 10000, "rate": 25, "timeouts": 0.005, "density": 0.0005}
+}
+LOG_ADDRESS = "0xdd6f56DcC28D3F5f27084381fE8Df634985cc39f"
+LOG_TOPIC = "0x" + "11" * 32
+
+
+class MockProvider:
+    """Behaviour and counters of the mock eth_getLogs server."""
+    def __init__(self, max_range=None, rate=None, timeouts=0, density=0.0005, seed=1):
+        self.max_range = max_range
+        self.rate = rate
+        self.timeouts = timeouts
+        # Logs are spread evenly, one every `stride` blocks
+        self.stride = max(1, round(1 / density)) if density > 0 else None
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = []  # Timestamps of requests within the last second
+        self.counts = {"http_requests": 0, "range_errors": 0, "rate_limited": 0, "timeouts": 0, "logs": 0}
+
+    def makeLogs(self, start, end):
+        if self.stride is None:
+            return []
+        first = -(-start // self.stride) * self.stride
+        return [{
+            "address": LOG_ADDRESS,
+            "topics": [LOG_TOPIC],
+            "data": "0x",
+            "blockNumber": hex(block),
+            "blockHash": "0x" + "{0:064x}".format(block),
+            "transactionHash": "0x" + "{0:064x}".format(block + 1),
+            "transactionIndex": "0x0",
+            "logIndex": "0x0",
+            "removed": False
+        } for block in range(first, end + 1, self.stride)]
+
+    def handle(self, request):
+        """Returns (HTTP status, JSON-RPC response or None)."""
+        with self.lock:
+            self.counts["http_requests"] += 1
+            now = time.monotonic()
+            self.recent = [t for t in self.recent if t > now - 1] + [now]
+            if self.rate and len(self.recent) > self.rate:
+                self.counts["rate_limited"] += 1
+                return 429, None
+            if self.timeouts and self.random.random() < self.timeouts:
+                self.counts["timeouts"] += 1
+                return 504, None
+        method = request["method"]
+        constants = {"web3_clientVersion": "bench_scan", "eth_chainId": "0xa4b1", "eth_blockNumber": hex(400000000)}
+        if method in constants:
+            return 200, {"jsonrpc": "2.0", "id": request["id"], "result": constants[method]}
+        if method != "eth_getLogs":
+            return 200, {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32601, "message": "method not found"}}
+        query = request["params"][0]
+        start, end = int(query["fromBlock"], 16), int(query["toBlock"], 16)
+        if self.max_range and end - start + 1 > self.max_range:
+            with self.lock:
+                self.counts["range_errors"] += 1
+            return 200, {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32600, "message": "exceed maximum block range: {0}".format(self.max_range)}}
+        logs = self.makeLogs(start, end)
+        with self.lock:
+            self.counts["logs"] += len(logs)
+        return 200, {"jsonrpc": "2.0", "id": request["id"], "result": logs}
+
+
+def startServer(mock):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            status, response = mock.handle(request)
+            body = json.dumps(response).encode() if response else b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def runScenario(Contract, name, behaviour, blocks):
+    """Scans `blocks` blocks against a fresh mock provider and a tuner which has not learned anything yet."""
+    mock = MockProvider(**behaviour)
+    server = startServer(mock)
+    url = "http://127.0.0.1:{0}".format(server.server_address[1])
+    w3 = Contract.web3.Web3(Contract.web3.HTTPProvider(url))
+    tuner = Contract.ScanTuner(url)
+    fetch = lambda start, end: w3.eth.get_logs({"fromBlock": start, "toBlock": end, "address": LOG_ADDRESS})
+    found = 0
+    start_time = time.perf_counter()
+    for _, _, logs in Contract.iterChunks(fetch, 1, blocks, tuner=tuner):
+        found += len(logs)
+    elapsed = time.perf_counter() - start_time
+    server.shutdown()
+    stats = tuner.stats
+    # web3 itself silently retries 429s and timeouts a few times, those only show up in the HTTP request count
+    print("\n{0:<11} {1:>7.2f}s {2:>11,.0f} blocks/s {3:>5} scan requests, {4:>5} over HTTP, {5:>4} retried ({6} range, {7} 429, {8} timeout), final chunk {9:,}, {10:,} logs".format(
+        name, elapsed, stats["blocks"] / elapsed, stats["requests"], mock.counts["http_requests"], stats["failures"],
+        mock.counts["range_errors"], mock.counts["rate_limited"], mock.counts["timeouts"], tuner.chunk_size, found))
+    if stats["skipped_blocks"]:
+        print("{0:<11} gave up on {1:,} blocks".format("", stats["skipped_blocks"]))
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=5000000, help="size of the scanned window")
+    parser.add_argument("--scenario", nargs="*", choices=sorted(SCENARIOS), help="scenarios to run, all of them by default")
+    parser.add_argument("--max-range", type=int, help="custom scenario: largest accepted block range")
+    parser.add_argument("--rate", type=int, help="custom scenario: requests per second before answering 429")
+    parser.add_argument("--timeouts", type=float, default=0, help="custom scenario: share of requests which time out")
+    parser.add_argument("--density", type=float, default=0.0005, help="custom scenario: logs per block")
+    args = parser.parse_args()
+
+    # The siphon connects to its RPC provider on import, point it to a mock as well
+    setup = MockProvider()
+    setup_server = startServer(setup)
+    os.environ["SIPHON_RPC_L2"] = "http://127.0.0.1:{0}".format(setup_server.server_address[1])
+    # Learned limits would make every run after the first start near the optimum
+    os.environ["SIPHON_DATA_DIR"] = tempfile.mkdtemp(prefix="bench_scan_")
+    os.environ.setdefault("SIPHON_VERBOSITY", "1")
+    from lib import Contract
+
+    if args.max_range or args.rate or args.timeouts:
+        scenarios = {"custom": {"max_range": args.max_range, "rate": args.rate, "timeouts": args.timeouts, "density": args.density}}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in (args.scenario or SCENARIOS)}
+    print("Scanning {0:,} blocks per scenario".format(args.blocks))
+    total = 0
+    for name, behaviour in scenarios.items():
+        total += runScenario(Contract, name, behaviour, args.blocks)
+    print("\nTotal wall time: {0:.2f}s".format(total))
@@ -0,0 +1,189 @@
+# asyncio versions of the contract reads in Contract.py which the siphon loop does for the whole fleet
+# Built on AsyncWeb3 with a single shared aiohttp session, so hundreds of reads can be in flight
+# from a single thread. A semaphore bounds the amount of concurrent requests to the RPC provider.
+# The event loop and session live as long as the process, so pooled connections get reused from cycle to cycle.
+# Reads go against the block pinned by Contract, so they see the same chain state as the rest of the cycle.
+import asyncio #< Running reads concurrently
+import atexit #< Closing the shared session on exit
+import os #< Telling whether we got forked since connecting
+import aiohttp #< Shared HTTP session and connection pool, ships with web3
+import web3 #< AsyncWeb3 and currency conversions
+from datetime import datetime, timezone #< In order to update the timer for cached variables
+# Import our own libraries
+from lib import Balances, Cassette, Contract, Planner, State, Util, Workers
+
+
+# Upper bound on concurrent requests (and pooled connections) to the RPC provider
+MAX_IN_FLIGHT = 32
+MAX_RETRIES = 3
+
+# Set up by the first run() of this process
+loop = None
+loop_pid = 0
+w3 = None
+session = None
+limit = None
+bonding_contract = None
+rounds_contract = None
+treasury_contract = None
+poll_creator_contract = None
+
+
+### Connection handling
+
+
+"""
+@brief Opens the shared aiohttp session and sets up the contracts
+"""
+async def connect():
+    global w3, session, limit, bonding_contract, rounds_contract, treasury_contract, poll_creator_contract
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=MAX_IN_FLIGHT))
+    provider = Workers.limitAsyncProvider(Cassette.getAsyncProvider(State.L2_RPC_PROVIDER))
+    await provider.cache_async_session(session)
+    w3 = web3.AsyncWeb3(provider)
+    # We only read, so there are no transactions to validate the chain ID of.
+    # Else web3 asks for the chain ID with every call, which would double our requests
+    w3.middleware_onion.remove("validation")
+    limit = asyncio.Semaphore(MAX_IN_FLIGHT)
+    bonding_contract = w3.eth.contract(address=Contract.BONDING_CONTRACT_ADDR, abi=Contract.abi_bonding_manager)
+    rounds_contract = w3.eth.contract(address=Contract.ROUNDS_CONTRACT_ADDR, abi=Contract.abi_rounds_manager)
+    treasury_contract = w3.eth.contract(address=Contract.GOVERNOR_CONTRACT_ADDR, abi=Contract.treasury_manager)
+    poll_creator_contract = w3.eth.contract(address=Contract.POLL_CREATOR_ADDR, abi=Contract.poll_creator_abi)
+
+"""
+@brief Closes the shared aiohttp session
+"""
+async def close():
+    await session.close()
+
+"""
+@brief Runs a coroutine function from synchronous code, on the event loop and session shared by all runs
+Connects on the first run. A forked worker connects again, as it can't use the connections of its parent
+@param function: one of the async functions in this file
+@return whatever the function returns
+"""
+def run(function, *args, **kwargs):
+    global loop, loop_pid
+    if loop is None or loop_pid != os.getpid():
+        loop = asyncio.new_event_loop()
+        loop_pid = os.getpid()
+        loop.run_until_complete(connect())
+    return loop.run_until_complete(function(*args, **kwargs))
+
+"""
+@brief Closes the shared session and event loop, if this process opened them
+"""
+def shutdown():
+    global loop
+    if loop is None or loop_pid != os.getpid():
+        return
+    loop.run_until_complete(close())
+    loop.close()
+    loop = None
+
+atexit.register(shutdown)
+
+"""
+@brief Calls a contract view function at the pinned block, within the in-flight limit
+"""
+async def call(function):
+    async with limit:
+        return await function.call(block_identifier=Contract.readBlock())
+
+
+### Round refresh logic
+
+
+"""
+@brief Refreshes the current round number and estimates when the next round starts
+"""
+async def refreshRound():
+    try:
+        this_round, start_block, round_length, l1_block = await asyncio.gather(
+            call(rounds_contract.functions.currentRound()),
+            call(rounds_contract.functions.currentRoundStartBlock()),
+            call(rounds_contract.functions.roundLength()),
+            call(rounds_contract.functions.blockNum())
+        )
+        State.previous_round_refresh = datetime.now(timezone.utc).timestamp()
+        Util.log("Current round number is {0}".format(this_round), 2)
+        State.current_round_num = this_round
+        blocks_left = max(0, start_block + round_length - l1_block)
+        State.next_round_eta = State.previous_round_refresh + blocks_left * Contract.L1_BLOCK_TIME
+    except Exception as e:
+        Util.log("Unable to refresh round number: {0}".format(e), 1)
+
+"""
+@brief Refreshes the current round lock status
+"""
+async def refreshLock():
+    try:
+        new_lock = await call(rounds_contract.functions.currentRoundLocked())
+        Util.log("Current round lock status is {0}".format(new_lock), 2)
+        State.current_round_is_locked = new_lock
+    except Exception as e:
+        Util.log("Unable to refresh round lock status: {0}".format(e), 1)
+
+
+### Orchestrator LPT and ETH logic
+
+
+"""
+@brief Refresh Delegator amount of LPT available for withdrawal
+@param idx: which Orch # in the set to check
+"""
+async def refreshStake(idx):
+    try:
+        pending_lptu = await call(bonding_contract.functions.pendingStake(State.orchestrators[idx].source_checksum_address, 99999))
+        pending_lpt = web3.Web3.from_wei(pending_lptu, 'ether')
+        now = datetime.now(timezone.utc).timestamp()
+        # Also keeps track of how fast stake is coming in, to know when to check again
+        Planner.recordStake(idx, pending_lpt, now)
+        Balances.record(idx, "balance_LPT_pending", now, pending_lpt)
+        Util.log("{0} currently has {1:.2f} LPT available for unstaking".format(State.orchestrators[idx].source_address, pending_lpt), 2)
+    except Exception as e:
+        Util.log("Unable to refresh stake: '{0}'".format(e), 1)
+
+"""
+@brief Refreshes pending ETH fees
+@param idx: which Orch # in the set to check
+"""
+async def refreshFees(idx):
+    try:
+        pending_wei = await call(bonding_contract.functions.pendingFees(State.orchestrators[idx].source_checksum_address, 99999))
+        pending_eth = web3.Web3.from_wei(pending_wei, 'ether')
+        now = datetime.now(timezone.utc).timestamp()
+        Planner.recordFees(idx, pending_eth, now)
+        Balances.record(idx, "balance_ETH_pending", now, pending_eth)
+        Util.log("{0} has {1:.6f} ETH in pending fees".format(State.orchestrators[idx].source_address, pending_eth), 2)
+    except Exception as e:
+        Util.log("Unable to refresh fees: '{0}'".format(e), 1)
+
+"""
+@brief Updates known ETH balance of the Orch
+@param idx: which Orch # in the set to check
+"""
+async def checkEthBalance(idx):
+    try:
+        async with limit:
+            balance_wei = await w3.eth.get_balance(State.orchestrators[idx].source_checksum_address, Contract.readBlock())
+        balance_ETH = web3.Web3.from_wei(balance_wei, 'ether')
+        State.orchestrators[idx].balance_ETH = balance_ETH
+        Balances.record(idx, "balance_ETH", datetime.now(timezone.utc).timestamp(), balance_ETH)
+        Util.log("{0} currently has {1:.4f} ETH in their wallet".format(State.orchestrators[idx].source_address, balance_ETH), 2)
+        if balance_ETH < State.ETH_WARN:
+            Util.log("{0} should top up their ETH balance ASAP!".format(State.orchestrators[idx].source_address), 1)
+    except Exception as e:
+        Util.log("Unable to get ETH balance: '{0}'".format(e), 1)
+
+"""
+@brief Refreshes the pending stake and/or fees and balance of many Orchestrators at once
+@param stake: Orch #'s to refresh the pending stake of
+@param fees: Orch #'s to refresh the pending fees and ETH balance of
+"""
+async def refreshFleet(stake=(), fees=()):
+    await asyncio.gather(
+        *[refreshStake(idx) for idx in stake],
+        *[refreshFees(idx) for idx in fees],
+        *[checkEthBalance(idx) for idx in fees]
+    )
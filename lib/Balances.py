@@ -0,0 +1,151 @@
+# Compact history of every balance we observe, per Orchestrator
+# Each Orchestrator gets a fixed size, memory-mapped file, so recording a sample is a couple of writes into memory.
+# Every series (pending stake, pending fees, wallet balance) keeps a ring of raw samples. Samples which fall out of it
+# get folded into a ring with one sample per hour, and from there into a ring with one sample per day.
+# Downsampled rings keep the last sample of each hour or day. Files never grow, no matter how long the siphon runs.
+# Layout: header of MAGIC followed by one uint64 count of written records per ring,
+#         then all rings in SERIES x TIERS order, each a list of (timestamp, value) doubles
+import mmap #< Mapping the files into memory
+import os #< Creating the files
+import struct #< Packing headers and records
+import threading #< Reads can come from the control socket while the siphon loop writes
+# Import our own libraries
+from lib import State, Util
+
+
+BALANCES_FOLDER = "balances"
+MAGIC = b"SIPHBAL1"
+SERIES = ["balance_LPT_pending", "balance_ETH_pending", "balance_ETH"]
+# (seconds per sample, samples kept): raw samples, then one per hour for a month, then one per day for five years
+TIERS = [(0, 1024), (3600, 24 * 31), (86400, 365 * 5)]
+RECORD = struct.Struct("<dd")
+HEADER = struct.Struct("<8s{0}Q".format(len(SERIES) * len(TIERS)))
+FILE_SIZE = HEADER.size + len(SERIES) * sum(capacity for _, capacity in TIERS) * RECORD.size
+
+lock = threading.Lock()
+stores = {}  # Checksum address -> BalanceStore
+
+
+class BalanceStore:
+    """
+    Memory-mapped rings of balance samples of a single Orchestrator.
+    Samples have to come in chronological order per series, which they do as we only ever record the present.
+    """
+    def __init__(self, path):
+        fresh = not os.path.exists(path) or os.path.getsize(path) != FILE_SIZE
+        if fresh and os.path.exists(path):
+            Util.log("Balance history {0} has an unknown layout, starting over".format(path), 1)
+        with open(path, "w+b" if fresh else "r+b") as file:
+            if fresh:
+                file.truncate(FILE_SIZE)
+            self.map = mmap.mmap(file.fileno(), FILE_SIZE)
+        if HEADER.unpack_from(self.map, 0)[0] != MAGIC:
+            HEADER.pack_into(self.map, 0, MAGIC, *[0] * (HEADER.size // 8 - 1))
+        self.readCounts()
+        # Offset of the first record of each ring
+        self.offsets = []
+        offset = HEADER.size
+        for _ in SERIES:
+            for _, capacity in TIERS:
+                self.offsets.append(offset)
+                offset += capacity * RECORD.size
+
+    def readCounts(self):
+        """Reads the record counts from the header, which another process may have written to since."""
+        self.counts = list(HEADER.unpack_from(self.map, 0)[1:])
+
+    def ring(self, series, tier):
+        return SERIES.index(series) * len(TIERS) + tier
+
+    def setCount(self, ring, count):
+        self.counts[ring] = count
+        struct.pack_into("<Q", self.map, len(MAGIC) + ring * 8, count)
+
+    def recordAt(self, ring, tier, position):
+        """Returns the record with the given absolute position in a ring."""
+        return RECORD.unpack_from(self.map, self.offsets[ring] + (position % TIERS[tier][1]) * RECORD.size)
+
+    def append(self, series, tier, timestamp, value):
+        """Appends a record to a ring, folding the record it overwrites into the next tier."""
+        ring = self.ring(series, tier)
+        count = self.counts[ring]
+        capacity = TIERS[tier][1]
+        if count >= capacity and tier + 1 < len(TIERS):
+            self.fold(series, tier + 1, *self.recordAt(ring, tier, count - capacity))
+        RECORD.pack_into(self.map, self.offsets[ring] + (count % capacity) * RECORD.size, timestamp, value)
+        self.setCount(ring, count + 1)
+
+    def fold(self, series, tier, timestamp, value):
+        """Adds a record to a downsampled ring, replacing its latest record if that falls in the same bucket."""
+        ring = self.ring(series, tier)
+        count = self.counts[ring]
+        resolution = TIERS[tier][0]
+        if count and self.recordAt(ring, tier, count - 1)[0] // resolution == timestamp // resolution:
+            RECORD.pack_into(self.map, self.offsets[ring] + ((count - 1) % TIERS[tier][1]) * RECORD.size, timestamp, value)
+            return
+        self.append(series, tier, timestamp, value)
+
+    def record(self, series, timestamp, value):
+        self.append(series, 0, timestamp, value)
+
+    def query(self, series, start, end):
+        """Returns all (timestamp, value) samples from `start` up to and including `end`, oldest first."""
+        # With workers, the samples get recorded by a worker while the coordinator answers queries
+        self.readCounts()
+        samples = []
+        # Coarser tiers hold the older samples
+        for tier in reversed(range(len(TIERS))):
+            ring = self.ring(series, tier)
+            count = self.counts[ring]
+            capacity = TIERS[tier][1]
+            kept = min(count, capacity)
+            if not kept:
+                continue
+            # Skip the ring entirely if it does not overlap the range
+            if self.recordAt(ring, tier, count - 1)[0] < start or self.recordAt(ring, tier, count - kept)[0] > end:
+                continue
+            values = memoryview(self.map)[self.offsets[ring]:self.offsets[ring] + capacity * RECORD.size].cast('d')
+            head = count % capacity if count > capacity else 0
+            records = list(zip(values[0::2].tolist(), values[1::2].tolist()))[:kept]
+            values.release()
+            samples.extend(sample for sample in records[head:] + records[:head] if start <= sample[0] <= end)
+        return samples
+
+    def close(self):
+        self.map.close()
+
+
+"""
+@brief Returns the balance history of an Orchestrator, opening its file if it isn't already
+"""
+def getStore(address):
+    store = stores.get(address)
+    if store is None:
+        folder = Util.getDataPath(BALANCES_FOLDER)
+        os.makedirs(folder, exist_ok=True)
+        store = BalanceStore(os.path.join(folder, address + ".bin"))
+        stores[address] = store
+    return store
+
+"""
+@brief Records an observed balance of an Orchestrator
+@param idx: which Orch # in the set was observed
+@param series: one of SERIES
+"""
+def record(idx, series, timestamp, value):
+    try:
+        with lock:
+            getStore(State.orchestrators[idx].source_checksum_address).record(series, timestamp, float(value))
+    except Exception as e:
+        Util.log("Unable to record {0} history: {1}".format(series, e), 1)
+
+"""
+@brief Returns the recorded history of a balance of an Orchestrator
+Samples older than the raw ring are downsampled to the last sample of each hour, then of each day
+@param address: checksum address of the Orchestrator
+@param series: one of SERIES
+@return list of (timestamp, value), oldest first
+"""
+def query(address, series, start, end):
+    with lock:
+        return getStore(address).query(series, start, end)
@@ -0,0 +1,181 @@
+# Records JSON-RPC traffic to a cassette file and replays it later without network access
+# In record mode every request and response passing through the RPC provider gets appended to the cassette,
+# together with how long the provider took to answer. In replay mode the same requests get answered from the
+# cassette, instantly or with the recorded timings scaled by a factor. This makes scans and siphon cycles
+# reproducible, so they can be profiled and regression tested offline.
+# Cassettes are JSON lines, gzip compressed if the file name ends in `.gz`:
+#   {"t": seconds taken, "q": [[method, params, response], ...]}
+import json #< Encoding requests and responses
+import gzip #< Compressing cassettes
+import time #< Recording and replaying timings
+import asyncio #< Replaying timings of async requests
+import threading #< Guarding the cassette file
+import collections #< Queues of recorded responses
+import web3 #< Providers to wrap
+# Import our own libraries
+from lib import State, Util
+
+
+lock = threading.Lock()
+recorded = None  # Replay mode: request key -> deque of responses in recorded order
+
+
+"""
+@brief Returns whether RPC traffic goes through a cassette
+"""
+def active():
+    return bool(State.CASSETTE)
+
+"""
+@brief Opens the cassette file, compressed if its name ends in .gz
+"""
+def openCassette(mode):
+    if State.CASSETTE.endswith(".gz"):
+        return gzip.open(State.CASSETTE, mode + "t")
+    return open(State.CASSETTE, mode)
+
+"""
+@brief Identifies a request by its method and parameters, so the JSON-RPC id does not matter
+"""
+def requestKey(request):
+    return request["method"] + json.dumps(request["params"], sort_keys=True, separators=(',', ':'))
+
+"""
+@brief Appends an exchange of one or more requests to the cassette
+@param requests: encoded JSON-RPC requests
+@param responses: decoded JSON-RPC responses, in the same order
+"""
+def record(requests, responses, elapsed):
+    exchange = [
+        [request["method"], request["params"], {key: value for key, value in response.items() if key in ("result", "error")}]
+        for request, response in zip(requests, responses)
+    ]
+    with lock:
+        with openCassette("a") as file:
+            file.write(json.dumps({"t": round(elapsed, 4), "q": exchange}, separators=(',', ':')) + "\n")
+
+"""
+@brief Loads all recorded responses, keyed by request
+"""
+def loadCassette():
+    global recorded
+    with lock:
+        if recorded is not None:
+            return recorded
+        recorded = collections.defaultdict(collections.deque)
+        with openCassette("r") as file:
+            for line in file:
+                exchange = json.loads(line)
+                for method, params, response in exchange["q"]:
+                    recorded[requestKey({"method": method, "params": params})].append((response, exchange["t"]))
+        Util.log("Replaying {0} distinct RPC requests from {1}".format(len(recorded), State.CASSETTE), 2)
+        return recorded
+
+"""
+@brief Answers requests from the cassette
+Identical requests get the responses in the order they were recorded, the last one repeats once they run out
+@return responses with the ids of the given requests, and the time the recorded exchange took
+"""
+def replay(requests):
+    loadCassette()
+    responses = []
+    elapsed = 0
+    with lock:
+        for request in requests:
+            queue = recorded.get(requestKey(request))
+            if not queue:
+                responses.append({"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32000, "message": "Request is not in the cassette: {0}".format(request["method"])}})
+                continue
+            response, elapsed = queue.popleft() if len(queue) > 1 else queue[0]
+            responses.append(dict(response, jsonrpc="2.0", id=request["id"]))
+    return responses, elapsed * State.CASSETTE_TIMING
+
+
+class CassetteHTTPProvider(web3.HTTPProvider):
+    """HTTPProvider which records to or replays from the configured cassette."""
+    def is_connected(self, show_traceback=False):
+        if State.CASSETTE_MODE == "replay":
+            return True
+        return super().is_connected(show_traceback)
+
+    def make_request(self, method, params):
+        request = json.loads(self.encode_rpc_request(method, params))
+        if State.CASSETTE_MODE == "replay":
+            responses, elapsed = replay([request])
+            time.sleep(elapsed)
+            return responses[0]
+        start = time.monotonic()
+        response = super().make_request(method, params)
+        record([request], [response], time.monotonic() - start)
+        return response
+
+    def make_batch_request(self, batch_requests):
+        requests = json.loads(self.encode_batch_rpc_request(batch_requests))
+        if State.CASSETTE_MODE == "replay":
+            responses, elapsed = replay(requests)
+            time.sleep(elapsed)
+            return responses
+        start = time.monotonic()
+        responses = super().make_batch_request(batch_requests)
+        # A rejected batch comes back as a single error, which we don't record
+        if isinstance(responses, list):
+            record(requests, responses, time.monotonic() - start)
+        return responses
+
+
+class CassetteAsyncHTTPProvider(web3.AsyncHTTPProvider):
+    """AsyncHTTPProvider which records to or replays from the configured cassette."""
+    async def is_connected(self, show_traceback=False):
+        if State.CASSETTE_MODE == "replay":
+            return True
+        return await super().is_connected(show_traceback)
+
+    async def make_request(self, method, params):
+        request = json.loads(self.encode_rpc_request(method, params))
+        if State.CASSETTE_MODE == "replay":
+            responses, elapsed = replay([request])
+            await asyncio.sleep(elapsed)
+            return responses[0]
+        start = time.monotonic()
+        response = await super().make_request(method, params)
+        record([request], [response], time.monotonic() - start)
+        return response
+
+    async def make_batch_request(self, batch_requests):
+        requests = json.loads(self.encode_batch_rpc_request(batch_requests))
+        if State.CASSETTE_MODE == "replay":
+            responses, elapsed = replay(requests)
+            await asyncio.sleep(elapsed)
+            return responses
+        start = time.monotonic()
+        responses = await super().make_batch_request(batch_requests)
+        if isinstance(responses, list):
+            record(requests, responses, time.monotonic() - start)
+        return responses
+
+
+"""
+@brief Logs whether RPC traffic gets recorded or replayed
+Called by the entry point: providers get created while Util is still being imported, so they can't log yet
+"""
+def announce():
+    if not active():
+        return
+    Util.log("{0} RPC traffic {1} cassette {2}".format("Replaying" if State.CASSETTE_MODE == "replay" else "Recording",
+        "from" if State.CASSETTE_MODE == "replay" else "to", State.CASSETTE), 2)
+
+"""
+@brief Returns the HTTP provider to use, recording or replaying if a cassette is configured
+"""
+def getProvider(url):
+    if not active():
+        return web3.HTTPProvider(url)
+    return CassetteHTTPProvider(url)
+
+"""
+@brief Returns the async HTTP provider to use, recording or replaying if a cassette is configured
+"""
+def getAsyncProvider(url):
+    if not active():
+        return web3.AsyncHTTPProvider(url)
+    return CassetteAsyncHTTPProvider(url)
@@ -0,0 +1,117 @@
+# Checkpoints cached Orchestrator and round state to disk
+# After a restart, anything which is still within its cache time does not need to be queried again,
+# so restarts and deploys no longer cause a burst of RPC calls for every Orchestrator at once
+# With workers, each of them checkpoints its own share of the fleet to a file of its own
+from datetime import datetime, timezone #< Checking which cached values are still fresh
+import glob #< Finding the checkpoints of all workers
+import os #< Telling which checkpoint is the newest
+# Import our own libraries
+from lib import Fleet, State, Util
+
+
+CHECKPOINT_FILE = "siphon_state.json"
+WORKER_CHECKPOINT_FILE = "siphon_state_worker{0}.json"
+# Cached values per Orchestrator, grouped by the timestamp which expires them
+CACHED_GROUPS = [
+    ("previous_LPT_refresh", "WAIT_TIME_LPT_REFRESH", ["balance_LPT_pending", "next_LPT_refresh"]),
+    ("previous_ETH_refresh", "WAIT_TIME_ETH_REFRESH", ["balance_ETH_pending", "balance_ETH", "next_ETH_refresh"]),
+    ("previous_round_refresh", "WAIT_TIME_ROUND_REFRESH", [])
+]
+# Values which stay valid no matter how old they are:
+# the last reward round only ever goes up and the accrual rates are long running averages
+KEPT_COLUMNS = ["previous_reward_round", "rate_LPT_pending", "rate_ETH_pending"]
+KEPT_FIELDS = ["reward_gas_used"]
+
+
+"""
+@brief Returns the path of the checkpoint of this process
+"""
+def getCheckpointPath():
+    if State.worker_id is None:
+        return Util.getDataPath(CHECKPOINT_FILE)
+    return Util.getDataPath(WORKER_CHECKPOINT_FILE.format(State.worker_id))
+
+"""
+@brief Reads the checkpoints of a single process and of all workers into one
+Where an Orchestrator or the round shows up in more than one, the most recently written one wins
+"""
+def readCheckpoints():
+    paths = [Util.getDataPath(CHECKPOINT_FILE)] + glob.glob(Util.getDataPath(WORKER_CHECKPOINT_FILE.format("*")))
+    merged = {}
+    for path in sorted(filter(os.path.exists, paths), key=os.path.getmtime):
+        checkpoint = Util.readJson(path, {})
+        if checkpoint.get("round"):
+            merged["round"] = checkpoint["round"]
+        merged.setdefault("orchestrators", {}).update(checkpoint.get("orchestrators", {}))
+    return merged
+
+"""
+@brief Writes the current round and Orchestrator state to disk
+"""
+def save():
+    orchestrators = {}
+    for orch in State.orchestrators:
+        entry = {name: State.fleet.get(name, orch.fleet_idx) for name in Fleet.COLUMNS}
+        for name in KEPT_FIELDS:
+            entry[name] = getattr(orch, name)
+        orchestrators[orch.source_checksum_address] = entry
+    Util.writeJsonAtomic(getCheckpointPath(), {
+        "round": {
+            "current_round_num": State.current_round_num,
+            "current_round_is_locked": State.current_round_is_locked,
+            "previous_round_refresh": State.previous_round_refresh,
+            "next_round_eta": State.next_round_eta
+        },
+        "orchestrators": orchestrators
+    })
+
+"""
+@brief Restores state from the previous run, for as far as it has not expired yet
+Should be called once all Orchestrators have been added
+"""
+def restore():
+    checkpoint = readCheckpoints()
+    if not checkpoint:
+        return
+    now = datetime.now(timezone.utc).timestamp()
+    # Round state
+    saved_round = checkpoint.get("round", {})
+    if now < saved_round.get("previous_round_refresh", 0) + State.WAIT_TIME_ROUND_REFRESH and now < saved_round.get("next_round_eta", 0):
+        State.current_round_num = saved_round["current_round_num"]
+        State.current_round_is_locked = saved_round["current_round_is_locked"]
+        State.previous_round_refresh = saved_round["previous_round_refresh"]
+        State.next_round_eta = saved_round["next_round_eta"]
+        Util.log("Restored round {0} from the previous run".format(State.current_round_num), 2)
+    # Orchestrator state
+    restored = 0
+    for orch in State.orchestrators:
+        entry = checkpoint.get("orchestrators", {}).get(orch.source_checksum_address)
+        if entry is None:
+            continue
+        for name in KEPT_COLUMNS:
+            State.fleet.set(name, orch.fleet_idx, entry.get(name, 0))
+        for name in KEPT_FIELDS:
+            setattr(orch, name, entry.get(name, getattr(orch, name)))
+        for time_column, ttl_name, columns in CACHED_GROUPS:
+            if now >= entry.get(time_column, 0) + getattr(State, ttl_name):
+                continue
+            for name in [time_column] + columns:
+                State.fleet.set(name, orch.fleet_idx, entry.get(name, 0))
+            restored += 1
+    if restored:
+        Util.log("Restored {0} cached value(s) of {1} Orchestrator(s) from the previous run".format(restored, len(State.orchestrators)), 2)
+
+"""
+@brief Takes over the latest Orchestrator state which the workers checkpointed
+Used by the coordinator, whose own copy of the fleet stops being updated once the workers take over
+"""
+def loadFleet():
+    orchestrators = readCheckpoints().get("orchestrators", {})
+    for orch in State.orchestrators:
+        entry = orchestrators.get(orch.source_checksum_address)
+        if entry is None:
+            continue
+        for name in Fleet.COLUMNS:
+            State.fleet.set(name, orch.fleet_idx, entry.get(name, State.fleet.get(name, orch.fleet_idx)))
+        for name in KEPT_FIELDS:
+            setattr(orch, name, entry.get(name, getattr(orch, name)))
@@ -6,8 +6,12 @@ import sys #< To exit the program
 import json #< Parse JSON ABI file
 import re #< Parse proposal description
 import time #< For rate limiting in chunked queries
+import hashlib #< Keying learned RPC limits without storing the (secret) RPC URL
+import collections #< LRU cache of contract reads
+from urllib.parse import urlparse #< Readable provider name for learned RPC limits
+from eth_utils.abi import get_abi_output_types #< Decoding raw eth_call results
 # Import our own libraries
-from lib import Util, State
+from lib import Util, State, Events, Stream, Cassette, Workers, Planner, Balances
 
 
 BONDING_CONTRACT_ADDR = '0x35Bcf3c30594191d53231E4FF333E8A770453e40'
@@ -36,6 +40,38 @@ PROPOSAL_STATE_NAMES = {
     7: "Executed"
 }
 
+# Fee parameters used for all transactions
+MAX_FEE_PER_GAS = 2000000000
+MAX_PRIORITY_FEE_PER_GAS = 1000000000
+ARBITRUM_CHAIN_ID = 42161
+# Gas limit for pre-signed reward calls until we have seen an actual reward receipt
+REWARD_GAS_LIMIT = 1000000
+L1_BLOCK_TIME = 12  # Rounds are measured in L1 blocks (~12s each)
+# Amount of contract reads to remember, keyed by (block, contract, calldata)
+READ_CACHE_SIZE = 1024
+# How long to wait for a transaction to get mined
+RECEIPT_TIMEOUT = 120
+RECEIPT_POLL_INTERVAL = 0.25  # Arbitrum produces a block every ~0.25s
+# Fees of a stuck transaction get multiplied by this each time it gets replaced
+FEE_BUMP = 1.25
+REPLACEMENTS_FILE = "replaced_transactions.json"
+MAX_RECORDED_REPLACEMENTS = 100
+# Most calls to put in a single batched request
+READ_BATCH_SIZE = 100
+POOL_FILE = "transcoder_pool.json"  # Order of the pool as of the last snapshot, to batch the walk after a restart
+EMPTY_ADDRESS = "0x0000000000000000000000000000000000000000"
+# BondingManager events of our Orchestrators which confirm their transactions over WebSocket
+STREAMED_EVENTS = ["Reward", "WithdrawFees", "TransferBond"]
+
+# States which can only be reached once the voting period is over
+PROPOSAL_STATES_ENDED = (
+    PROPOSAL_STATE_DEFEATED,
+    PROPOSAL_STATE_SUCCEEDED,
+    PROPOSAL_STATE_QUEUED,
+    PROPOSAL_STATE_EXPIRED,
+    PROPOSAL_STATE_EXECUTED
+)
+
 
 ### Define contracts
 
@@ -58,8 +94,8 @@ abi_rounds_manager = getABI(State.SIPHON_ROOT + "/contracts/RoundsManager.json")
 treasury_manager = getABI(State.SIPHON_ROOT + "/contracts/LivepeerGovernor.json")
 poll_creator_abi = getABI(State.SIPHON_ROOT + "/contracts/PollCreator.json")
 poll_abi = getABI(State.SIPHON_ROOT + "/contracts/Poll.json")
-# connect to L2 rpc provider
-provider = web3.HTTPProvider(State.L2_RPC_PROVIDER)
+# connect to L2 rpc provider, through a cassette if configured and within the shared RPC budget
+provider = Workers.limitProvider(Cassette.getProvider(State.L2_RPC_PROVIDER))
 w3 = web3.Web3(provider)
 assert w3.is_connected()
 # prepare contracts
@@ -68,6 +104,257 @@ rounds_contract = w3.eth.contract(address=ROUNDS_CONTRACT_ADDR, abi=abi_rounds_m
 treasury_contract = w3.eth.contract(address=GOVERNOR_CONTRACT_ADDR, abi=treasury_manager)
 poll_creator_contract = w3.eth.contract(address=POLL_CREATOR_ADDR, abi=poll_creator_abi)
 
+"""
+@brief Connects to the RPC provider again
+Used by forked workers, which must not share pooled connections with the process they were forked from
+"""
+def reconnect():
+    global provider
+    provider = Workers.limitProvider(Cassette.getProvider(State.L2_RPC_PROVIDER))
+    w3.provider = provider
+
+
+### Block-pinned reads
+
+
+# While a block is pinned, all reads go against that block so a cycle sees a consistent view of the chain
+pinned_block = None
+read_cache = collections.OrderedDict()
+
+"""
+@brief Resolves the block all reads of this cycle should go against
+Falls back to reading 'latest' if the block number can't be retrieved
+"""
+def pinBlock():
+    global pinned_block
+    try:
+        pinned_block = w3.eth.block_number
+        Util.log("Pinned reads to block {0}".format(pinned_block), 3)
+    except Exception as e:
+        pinned_block = None
+        Util.log("Unable to pin a block, reading from 'latest': {0}".format(e), 1)
+
+"""
+@brief Goes back to reading from 'latest', should be called at the end of each cycle
+"""
+def unpinBlock():
+    global pinned_block
+    pinned_block = None
+
+"""
+@brief Moves the pinned block past a transaction we sent, so that following reads include its effects
+@param receipt: receipt of the mined transaction
+"""
+def followReceipt(receipt):
+    global pinned_block
+    if pinned_block is not None and receipt["blockNumber"] > pinned_block:
+        pinned_block = receipt["blockNumber"]
+        Util.log("Pinned reads to block {0}".format(pinned_block), 3)
+
+"""
+@brief Returns the block identifier reads should use right now
+"""
+def readBlock():
+    return pinned_block if pinned_block is not None else 'latest'
+
+"""
+@brief Returns the current block number, without a request while a block is pinned
+"""
+def currentBlock():
+    return pinned_block if pinned_block is not None else w3.eth.block_number
+
+"""
+@brief Does a read at the pinned block, answering repeated reads from the cache
+Without a pinned block this is just a read from 'latest', as those results could change at any time
+@param key: (contract or account address, calldata) identifying the read
+@param read: function doing the actual read, given the block identifier
+"""
+def cachedRead(key, read):
+    if pinned_block is None:
+        return read('latest')
+    key = (pinned_block,) + key
+    if key in read_cache:
+        read_cache.move_to_end(key)
+        return read_cache[key]
+    result = read(pinned_block)
+    read_cache[key] = result
+    if len(read_cache) > READ_CACHE_SIZE:
+        read_cache.popitem(last=False)
+    return result
+
+"""
+@brief Calls a contract view function at the pinned block
+@param function: bound contract function, like `bonding_contract.functions.pendingFees(address, 99999)`
+"""
+def cachedCall(function):
+    return cachedRead(
+        (function.address, function._encode_transaction_data()),
+        lambda block: function.call(block_identifier=block)
+    )
+
+"""
+@brief Returns the ETH balance of an account at the pinned block, in wei
+"""
+def cachedBalance(address):
+    return cachedRead((address, "balance"), lambda block: w3.eth.get_balance(address, block))
+
+"""
+@brief Executes contract calls in batches of READ_BATCH_SIZE
+@return list of results, in the same order as the calls
+"""
+def batchCalls(calls):
+    results = []
+    for start in range(0, len(calls), READ_BATCH_SIZE):
+        with w3.batch_requests() as batch:
+            for call in calls[start:start + READ_BATCH_SIZE]:
+                batch.add(call.call(block_identifier=readBlock()))
+            results += batch.execute()
+    return results
+
+
+### Notifications over WebSocket
+
+
+"""
+@brief Subscribes to new blocks, round changes and our own BondingManager events, if a WebSocket endpoint is configured
+Should be called once all Orchestrators have been added
+"""
+def startStream():
+    # Notifications are not part of a cassette, replays poll like they were recorded without them
+    if not State.L2_WS_PROVIDER or Cassette.active():
+        return
+    our_topics = [addressToTopic(orch.source_checksum_address) for orch in State.orchestrators]
+    round_topic = rounds_contract.events.NewRound.topic
+    Stream.start(State.L2_WS_PROVIDER, [
+        {"address": ROUNDS_CONTRACT_ADDR, "topics": [round_topic]},
+        {"address": BONDING_CONTRACT_ADDR, "topics": [[getattr(bonding_contract.events, name).topic for name in STREAMED_EVENTS], our_topics]}
+    ], round_topic)
+
+"""
+@brief Waits until any of the given transactions got mined
+While subscribed to new blocks, receipts only get requested once a new block or one of
+our own events comes in, else this polls over HTTP
+@param transaction_hashes: hashes of transactions, like a transaction and its replacements
+@return receipt of the transaction which got mined
+"""
+def waitForAnyReceipt(transaction_hashes, timeout=RECEIPT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    tx_hashes = [web3.Web3.to_hex(transaction_hash) for transaction_hash in transaction_hashes]
+    head = Stream.latest_head
+    while True:
+        for tx_hash in tx_hashes:
+            try:
+                return w3.eth.get_transaction_receipt(tx_hash)
+            except web3.exceptions.TransactionNotFound:
+                pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise web3.exceptions.TimeExhausted("Transaction {0} is not in the chain after {1} seconds".format(tx_hashes[-1], timeout))
+        if not Stream.connected:
+            time.sleep(min(RECEIPT_POLL_INTERVAL, remaining))
+            continue
+        # One of our events came in with this transaction, the receipt should be available now
+        if [tx_hash for tx_hash in tx_hashes if Stream.seen_transactions.pop(tx_hash, None) is not None]:
+            continue
+        head = Stream.waitForHead(head, remaining, tx_hashes) or head
+
+"""
+@brief Waits for a transaction to get mined
+"""
+def waitForReceipt(transaction_hash, timeout=RECEIPT_TIMEOUT):
+    return waitForAnyReceipt([transaction_hash], timeout)
+
+### Sending transactions
+
+
+"""
+@brief Returns the fee fields for a new transaction, capped at TX_MAX_FEE like the fee bumps of stuck transactions
+@param max_fee: maxFeePerGas to use
+"""
+def getFees(max_fee=MAX_FEE_PER_GAS):
+    max_fee = min(max_fee, State.TX_MAX_FEE)
+    return {
+        'maxFeePerGas': max_fee,
+        'maxPriorityFeePerGas': min(max_fee, MAX_PRIORITY_FEE_PER_GAS)
+    }
+
+"""
+@brief Signs and broadcasts a transaction
+@return transaction hash
+"""
+def signAndSend(idx, transaction_obj):
+    signed_transaction = w3.eth.account.sign_transaction(transaction_obj, State.orchestrators[idx].source_private_key)
+    return w3.eth.send_raw_transaction(signed_transaction.raw_transaction)
+
+"""
+@brief Remembers which transactions had to be replaced, and which one got mined in the end
+"""
+def recordReplacements(idx, label, transaction_obj, chain, receipt):
+    path = Util.getDataPath(REPLACEMENTS_FILE)
+    records = Util.readJson(path, [])
+    records.append({
+        "address": State.orchestrators[idx].source_checksum_address,
+        "action": label,
+        "nonce": transaction_obj["nonce"],
+        "round": State.current_round_num,
+        "transactions": [web3.Web3.to_hex(transaction_hash) for transaction_hash in chain],
+        "mined": web3.Web3.to_hex(receipt["transactionHash"]),
+        "block": receipt["blockNumber"],
+        "maxFeePerGas": transaction_obj["maxFeePerGas"],
+        "timestamp": int(time.time())
+    })
+    Util.writeJsonAtomic(path, records[-MAX_RECORDED_REPLACEMENTS:])
+
+"""
+@brief Waits for a transaction to get mined, replacing it with higher fees while it is stuck
+Whenever the transaction is not mined within TX_BUMP_AFTER seconds, it gets re-signed with the same nonce
+and fees raised by FEE_BUMP, up to TX_MAX_FEE. Any transaction in the replacement chain can end up mined.
+@param idx: which Orch # in the set sent the transaction
+@param transaction_obj: the transaction as it was signed, including nonce, gas and fees
+@param transaction_hash: hash of the broadcast transaction
+@param label: name of the action, for logging
+@return receipt of the mined transaction
+"""
+def superviseTransaction(idx, transaction_obj, transaction_hash, label):
+    chain = [transaction_hash]
+    while True:
+        try:
+            receipt = waitForAnyReceipt(chain, State.TX_BUMP_AFTER)
+            break
+        except web3.exceptions.TimeExhausted:
+            pass
+        if transaction_obj["maxFeePerGas"] >= State.TX_MAX_FEE:
+            Util.log("{0} for {1} is still pending, but its fees are at the cap already".format(label, State.orchestrators[idx].source_address), 1)
+            receipt = waitForAnyReceipt(chain)
+            break
+        # The last bump goes up to the cap, rather than stopping short of it
+        max_fee = min(int(transaction_obj["maxFeePerGas"] * FEE_BUMP), State.TX_MAX_FEE)
+        transaction_obj = dict(transaction_obj,
+            maxFeePerGas=max_fee,
+            maxPriorityFeePerGas=min(max_fee, int(transaction_obj["maxPriorityFeePerGas"] * FEE_BUMP))
+        )
+        try:
+            chain.append(signAndSend(idx, transaction_obj))
+            Util.log("{0} for {1} got stuck, replaced it with {2} at a max fee of {3:.4f} gwei".format(
+                label, State.orchestrators[idx].source_address, chain[-1].hex(), web3.Web3.from_wei(max_fee, 'gwei')), 2)
+        except Exception as e:
+            # Most likely one of the earlier transactions got mined in the meantime
+            Util.log("Unable to replace {0} for {1}: {2}".format(label, State.orchestrators[idx].source_address, e), 1)
+            receipt = waitForAnyReceipt(chain)
+            break
+    if len(chain) > 1:
+        recordReplacements(idx, label, transaction_obj, chain, receipt)
+    return receipt
+
+"""
+@brief Signs and broadcasts a transaction, then supervises it until it got mined
+@return receipt of the mined transaction
+"""
+def sendTransaction(idx, transaction_obj, label):
+    transaction_hash = signAndSend(idx, transaction_obj)
+    Util.log("Initiated transaction with hash {0}".format(transaction_hash.hex()), 2)
+    return superviseTransaction(idx, transaction_obj, transaction_hash, label)
+
 
 ### Governance & Treasury logic
 
@@ -82,93 +369,309 @@ def printProgressBar(current, total, prefix='', length=30, extra=''):
         print()  # Newline when done
 
 
+def addressToTopic(address):
+    """Left-pads an address to a 32-byte topic so it can be used in a log filter."""
+    return "0x" + address.lower().replace("0x", "").rjust(64, "0")
+
+
 def getLogsInChunks(event, from_block, to_block):
+    """Query a single event's logs over a block range, decoded by web3."""
+    all_logs = []
+    for logs in iterLogsInChunks(event, from_block, to_block):
+        all_logs.extend(logs)
+    return all_logs
+
+
+def iterLogsInChunks(event, from_block, to_block, newest_first=False):
+    """Streaming variant of getLogsInChunks: yields the decoded logs of each chunk as soon as it is fetched."""
+    for _, _, logs in iterChunks(
+        lambda start, end: event.get_logs(from_block=start, to_block=end),
+        from_block,
+        to_block,
+        newest_first
+    ):
+        yield logs
+
+
+def getMultiLogsInChunks(sources, from_block, to_block, topic_filters=None, background=False, strict=False):
     """
-    Query event logs with adaptive block range and rate limiting.
-    - Auto-discovers max block range (starts large, halves on error)
-    - Auto-adjusts request rate (slows on rate limit)
+    Query logs of several (contract, event name) pairs in a single walk.
+    Returns a dict of event name -> list of decoded logs, in chain order
     """
-    all_logs = []
-    current = from_block
+    results = {event_name: [] for _, event_name in sources}
+    for logs in iterMultiLogsInChunks(sources, from_block, to_block, topic_filters, background=background, strict=strict):
+        for event_name, log in logs:
+            results[event_name].append(log)
+    return results
 
-    # Adaptive parameters - once reduced, stays reduced
-    chunk_size = 500000  # Start optimistic (500k blocks)
-    min_chunk = 1000     # Don't go below 1k
-    delay = 0.01         # Start fast (100 req/s)
-    max_delay = 0.5      # Max 2 req/s if heavily rate limited
 
-    total_blocks = to_block - from_block
-    retries = 0
-    max_retries = 3
+def iterMultiLogsInChunks(sources, from_block, to_block, topic_filters=None, newest_first=False, fast_decode=True, background=False, strict=False):
+    """
+    Streaming multi-contract scan, yields a list of (event name, decoded log) per chunk.
+    - Issues one eth_getLogs per chunk with an address list and a topic0 OR-filter
+    - Demultiplexes the raw logs by (address, topic0) into the matching event decoder
+    - topic_filters optionally restricts topic1..3 for all sources at once
+    - fast_decode uses the minimal decoders in Events where available instead of web3's
+    """
+    decoders = {}
+    addresses = []
+    for contract, event_name in sources:
+        event = contract.events[event_name]()
+        decoders[(contract.address, event.topic)] = event
+        if contract.address not in addresses:
+            addresses.append(contract.address)
+    topics = [sorted(set(topic for _, topic in decoders))]
+    if topic_filters:
+        topics.extend(topic_filters)
+
+    def fetchChunk(start, end):
+        return w3.eth.get_logs({
+            "fromBlock": start,
+            "toBlock": end,
+            "address": addresses,
+            "topics": topics
+        })
+
+    for _, _, raw_logs in iterChunks(fetchChunk, from_block, to_block, newest_first, background=background, strict=strict):
+        logs = []
+        for log in raw_logs:
+            if not log["topics"]:
+                continue
+            topic = web3.Web3.to_hex(log["topics"][0])
+            event = decoders.get((log["address"], topic))
+            if event is None:
+                continue
+            try:
+                raw_decoder = Events.RAW_DECODERS.get(topic) if fast_decode else None
+                if raw_decoder is not None:
+                    logs.append((event.event_name, raw_decoder(log)))
+                else:
+                    logs.append((event.event_name, event.process_log(log)))
+            except Exception as e:
+                Util.log("Unable to decode {0} log in tx {1}: {2}".format(event.event_name, web3.Web3.to_hex(log["transactionHash"]), e), 3)
+        yield logs
+
+
+class ScanTuner:
+    """
+    AIMD controller for chunked eth_getLogs scans against a single RPC provider.
+    - Chunk size: halves on a block range error, grows additively after sustained success.
+      Growth is capped just below the smallest range that failed, which slowly relaxes again.
+    - Request rate: halves on a rate limit, grows additively after sustained success.
+    Learned values are persisted per RPC URL, so later scans start near the optimum.
+    Counts requests, scanned blocks and failures per kind in `stats`, for logging and benchmarks.
+    """
+    START_CHUNK = 500000     # Start optimistic (500k blocks) for unknown providers
+    MIN_CHUNK = 1000         # Don't go below 1k
+    MAX_CHUNK = 5000000      # Never ask for more than this in one request
+    START_DELAY = 0.01       # Start fast (100 req/s)
+    MAX_DELAY = 0.5          # Max 2 req/s if heavily rate limited
+    RATE_STEP = 5            # Additive increase of the request rate (req/s)
+    GROW_AFTER = 5           # Consecutive successes before increasing
+    PROBE_AFTER = 50         # Consecutive successes at the cap before relaxing the learned range limit
+    LIMITS_FILE = "rpc_limits.json"
+
+    def __init__(self, rpc_url):
+        self.key = hashlib.sha256(rpc_url.encode()).hexdigest()[:16]
+        self.host = urlparse(rpc_url).netloc or rpc_url
+        learned = Util.readJson(Util.getDataPath(self.LIMITS_FILE), {}).get(self.key, {})
+        # Replays only match the recording if both scans start out the same
+        if Cassette.active():
+            learned = {}
+        self.chunk_size = int(learned.get("chunk_size", self.START_CHUNK))
+        self.range_limit = learned.get("range_limit")  # Smallest chunk size which was rejected
+        self.delay = float(learned.get("delay", self.START_DELAY))
+        self.successes = 0
+        self.capped_successes = 0
+        self.stats = collections.Counter()
+        if learned:
+            Util.log("Using learned limits for {0}: chunk={1:,} rate={2:.0f}/s".format(self.host, self.chunk_size, self.rate()), 3)
+
+    def rate(self):
+        return 1 / self.delay if self.delay > 0 else 100
+
+    def cap(self):
+        """Largest chunk size we are willing to try."""
+        if self.range_limit:
+            return max(self.MIN_CHUNK, min(self.MAX_CHUNK, self.range_limit - 1))
+        return self.MAX_CHUNK
+
+    def onSuccess(self):
+        self.successes += 1
+        if self.successes < self.GROW_AFTER:
+            return
+        self.successes = 0
+        # Additive increase of the request rate
+        self.delay = max(self.START_DELAY, 1 / (self.rate() + self.RATE_STEP))
+        # Additive increase of the chunk size, up to the learned range limit
+        if self.chunk_size >= self.cap():
+            self.capped_successes += self.GROW_AFTER
+            if self.range_limit and self.capped_successes >= self.PROBE_AFTER:
+                # The limit might have been a transient failure: carefully probe above it
+                self.capped_successes = 0
+                self.range_limit = int(self.range_limit * 1.25)
+                Util.log("Probing larger chunks up to {0:,} blocks".format(self.cap()), 3)
+        self.chunk_size = min(self.cap(), self.chunk_size + max(self.MIN_CHUNK, self.chunk_size // 10))
+
+    def onRateLimited(self):
+        """Multiplicative decrease of the request rate."""
+        self.successes = 0
+        self.delay = min(self.MAX_DELAY, self.delay * 2)
+
+    def onRangeError(self):
+        """Multiplicative decrease of the chunk size. Returns False if it cannot go any lower."""
+        self.successes = 0
+        self.capped_successes = 0
+        if self.chunk_size <= self.MIN_CHUNK:
+            return False
+        self.range_limit = self.chunk_size if not self.range_limit else min(self.range_limit, self.chunk_size)
+        self.chunk_size = max(self.MIN_CHUNK, self.chunk_size // 2)
+        return True
+
+    def save(self):
+        """Persists what we learned about this provider."""
+        if Cassette.active():
+            return
+        path = Util.getDataPath(self.LIMITS_FILE)
+        limits = Util.readJson(path, {})
+        limits[self.key] = {
+            "host": self.host,
+            "chunk_size": self.chunk_size,
+            "range_limit": self.range_limit,
+            "delay": self.delay,
+            "updated": int(time.time())
+        }
+        Util.writeJsonAtomic(path, limits)
 
-    while current <= to_block:
-        end = min(current + chunk_size - 1, to_block)
-        try:
-            logs = event.get_logs(from_block=current, to_block=end)
-            all_logs.extend(logs)
-            retries = 0  # Reset on success
+# Tuners by RPC URL, shared between scans so we keep learning within a session
+scan_tuners = {}
 
-            # Update progress bar with details
-            progress = current - from_block
-            rate = 1 / delay if delay > 0 else 100
-            extra = f"[{current:,}-{end:,}] chunk={chunk_size:,} rate={rate:.0f}/s"
-            printProgressBar(progress, total_blocks, prefix='Scanning', extra=extra)
+"""
+@brief Returns the shared ScanTuner for an RPC provider
+@param rpc_url: RPC URL, defaults to the configured L2 provider
+"""
+def getScanTuner(rpc_url=None):
+    rpc_url = rpc_url or State.L2_RPC_PROVIDER
+    if rpc_url not in scan_tuners:
+        scan_tuners[rpc_url] = ScanTuner(rpc_url)
+    return scan_tuners[rpc_url]
 
-            current = end + 1
-            time.sleep(delay)
 
-        except Exception as e:
-            # Get full error details
-            error_type = type(e).__name__
-            error_msg = str(e)
-            error_str = error_msg.lower()
-
-            # If exception has nested cause, get that too
-            if hasattr(e, '__cause__') and e.__cause__:
-                error_msg = f"{error_msg} | Cause: {e.__cause__}"
-            if hasattr(e, 'args') and e.args:
-                error_msg = f"{error_type}: {e.args}"
-
-            # Clear progress bar line before logging errors
-            print()
+def iterChunks(fetch_chunk, from_block, to_block, newest_first=False, tuner=None, background=False, strict=False):
+    """
+    Call fetch_chunk(start, end) over a block range with adaptive block range and rate limiting.
+    Yields (start, end, logs) per chunk so callers can act before the whole range is scanned.
+    - Chunk size and request rate are controlled by a ScanTuner (AIMD, learned per provider)
+    - newest_first walks the range backwards; logs within each chunk are then reversed too
+    - background scans print no progress bar and wait at least BACKGROUND_SCAN_DELAY between chunks
+    - strict scans raise once a chunk keeps failing, instead of skipping it, for callers which must not miss any logs
+    """
+    tuner = tuner or getScanTuner()
+    min_delay = State.BACKGROUND_SCAN_DELAY if background else 0
+    found = 0
+    # Next block to fetch: moves up when walking forwards, down when walking backwards
+    current = to_block if newest_first else from_block
 
-            # Timeout / temporary error - just retry (check first!)
-            if any(x in error_str for x in ['timeout', 'deadline', 'connection']):
-                Util.log("Timeout on blocks {0}-{1}, retrying: {2}".format(current, end, error_msg), 2)
-                time.sleep(1)
-                continue  # Retry same range
-
-            # Rate limited - slow down (permanently)
-            if any(x in error_str for x in ['rate', '429', 'too many requests']):
-                delay = min(max_delay, delay * 2)
-                Util.log("Rate limited, slowing to {0:.2f}s delay: {1}".format(delay, error_msg), 2)
-                time.sleep(delay)
-                continue  # Retry
-
-            # Block range too large - halve it (permanently)
-            if any(x in error_str for x in ['range', 'limit', '422', 'block', '10000']):
-                if chunk_size > min_chunk:
-                    chunk_size = chunk_size // 2
-                    Util.log("Reducing chunk size to {0} blocks: {1}".format(chunk_size, error_msg), 2)
-                    continue  # Retry same range with smaller chunk
-
-            # Other error - retry up to max_retries, then skip
-            retries += 1
-            if retries <= max_retries:
-                Util.log("Error querying blocks {0}-{1} (retry {2}/{3}): {4}".format(
-                    current, end, retries, max_retries, error_msg), 1)
-                time.sleep(1)
-                continue
+    total_blocks = to_block - from_block
+    retries = 0
+    max_retries = 3
+
+    try:
+        while from_block <= current <= to_block:
+            if newest_first:
+                start = max(current - tuner.chunk_size + 1, from_block)
+                end = current
             else:
-                Util.log("Giving up on blocks {0}-{1} after {2} retries: {3}".format(
-                    current, end, max_retries, error_msg), 1)
-                retries = 0
-                current = end + 1
-                time.sleep(0.5)
-
-    # Final progress
-    printProgressBar(total_blocks, total_blocks, prefix='Scanning', extra=f"Done! Found {len(all_logs)} events")
-    return all_logs
+                start = current
+                end = min(current + tuner.chunk_size - 1, to_block)
+            try:
+                tuner.stats["requests"] += 1
+                logs = fetch_chunk(start, end)
+                tuner.stats["blocks"] += end - start + 1
+                tuner.stats["logs"] += len(logs)
+                retries = 0  # Reset on success
+                # Only count full chunks towards growing the chunk size
+                if end - start + 1 >= tuner.chunk_size:
+                    tuner.onSuccess()
+
+                # Update progress bar with details
+                progress = (to_block - end) if newest_first else (start - from_block)
+                extra = f"[{start:,}-{end:,}] chunk={tuner.chunk_size:,} rate={tuner.rate():.0f}/s"
+                if not background:
+                    printProgressBar(progress, total_blocks, prefix='Scanning', extra=extra)
+
+                current = start - 1 if newest_first else end + 1
+                found += len(logs)
+                yield start, end, (list(reversed(logs)) if newest_first else logs)
+                time.sleep(max(tuner.delay, min_delay))
+
+            except Exception as e:
+                # Get full error details
+                error_type = type(e).__name__
+                error_msg = str(e)
+                error_str = error_msg.lower()
+
+                # If exception has nested cause, get that too
+                if hasattr(e, '__cause__') and e.__cause__:
+                    error_msg = f"{error_msg} | Cause: {e.__cause__}"
+                if hasattr(e, 'args') and e.args:
+                    error_msg = f"{error_type}: {e.args}"
+
+                # Clear progress bar line before logging errors
+                if not background:
+                    print()
+                tuner.stats["failures"] += 1
+
+                # Timeout / temporary error - just retry (check first!)
+                if any(x in error_str for x in ['timeout', 'deadline', 'connection']):
+                    tuner.stats["timeouts"] += 1
+                    Util.log("Timeout on blocks {0}-{1}, retrying: {2}".format(start, end, error_msg), 2)
+                    time.sleep(1)
+                    continue  # Retry same range
+
+                # Rate limited - slow down until we have a streak of successes again
+                if any(x in error_str for x in ['rate', '429', 'too many requests']):
+                    tuner.onRateLimited()
+                    tuner.stats["rate_limited"] += 1
+                    Util.log("Rate limited, slowing to {0:.2f}s delay: {1}".format(tuner.delay, error_msg), 2)
+                    time.sleep(tuner.delay)
+                    continue  # Retry
+
+                # Block range too large - halve it, it grows back after a streak of successes
+                if any(x in error_str for x in ['range', 'limit', '422', 'block', '10000']):
+                    if tuner.onRangeError():
+                        tuner.stats["range_errors"] += 1
+                        Util.log("Reducing chunk size to {0} blocks: {1}".format(tuner.chunk_size, error_msg), 2)
+                        continue  # Retry same range with smaller chunk
+
+                # Other error - retry up to max_retries, then skip
+                retries += 1
+                if retries <= max_retries:
+                    Util.log("Error querying blocks {0}-{1} (retry {2}/{3}): {4}".format(
+                        start, end, retries, max_retries, error_msg), 1)
+                    time.sleep(1)
+                    continue
+                else:
+                    if strict:
+                        raise Exception("Unable to query blocks {0}-{1} after {2} retries: {3}".format(start, end, max_retries, error_msg)) from e
+                    Util.log("Giving up on blocks {0}-{1} after {2} retries: {3}".format(
+                        start, end, max_retries, error_msg), 1)
+                    tuner.stats["skipped_blocks"] += end - start + 1
+                    retries = 0
+                    current = start - 1 if newest_first else end + 1
+                    time.sleep(0.5)
+
+        # Final progress
+        if not background:
+            printProgressBar(total_blocks, total_blocks, prefix='Scanning', extra=f"Done! Found {found} events")
+    except GeneratorExit:
+        # Caller stopped early, end the progress bar line
+        if not background:
+            print()
+        Util.log("Stopped scanning early after {0} events".format(found), 3)
+        raise
+    finally:
+        tuner.save()
 
 
 def getProposalState(proposalId):
@@ -207,53 +710,95 @@ def getVotingWindow():
         return 5_000_000
 
 
+def getProposalSearchStart(current_block):
+    """Returns the first block where proposals which are still active can have been created."""
+    # Get voting window from contract (votingDelay + votingPeriod)
+    voting_window = getVotingWindow()
+    buffer_blocks = 50000  # Small buffer for safety
+    return max(0, current_block - voting_window - buffer_blocks)
+
+
+def parseProposal(proposal):
+    """
+    Returns (state, proposal dict) for a ProposalCreated log.
+    Takes both an Events.ProposalCreatedLog and a log decoded by web3, which keeps the fields under `args`.
+    """
+    if isinstance(proposal, Events.ProposalCreatedLog):
+        fields = proposal
+        first_line = proposal.title
+    else:
+        fields = proposal.args
+        first_line = proposal.args.description.split("\n")[0]
+    proposal_id = fields.proposalId
+    state = getProposalState(proposal_id)
+    state_name = PROPOSAL_STATE_NAMES.get(state, f"Unknown({state})")
+    title = re.sub(r'^#+\s*', "", first_line)
+
+    Util.log("Proposal '{0}' state: {1}".format(title[:50], state_name), 2)
+
+    return state, {
+        "proposalId": proposal_id,
+        "proposer": fields.proposer,
+        "targets": fields.targets,
+        "voteStart": fields.voteStart,
+        "voteEnd": fields.voteEnd,
+        "title": title
+    }
+
+
+def parseProposals(raw_proposals):
+    """Filters ProposalCreated logs down to the ACTIVE proposals."""
+    if not raw_proposals:
+        Util.log("No proposals found in search range", 2)
+        return []
+
+    # Filter for ACTIVE proposals only
+    Util.log("Found {0} proposals, checking states...".format(len(raw_proposals)), 2)
+    active_proposals = []
+    for proposal in raw_proposals:
+        state, parsed = parseProposal(proposal)
+        if state == PROPOSAL_STATE_ACTIVE:
+            active_proposals.append(parsed)
+
+    Util.log("Found {0} active proposals".format(len(active_proposals)), 2)
+    return active_proposals
+
+
 """
 @brief Returns all currently ACTIVE governance proposals
+Streams the search window newest-first, checking states while the scan is running.
+Since every proposal gets the same voting delay and period, the scan stops at the
+first proposal whose vote has already ended: anything older has ended as well.
 """
 def getProposals():
     try:
-        current_block = w3.eth.block_number
-
-        # Get voting window from contract (votingDelay + votingPeriod)
-        voting_window = getVotingWindow()
-        buffer_blocks = 50000  # Small buffer for safety
-        from_block = max(0, current_block - voting_window - buffer_blocks)
+        current_block = currentBlock()
+        from_block = getProposalSearchStart(current_block)
 
         Util.log("Searching for proposals from block {0} to {1}".format(from_block, current_block), 2)
 
-        # Query in adaptive chunks
-        raw_proposals = getLogsInChunks(
-            treasury_contract.events.ProposalCreated(),
-            from_block,
-            current_block
-        )
-
-        if not raw_proposals:
+        active_proposals = []
+        found = 0
+        vote_ended = False
+        for chunk in iterMultiLogsInChunks([(treasury_contract, "ProposalCreated")], from_block, current_block, newest_first=True):
+            for _, proposal in chunk:
+                found += 1
+                state, parsed = parseProposal(proposal)
+                if state == PROPOSAL_STATE_ACTIVE:
+                    active_proposals.append(parsed)
+                elif state in PROPOSAL_STATES_ENDED:
+                    vote_ended = True
+                    break
+            if vote_ended:
+                Util.log("Reached a proposal whose vote has ended, skipping older blocks", 2)
+                break
+
+        if not found:
             Util.log("No proposals found in search range", 2)
             return []
 
-        # Filter for ACTIVE proposals only
-        Util.log("Found {0} proposals, checking states...".format(len(raw_proposals)), 2)
-        active_proposals = []
-        for proposal in raw_proposals:
-            proposal_id = proposal.args.proposalId
-            state = getProposalState(proposal_id)
-            state_name = PROPOSAL_STATE_NAMES.get(state, f"Unknown({state})")
-            title_and_body = proposal.args.description.split("\n")
-            title = re.sub(r'^#+\s*', "", title_and_body[0])
-
-            Util.log("Proposal '{0}' state: {1}".format(title[:50], state_name), 2)
-
-            if state == PROPOSAL_STATE_ACTIVE:
-                active_proposals.append({
-                    "proposalId": proposal_id,
-                    "proposer": proposal.args.proposer,
-                    "targets": proposal.args.targets,
-                    "voteStart": proposal.args.voteStart,
-                    "voteEnd": proposal.args.voteEnd,
-                    "title": title
-                })
-
+        # Return in chain order, oldest first
+        active_proposals.reverse()
         Util.log("Found {0} active proposals".format(len(active_proposals)), 2)
         return active_proposals
 
@@ -292,17 +837,12 @@ def doCastVote(idx, proposalId, value):
         transaction_obj = treasury_contract.functions.castVote(proposalId, value).build_transaction(
             {
                 "from": State.orchestrators[idx].source_checksum_address,
-                'maxFeePerGas': 2000000000,
-                'maxPriorityFeePerGas': 1000000000,
+                **getFees(),
                 "nonce": w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address)
             }
         )
-        # Sign and initiate transaction
-        signed_transaction = w3.eth.account.sign_transaction(transaction_obj, State.orchestrators[idx].source_private_key)
-        transaction_hash = w3.eth.send_raw_transaction(signed_transaction.raw_transaction)
-        Util.log("Initiated transaction with hash {0}".format(transaction_hash.hex()), 2)
-        # Wait for transaction to be confirmed
-        receipt = w3.eth.wait_for_transaction_receipt(transaction_hash)
+        # Sign and initiate transaction, then wait for it to be confirmed
+        receipt = sendTransaction(idx, transaction_obj, "castVote")
         # Util.log("Completed transaction {0}".format(receipt))
         Util.log('Voted successfully', 2)
     except Exception as e:
@@ -317,22 +857,91 @@ def doCastVoteWithReason(idx, proposalId, value, reason):
         transaction_obj = treasury_contract.functions.castVoteWithReason(proposalId, value, reason).build_transaction(
             {
                 "from": State.orchestrators[idx].source_checksum_address,
-                'maxFeePerGas': 2000000000,
-                'maxPriorityFeePerGas': 1000000000,
+                **getFees(),
                 "nonce": w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address)
             }
         )
-        # Sign and initiate transaction
-        signed_transaction = w3.eth.account.sign_transaction(transaction_obj, State.orchestrators[idx].source_private_key)
-        transaction_hash = w3.eth.send_raw_transaction(signed_transaction.raw_transaction)
-        Util.log("Initiated transaction with hash {0}".format(transaction_hash.hex()), 2)
-        # Wait for transaction to be confirmed
-        receipt = w3.eth.wait_for_transaction_receipt(transaction_hash)
+        # Sign and initiate transaction, then wait for it to be confirmed
+        receipt = sendTransaction(idx, transaction_obj, "castVoteWithReason")
         # Util.log("Completed transaction {0}".format(receipt))
         Util.log('Voted successfully', 2)
     except Exception as e:
         Util.log("Unable to vote: '{0}'".format(e), 1)
 
+"""
+@brief Checks which wallets have already voted on a proposal, in a single batched request
+@return dict of address -> True if it has voted
+"""
+def getHasVoted(proposalId, addresses):
+    try:
+        with w3.batch_requests() as batch:
+            for address in addresses:
+                batch.add(treasury_contract.functions.hasVoted(proposalId, address))
+            results = batch.execute()
+        return dict(zip(addresses, results))
+    except Exception as e:
+        Util.log("Unable to check for voting status: '{0}'".format(e), 1)
+        return {}
+
+"""
+@brief Signs and broadcasts a transaction for each Orchestrator, then waits for all of them
+Nonces are fetched in a single batch and all transactions go out before waiting for any receipt,
+so voting with the whole fleet takes about as long as a single vote
+@param idxs: which Orch #'s in the set to send from
+@param build_function: returns the contract function to call for an Orch #
+@return list of dicts with the `idx`, `hash` and `status` (confirmed, reverted or failed) of each transaction
+"""
+def doBroadcastAll(idxs, build_function):
+    results = [{"idx": idx, "hash": None, "status": "failed"} for idx in idxs]
+    try:
+        with w3.batch_requests() as batch:
+            for idx in idxs:
+                batch.add(w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address, 'pending'))
+            nonces = batch.execute()
+    except Exception as e:
+        Util.log("Unable to get nonces: {0}".format(e), 1)
+        return results
+    # Sign and broadcast everything first
+    for result, nonce in zip(results, nonces):
+        orch = State.orchestrators[result["idx"]]
+        try:
+            transaction_obj = build_function(result["idx"]).build_transaction(
+                {
+                    "from": orch.source_checksum_address,
+                    **getFees(),
+                    "nonce": nonce,
+                    "chainId": ARBITRUM_CHAIN_ID
+                }
+            )
+            result["hash"] = signAndSend(result["idx"], transaction_obj)
+            result["transaction"] = transaction_obj
+            Util.log("Initiated transaction for {0} with hash {1}".format(orch.source_address, result["hash"].hex()), 2)
+        except Exception as e:
+            Util.log("Unable to send transaction for {0}: {1}".format(orch.source_address, e), 1)
+    # Then wait for them to get mined
+    for result in results:
+        if result["hash"] is None:
+            continue
+        try:
+            receipt = superviseTransaction(result["idx"], result.pop("transaction"), result["hash"], "vote")
+            result["hash"] = receipt["transactionHash"]
+            result["status"] = "confirmed" if receipt["status"] == 1 else "reverted"
+        except Exception as e:
+            Util.log("Unable to confirm transaction {0}: {1}".format(result["hash"].hex(), e), 1)
+        result.pop("transaction", None)
+        result["hash"] = web3.Web3.to_hex(result["hash"])
+    return results
+
+"""
+@brief Votes on a proposal with multiple Orchestrators at once
+@param value: 0 = Against, 1 = For, 2 = Abstain
+@param reason: optional reason, votes without a reason if empty
+"""
+def doCastVotes(idxs, proposalId, value, reason=""):
+    if reason == "":
+        return doBroadcastAll(idxs, lambda idx: treasury_contract.functions.castVote(proposalId, value))
+    return doBroadcastAll(idxs, lambda idx: treasury_contract.functions.castVoteWithReason(proposalId, value, reason))
+
 
 ### LIP Governance Polls
 
@@ -352,10 +961,28 @@ def getPollWindow():
         # Fallback: ~10 days on Arbitrum at 0.25s/block
         return 3_500_000
 
+def parsePolls(raw_polls):
+    """Turns PollCreated logs into poll dicts."""
+    if not raw_polls:
+        Util.log("No polls found in search range", 2)
+        return []
+
+    Util.log("Found {0} polls".format(len(raw_polls)), 2)
+    polls = []
+    for poll in raw_polls:
+        poll_address = poll.args.poll
+        end_block = poll.args.endBlock
+        polls.append({
+            "pollAddress": poll_address,
+            "endBlock": end_block,
+            "proposal": poll.args.proposal.hex() if isinstance(poll.args.proposal, bytes) else poll.args.proposal
+        })
+    return polls
+
 def getPolls():
     """Returns all LIP governance polls within the search window."""
     try:
-        current_block = w3.eth.block_number
+        current_block = currentBlock()
         poll_window = getPollWindow()
         from_block = max(0, current_block - poll_window)
 
@@ -366,32 +993,42 @@ def getPolls():
             from_block,
             current_block
         )
-
-        if not raw_polls:
-            Util.log("No polls found in search range", 2)
-            return []
-
-        Util.log("Found {0} polls".format(len(raw_polls)), 2)
-        polls = []
-        for poll in raw_polls:
-            poll_address = poll.args.poll
-            end_block = poll.args.endBlock
-            polls.append({
-                "pollAddress": poll_address,
-                "endBlock": end_block,
-                "proposal": poll.args.proposal.hex() if isinstance(poll.args.proposal, bytes) else poll.args.proposal
-            })
-
-        return polls
+        return parsePolls(raw_polls)
     except Exception as e:
         Util.log("Unable to retrieve LIP polls: {0}".format(e), 1)
         return []
 
+def getPollVotes(pollAddresses, voterAddresses):
+    """
+    Returns the latest vote of each voter on each poll in a single walk.
+    Vote logs of all polls are fetched at once, filtered on the voter topic.
+    Returns a dict of (pollAddress, voterAddress) -> choiceId where 0=Yes, 1=No
+    """
+    if not pollAddresses or not voterAddresses:
+        return {}
+    try:
+        current_block = currentBlock()
+        from_block = max(0, current_block - getPollWindow())
+        sources = [(w3.eth.contract(address=pollAddress, abi=poll_abi), "Vote") for pollAddress in pollAddresses]
+        logs = getMultiLogsInChunks(
+            sources,
+            from_block,
+            current_block,
+            topic_filters=[[addressToTopic(voter) for voter in voterAddresses]]
+        )
+        votes = {}
+        for vote in logs["Vote"]:
+            votes[(vote.address, vote.args.voter)] = vote.args.choiceID
+        return votes
+    except Exception as e:
+        Util.log("Unable to check poll vote status: '{0}'".format(e), 1)
+        return {}
+
 def getVoteStatus(pollAddress, voterAddress):
     """Check if wallet voted on poll. Returns (hasVoted, choiceId) where 0=Yes, 1=No."""
     try:
         poll_contract = w3.eth.contract(address=pollAddress, abi=poll_abi)
-        current_block = w3.eth.block_number
+        current_block = currentBlock()
         poll_window = getPollWindow()
         from_block = max(0, current_block - poll_window)
         votes = poll_contract.events.Vote.get_logs(
@@ -412,32 +1049,196 @@ def doCastPollVote(idx, pollAddress, choiceId):
         transaction_obj = poll_contract.functions.vote(choiceId).build_transaction(
             {
                 "from": State.orchestrators[idx].source_checksum_address,
-                'maxFeePerGas': 2000000000,
-                'maxPriorityFeePerGas': 1000000000,
+                **getFees(),
                 "nonce": w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address)
             }
         )
-        signed_transaction = w3.eth.account.sign_transaction(transaction_obj, State.orchestrators[idx].source_private_key)
-        transaction_hash = w3.eth.send_raw_transaction(signed_transaction.raw_transaction)
-        Util.log("Initiated transaction with hash {0}".format(transaction_hash.hex()), 2)
-        receipt = w3.eth.wait_for_transaction_receipt(transaction_hash)
+        receipt = sendTransaction(idx, transaction_obj, "poll vote")
         Util.log('Poll vote cast successfully', 2)
     except Exception as e:
         Util.log("Unable to vote on poll: '{0}'".format(e), 1)
 
+def doCastPollVotes(idxs, pollAddress, choiceId):
+    """Cast the same vote on a LIP poll with multiple Orchestrators at once. choiceId: 0=Yes, 1=No."""
+    poll_contract = w3.eth.contract(address=pollAddress, abi=poll_abi)
+    return doBroadcastAll(idxs, lambda idx: poll_contract.functions.vote(choiceId))
+
+
+### Transcoder pool
+
+
+pool_snapshot = {"round": None, "max_size": 0, "transcoders": []}
+
+"""
+@brief Walks the linked list of transcoders in the pool, which is sorted by stake
+The pool barely changes between rounds, so the successor of every transcoder in the previous snapshot
+(or the one saved to disk by a previous run) gets requested in one batch.
+Only where the list changed we need to follow it one call at a time
+@return list of checksum addresses, highest stake first, and the maximum size of the pool
+"""
+def walkTranscoderPool():
+    known = [transcoder["address"] for transcoder in pool_snapshot["transcoders"]]
+    if not known:
+        known = Util.readJson(Util.getDataPath(POOL_FILE), [])
+    results = batchCalls(
+        [
+            bonding_contract.functions.getFirstTranscoderInPool(),
+            bonding_contract.functions.getTranscoderPoolSize(),
+            bonding_contract.functions.getTranscoderPoolMaxSize()
+        ] + [bonding_contract.functions.getNextTranscoderInPool(address) for address in known]
+    )
+    first, pool_size, max_size = results[:3]
+    next_in_pool = dict(zip(known, results[3:]))
+    pool = []
+    address = first
+    while address != EMPTY_ADDRESS and len(pool) < pool_size:
+        pool.append(address)
+        if address not in next_in_pool:
+            next_in_pool[address] = bonding_contract.functions.getNextTranscoderInPool(address).call(block_identifier=readBlock())
+        address = next_in_pool[address]
+    Util.log("Walked a transcoder pool of {0} with {1} sequential call(s)".format(len(pool), len(set(pool) - set(known))), 3)
+    return pool, max_size
+
+"""
+@brief Returns the stake and commission of every transcoder in the pool, highest stake first
+The snapshot is taken once per round and reused until the next round starts
+@return dict with the `round`, the `max_size` of the pool and its `transcoders`, each a dict with
+        `address`, `stake`, `reward_cut`, `fee_cut`, `last_reward_round` and `active`
+"""
+def getTranscoderPool():
+    global pool_snapshot
+    if pool_snapshot["round"] == State.current_round_num and pool_snapshot["transcoders"]:
+        return pool_snapshot
+    try:
+        pool, max_size = walkTranscoderPool()
+        calls = []
+        for address in pool:
+            calls += [
+                bonding_contract.functions.transcoderTotalStake(address),
+                bonding_contract.functions.getTranscoder(address),
+                bonding_contract.functions.isActiveTranscoder(address)
+            ]
+        results = batchCalls(calls)
+        transcoders = []
+        for i, address in enumerate(pool):
+            stake, info, active = results[i * 3:i * 3 + 3]
+            transcoders.append({
+                "address": address,
+                "stake": web3.Web3.from_wei(stake, 'ether'),
+                # rewardCut is the share of rewards the transcoder keeps, feeShare the share of fees for delegators
+                "reward_cut": info[1] / 10000,
+                "fee_cut": 100 - info[2] / 10000,
+                "last_reward_round": info[0],
+                "active": active
+            })
+        pool_snapshot = {"round": State.current_round_num, "max_size": max_size, "transcoders": transcoders}
+        Util.writeJsonAtomic(Util.getDataPath(POOL_FILE), pool)
+        Util.log("Took a snapshot of {0} transcoders in the pool for round {1}".format(len(transcoders), State.current_round_num), 2)
+    except Exception as e:
+        Util.log("Unable to snapshot the transcoder pool: {0}".format(e), 1)
+    return pool_snapshot
+
+
+### Pre-flight simulation
+
+
+"""
+@brief Executes contract calls as one batch of raw eth_calls, each from a given sender
+Unlike w3.batch_requests(), a call which reverts does not fail the whole batch
+@param calls: list of (bound contract function, sender address)
+@return list of (True, decoded result) or (False, revert reason), in the same order as the calls
+"""
+def simulateCalls(calls):
+    block = readBlock()
+    block = web3.Web3.to_hex(block) if isinstance(block, int) else block
+    results = []
+    for start in range(0, len(calls), READ_BATCH_SIZE):
+        requests = [
+            ("eth_call", [{"from": sender, "to": function.address, "data": function._encode_transaction_data()}, block])
+            for function, sender in calls[start:start + READ_BATCH_SIZE]
+        ]
+        responses = w3.provider.make_batch_request(requests)
+        if not isinstance(responses, list):
+            raise ConnectionError("Batched eth_call was rejected: {0}".format(responses.get("error")))
+        for (function, _), response in zip(calls[start:start + READ_BATCH_SIZE], responses):
+            if "error" in response:
+                results.append((False, response["error"].get("message", response["error"])))
+                continue
+            decoded = w3.codec.decode(get_abi_output_types(function.abi), web3.Web3.to_bytes(hexstr=response["result"]))
+            results.append((True, decoded[0] if len(decoded) == 1 else decoded))
+    return results
+
+"""
+@brief Checks which planned actions would succeed, in a single batched pass
+Every action gets a state check and is simulated from the Orchestrator's address:
+reward needs an active transcoder, transferBond and withdrawFees need enough pending stake or fees
+@param actions: list of (Orch #, "reward", "transferBond" or "withdrawFees")
+@return list of the actions which passed, in the same order
+"""
+def preflight(actions):
+    if not actions:
+        return []
+    calls = []
+    for idx, action in actions:
+        address = State.orchestrators[idx].source_checksum_address
+        if action == "reward":
+            calls.append((bonding_contract.functions.isActiveTranscoder(address), address))
+            calls.append((bonding_contract.functions.reward(), address))
+        elif action == "transferBond":
+            calls.append((bonding_contract.functions.pendingStake(address, 99999), address))
+            calls.append((transferBondFunction(idx), address))
+        else:
+            calls.append((bonding_contract.functions.pendingFees(address, 99999), address))
+            calls.append((withdrawFeesFunction(idx), address))
+    try:
+        results = simulateCalls(calls)
+    except Exception as e:
+        # Without a pre-flight check, the transactions themselves will tell whether they fail
+        Util.log("Unable to run pre-flight checks, sending all transactions: {0}".format(e), 1)
+        return actions
+    passed = []
+    for i, (idx, action) in enumerate(actions):
+        (check_ok, check), (simulation_ok, simulation) = results[i * 2:i * 2 + 2]
+        if action == "reward":
+            required = True
+        elif action == "transferBond":
+            required = getTransferBondAmount(idx)
+        else:
+            required = getWithdrawFeesAmount(idx)
+        if not check_ok:
+            Util.log("Skipping {0} for {1}, its state could not be checked: {2}".format(action, State.orchestrators[idx].source_address, check), 1)
+        elif not check or check < required:
+            reason = "not an active transcoder" if action == "reward" else "only {0} pending, need {1}".format(check, required)
+            Util.log("Skipping {0} for {1}: {2}".format(action, State.orchestrators[idx].source_address, reason), 1)
+        elif not simulation_ok:
+            Util.log("Skipping {0} for {1}, it would revert: {2}".format(action, State.orchestrators[idx].source_address, simulation), 1)
+        else:
+            passed.append((idx, action))
+    Util.log("{0} of {1} planned transaction(s) passed pre-flight checks".format(len(passed), len(actions)), 3)
+    return passed
+
 
 ### Round refresh logic
 
 
 """
-@brief Refreshes the current round number
+@brief Refreshes the current round number and estimates when the next round starts
 """
 def refreshRound():
     try:
-        this_round = rounds_contract.functions.currentRound().call()
+        with w3.batch_requests() as batch:
+            batch.add(rounds_contract.functions.currentRound().call(block_identifier=readBlock()))
+            batch.add(rounds_contract.functions.currentRoundStartBlock().call(block_identifier=readBlock()))
+            batch.add(rounds_contract.functions.roundLength().call(block_identifier=readBlock()))
+            batch.add(rounds_contract.functions.blockNum().call(block_identifier=readBlock()))
+            this_round, start_block, round_length, l1_block = batch.execute()
         State.previous_round_refresh = datetime.now(timezone.utc).timestamp()
         Util.log("Current round number is {0}".format(this_round), 2)
         State.current_round_num = this_round
+        # Rounds flip at a fixed L1 block, so we know roughly when to expect the next one
+        blocks_left = max(0, start_block + round_length - l1_block)
+        State.next_round_eta = State.previous_round_refresh + blocks_left * L1_BLOCK_TIME
+        Util.log("Next round starts in {0} L1 blocks (~{1:.0f} minutes)".format(blocks_left, blocks_left * L1_BLOCK_TIME / 60), 3)
     except Exception as e:
         Util.log("Unable to refresh round number: {0}".format(e), 1)
 
@@ -446,7 +1247,7 @@ def refreshRound():
 """
 def refreshLock():
     try:
-        new_lock = rounds_contract.functions.currentRoundLocked().call()
+        new_lock = cachedCall(rounds_contract.functions.currentRoundLocked())
         Util.log("Current round lock status is {0}".format(new_lock), 2)
         State.current_round_is_locked = new_lock
     except Exception as e:
@@ -462,7 +1263,7 @@ def refreshRewardRound(idx):
         #                              lastActiveStakeUpdateRound, activationRound, deactivationRound,
         #                              activeCumulativeRewards, cumulativeRewards, cumulativeFees,
         #                              lastFeeRound]
-        orchestrator_info = bonding_contract.functions.getTranscoder(State.orchestrators[idx].source_checksum_address).call()
+        orchestrator_info = cachedCall(bonding_contract.functions.getTranscoder(State.orchestrators[idx].source_checksum_address))
         State.orchestrators[idx].previous_reward_round = orchestrator_info[0]
         State.orchestrators[idx].previous_round_refresh = datetime.now(timezone.utc).timestamp()
         Util.log("Latest reward round for {0} is {1}".format(State.orchestrators[idx].source_address, State.orchestrators[idx].previous_reward_round), 2)
@@ -479,10 +1280,12 @@ def refreshRewardRound(idx):
 """
 def refreshStake(idx):
     try:
-        pending_lptu = bonding_contract.functions.pendingStake(State.orchestrators[idx].source_checksum_address, 99999).call()
+        pending_lptu = cachedCall(bonding_contract.functions.pendingStake(State.orchestrators[idx].source_checksum_address, 99999))
         pending_lpt = web3.Web3.from_wei(pending_lptu, 'ether')
-        State.orchestrators[idx].balance_LPT_pending = pending_lpt
-        State.orchestrators[idx].previous_LPT_refresh = datetime.now(timezone.utc).timestamp()
+        now = datetime.now(timezone.utc).timestamp()
+        # Also keeps track of how fast stake is coming in, to know when to check again
+        Planner.recordStake(idx, pending_lpt, now)
+        Balances.record(idx, "balance_LPT_pending", now, pending_lpt)
         Util.log("{0} currently has {1:.2f} LPT available for unstaking".format(State.orchestrators[idx].source_address, pending_lpt), 2)
     except Exception as e:
         Util.log("Unable to refresh stake: '{0}'".format(e), 1)
@@ -493,55 +1296,131 @@ def refreshStake(idx):
 """
 def doTransferBond(idx):
     try:
-        transfer_amount = web3.Web3.to_wei(float(State.orchestrators[idx].balance_LPT_pending) - State.LPT_MINVAL, 'ether')
+        transfer_amount = getTransferBondAmount(idx)
         Util.log("Going to transfer {0} LPTU bond to {1}".format(transfer_amount, State.orchestrators[idx].receiver_address_LPT), 2)
         # Build transaction info
-        transaction_obj = bonding_contract.functions.transferBond(State.orchestrators[idx].receiver_checksum_address_LPT, transfer_amount,
-            web3.constants.ADDRESS_ZERO, web3.constants.ADDRESS_ZERO, web3.constants.ADDRESS_ZERO,
-            web3.constants.ADDRESS_ZERO).build_transaction(
+        transaction_obj = transferBondFunction(idx).build_transaction(
             {
                 "from": State.orchestrators[idx].source_checksum_address,
-                'maxFeePerGas': 2000000000,
-                'maxPriorityFeePerGas': 1000000000,
+                **getFees(),
                 "nonce": w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address)
             }
         )
-        # Sign and initiate transaction
-        signed_transaction = w3.eth.account.sign_transaction(transaction_obj, State.orchestrators[idx].source_private_key)
-        transaction_hash = w3.eth.send_raw_transaction(signed_transaction.raw_transaction)
-        Util.log("Initiated transaction with hash {0}".format(transaction_hash.hex()), 2)
-        # Wait for transaction to be confirmed
-        receipt = w3.eth.wait_for_transaction_receipt(transaction_hash)
+        # Sign and initiate transaction, then wait for it to be confirmed
+        receipt = sendTransaction(idx, transaction_obj, "transferBond")
         # Util.log("Completed transaction {0}".format(receipt))
+        followReceipt(receipt)
         Util.log('Transfer bond success.', 2)
     except Exception as e:
         Util.log("Unable to transfer bond: {0}".format(e), 1)
 
 """
-@brief Calls reward for the Orchestrator
-@param idx: which Orch # in the set to call reward for
+@brief Returns the amount of LPT to transfer, in LPTU: all pending stake but LPT_MINVAL
 """
-def doCallReward(idx):
+def getTransferBondAmount(idx):
+    return web3.Web3.to_wei(float(State.orchestrators[idx].balance_LPT_pending) - State.LPT_MINVAL, 'ether')
+
+"""
+@brief Returns the transferBond call which moves the pending stake to the LPT receiver
+"""
+def transferBondFunction(idx):
+    return bonding_contract.functions.transferBond(State.orchestrators[idx].receiver_checksum_address_LPT, getTransferBondAmount(idx),
+        web3.constants.ADDRESS_ZERO, web3.constants.ADDRESS_ZERO, web3.constants.ADDRESS_ZERO,
+        web3.constants.ADDRESS_ZERO)
+
+"""
+@brief Builds and signs the reward transaction for the next round ahead of time
+Nonce, gas and fee parameters are fixed up front, so that at the round boundary
+calling reward only takes a single eth_sendRawTransaction.
+@param idx: which Orch # in the set to prepare reward for
+@param nonce: nonce to use, looked up if not given
+@param max_fee: maxFeePerGas to use
+"""
+def prepareReward(idx, nonce=None, max_fee=MAX_FEE_PER_GAS):
     try:
-        Util.log("Calling reward for {0}".format(State.orchestrators[idx].source_address), 2)
-        # Build transaction info
+        orch = State.orchestrators[idx]
+        if nonce is None:
+            nonce = w3.eth.get_transaction_count(orch.source_checksum_address, 'pending')
+        fees = getFees(max_fee)
+        # We cannot estimate gas before the round flips, as reward() reverts until then
+        gas = int(orch.reward_gas_used * 1.5) if orch.reward_gas_used else REWARD_GAS_LIMIT
+        # With gas and chainId given, build_transaction does not need to do any RPC calls
         transaction_obj = bonding_contract.functions.reward().build_transaction(
             {
-                "from": State.orchestrators[idx].source_checksum_address,
-                'maxFeePerGas': 2000000000,
-                'maxPriorityFeePerGas': 1000000000,
-                "nonce": w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address)
+                "from": orch.source_checksum_address,
+                **fees,
+                "nonce": nonce,
+                "gas": gas,
+                "chainId": ARBITRUM_CHAIN_ID
             }
         )
-        # Sign and initiate transaction
-        signed_transaction = w3.eth.account.sign_transaction(transaction_obj, State.orchestrators[idx].source_private_key)
-        transaction_hash = w3.eth.send_raw_transaction(signed_transaction.raw_transaction)
+        signed_transaction = w3.eth.account.sign_transaction(transaction_obj, orch.source_private_key)
+        orch.prepared_reward = {
+            "raw": signed_transaction.raw_transaction,
+            "transaction": transaction_obj,
+            "nonce": nonce,
+            "maxFeePerGas": fees["maxFeePerGas"]
+        }
+        Util.log("Pre-signed reward for {0} with nonce {1}".format(orch.source_address, nonce), 3)
+    except Exception as e:
+        State.orchestrators[idx].prepared_reward = None
+        Util.log("Unable to pre-sign reward: {0}".format(e), 1)
+
+"""
+@brief Cheaply re-validates a pre-signed reward transaction, re-signing it when it went stale
+Does a single batched request for the pending nonce, gas price and round initialization.
+@param idx: which Orch # in the set to check
+@return True if the prepared transaction can be broadcast right now
+"""
+def validatePreparedReward(idx):
+    orch = State.orchestrators[idx]
+    with w3.batch_requests() as batch:
+        batch.add(w3.eth.get_transaction_count(orch.source_checksum_address, 'pending'))
+        batch.add(w3.eth.gas_price)
+        batch.add(rounds_contract.functions.currentRoundInitialized())
+        nonce, gas_price, initialized = batch.execute()
+    if not initialized:
+        Util.log("Round {0} is not initialized yet, holding on to the pre-signed reward".format(State.current_round_num), 2)
+        return False
+    if nonce != orch.prepared_reward["nonce"] or gas_price > orch.prepared_reward["maxFeePerGas"]:
+        Util.log("Pre-signed reward for {0} went stale (nonce {1}, gas price {2}), re-signing".format(orch.source_address, nonce, gas_price), 2)
+        prepareReward(idx, nonce, max(MAX_FEE_PER_GAS, gas_price * 2))
+    return orch.prepared_reward is not None
+
+"""
+@brief Calls reward for the Orchestrator
+Broadcasts the pre-signed transaction if there is one, else builds one on the spot
+@param idx: which Orch # in the set to call reward for
+"""
+def doCallReward(idx):
+    try:
+        Util.log("Calling reward for {0}".format(State.orchestrators[idx].source_address), 2)
+        if State.orchestrators[idx].prepared_reward is not None:
+            if not validatePreparedReward(idx):
+                return
+            transaction_obj = State.orchestrators[idx].prepared_reward["transaction"]
+            transaction_hash = w3.eth.send_raw_transaction(State.orchestrators[idx].prepared_reward["raw"])
+        else:
+            # Build transaction info
+            transaction_obj = bonding_contract.functions.reward().build_transaction(
+                {
+                    "from": State.orchestrators[idx].source_checksum_address,
+                    **getFees(),
+                    "nonce": w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address)
+                }
+            )
+            # Sign and initiate transaction
+            transaction_hash = signAndSend(idx, transaction_obj)
+        State.orchestrators[idx].prepared_reward = None
         Util.log("Initiated transaction with hash {0}".format(transaction_hash.hex()), 2)
-        # Wait for transaction to be confirmed
-        receipt = w3.eth.wait_for_transaction_receipt(transaction_hash)
+        # Wait for transaction to be confirmed, bumping fees if it gets stuck so it still lands this round
+        receipt = superviseTransaction(idx, transaction_obj, transaction_hash, "reward")
         # Util.log("Completed transaction {0}".format(receipt))
+        followReceipt(receipt)
+        State.orchestrators[idx].reward_gas_used = receipt["gasUsed"]
         Util.log('Call to reward success.', 2)
     except Exception as e:
+        State.orchestrators[idx].prepared_reward = None
         Util.log("Unable to call reward: {0}".format(e), 1)
 
 """
@@ -566,17 +1445,12 @@ def doTranscoder(idx, reward_percent_to_keep, fee_percent_to_keep):
         transaction_obj = bonding_contract.functions.transcoder(reward_cut, fee_share).build_transaction(
             {
                 "from": State.orchestrators[idx].source_checksum_address,
-                'maxFeePerGas': 2000000000,
-                'maxPriorityFeePerGas': 1000000000,
+                **getFees(),
                 "nonce": w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address)
             }
         )
-        # Sign and initiate transaction
-        signed_transaction = w3.eth.account.sign_transaction(transaction_obj, State.orchestrators[idx].source_private_key)
-        transaction_hash = w3.eth.send_raw_transaction(signed_transaction.raw_transaction)
-        Util.log("Initiated transaction with hash {0}".format(transaction_hash.hex()), 2)
-        # Wait for transaction to be confirmed
-        receipt = w3.eth.wait_for_transaction_receipt(transaction_hash)
+        # Sign and initiate transaction, then wait for it to be confirmed
+        receipt = sendTransaction(idx, transaction_obj, "transcoder")
         # Util.log("Completed transaction {0}".format(receipt))
         Util.log('Transcoder rates set successfully', 2)
     except Exception as e:
@@ -592,10 +1466,12 @@ def doTranscoder(idx, reward_percent_to_keep, fee_percent_to_keep):
 """
 def refreshFees(idx):
     try:
-        pending_wei = bonding_contract.functions.pendingFees(State.orchestrators[idx].source_checksum_address, 99999).call()
+        pending_wei = cachedCall(bonding_contract.functions.pendingFees(State.orchestrators[idx].source_checksum_address, 99999))
         pending_eth = web3.Web3.from_wei(pending_wei, 'ether')
-        State.orchestrators[idx].balance_ETH_pending = pending_eth
-        State.orchestrators[idx].previous_ETH_refresh = datetime.now(timezone.utc).timestamp()
+        now = datetime.now(timezone.utc).timestamp()
+        # Also keeps track of how fast fees are coming in, to know when to check again
+        Planner.recordFees(idx, pending_eth, now)
+        Balances.record(idx, "balance_ETH_pending", now, pending_eth)
         Util.log("{0} has {1:.6f} ETH in pending fees".format(State.orchestrators[idx].source_address, pending_eth), 2)
     except Exception as e:
         Util.log("Unable to refresh fees: '{0}'".format(e), 1)
@@ -606,45 +1482,57 @@ def refreshFees(idx):
 """
 def doWithdrawFees(idx):
     try:
-        # We take a little bit off due to floating point inaccuracies causing tx's to fail
-        transfer_amount = web3.Web3.to_wei(float(State.orchestrators[idx].balance_ETH_pending) - 0.00001, 'ether')
-        receiver_address = State.orchestrators[idx].source_checksum_address
+        transfer_amount = getWithdrawFeesAmount(idx)
         if not State.WITHDRAW_TO_RECEIVER:
             Util.log("Withdrawing {0} WEI to {1}".format(transfer_amount, State.orchestrators[idx].source_address), 2)
         elif State.orchestrators[idx].balance_ETH < State.ETH_MINVAL:
             Util.log("{0} has a balance of {1:.4f} ETH. Withdrawing fees to the Orch wallet to maintain the minimum balance of {2:.4f}".format(State.orchestrators[idx].source_address, State.orchestrators[idx].balance_ETH, State.ETH_MINVAL), 2)
         else:
-            receiver_address = State.orchestrators[idx].target_checksum_address_ETH
             Util.log("Withdrawing {0} WEI directly to receiver wallet {1}".format(transfer_amount, State.orchestrators[idx].target_address_ETH), 2)
         # Build transaction info
-        transaction_obj = bonding_contract.functions.withdrawFees(receiver_address, transfer_amount).build_transaction(
+        transaction_obj = withdrawFeesFunction(idx).build_transaction(
             {
                 "from": State.orchestrators[idx].source_checksum_address,
-                'maxFeePerGas': 2000000000,
-                'maxPriorityFeePerGas': 1000000000,
+                **getFees(),
                 "nonce": w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address)
             }
         )
-        # Sign and initiate transaction
-        signed_transaction = w3.eth.account.sign_transaction(transaction_obj, State.orchestrators[idx].source_private_key)
-        transaction_hash = w3.eth.send_raw_transaction(signed_transaction.raw_transaction)
-        Util.log("Initiated transaction with hash {0}".format(transaction_hash.hex()), 2)
-        # Wait for transaction to be confirmed
-        receipt = w3.eth.wait_for_transaction_receipt(transaction_hash)
+        # Sign and initiate transaction, then wait for it to be confirmed
+        receipt = sendTransaction(idx, transaction_obj, "withdrawFees")
         # Util.log("Completed transaction {0}".format(receipt))
+        followReceipt(receipt)
         Util.log('Withdraw fees success.', 2)
     except Exception as e:
         Util.log("Unable to withdraw fees: '{0}'".format(e), 1)
 
+"""
+@brief Returns the amount of fees to withdraw, in wei
+"""
+def getWithdrawFeesAmount(idx):
+    # We take a little bit off due to floating point inaccuracies causing tx's to fail
+    return web3.Web3.to_wei(float(State.orchestrators[idx].balance_ETH_pending) - 0.00001, 'ether')
+
+"""
+@brief Returns the withdrawFees call, which withdraws to the receiver wallet if configured
+and the Orch wallet still holds at least ETH_MINVAL
+"""
+def withdrawFeesFunction(idx):
+    orch = State.orchestrators[idx]
+    receiver_address = orch.source_checksum_address
+    if State.WITHDRAW_TO_RECEIVER and orch.balance_ETH >= State.ETH_MINVAL:
+        receiver_address = orch.target_checksum_address_ETH
+    return bonding_contract.functions.withdrawFees(receiver_address, getWithdrawFeesAmount(idx))
+
 """
 @brief Updates known ETH balance of the Orch
 @param idx: which Orch # in the set to check
 """
 def checkEthBalance(idx):
     try:
-        balance_wei = w3.eth.get_balance(State.orchestrators[idx].source_checksum_address)
+        balance_wei = cachedBalance(State.orchestrators[idx].source_checksum_address)
         balance_ETH = web3.Web3.from_wei(balance_wei, 'ether')
         State.orchestrators[idx].balance_ETH = balance_ETH
+        Balances.record(idx, "balance_ETH", datetime.now(timezone.utc).timestamp(), balance_ETH)
         Util.log("{0} currently has {1:.4f} ETH in their wallet".format(State.orchestrators[idx].source_address, balance_ETH), 2)
         if balance_ETH < State.ETH_WARN:
             Util.log("{0} should top up their ETH balance ASAP!".format(State.orchestrators[idx].source_address), 1)
@@ -666,18 +1554,14 @@ def doSendFees(idx):
             'value': transfer_amount,
             "nonce": w3.eth.get_transaction_count(State.orchestrators[idx].source_checksum_address),
             'gas': 300000,
-            'maxFeePerGas': 2000000000,
-            'maxPriorityFeePerGas': 1000000000,
+            **getFees(),
             'chainId': 42161
         }
 
-        # Sign and initiate transaction
-        signed_transaction = w3.eth.account.sign_transaction(transaction_obj, State.orchestrators[idx].source_private_key)
-        transaction_hash = w3.eth.send_raw_transaction(signed_transaction.raw_transaction)
-        Util.log("Initiated transaction with hash {0}".format(transaction_hash.hex()), 2)
-        # Wait for transaction to be confirmed
-        receipt = w3.eth.wait_for_transaction_receipt(transaction_hash)
+        # Sign and initiate transaction, then wait for it to be confirmed
+        receipt = sendTransaction(idx, transaction_obj, "sendFees")
         # Util.log("Completed transaction {0}".format(receipt))
+        followReceipt(receipt)
         Util.log('Transfer ETH success.', 2)
     except Exception as e:
         Util.log("Unable to send ETH: {0}".format(e), 1)
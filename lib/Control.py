@@ -0,0 +1,232 @@
+# Local control socket, so an operator can use the interactive menus while the siphon keeps running
+# The siphon process serves a small JSON request/response API over a Unix socket,
+# a second process started with `--attach` connects to it and runs the usual menus against it
+import socket #< Unix domain sockets
+import socketserver #< Serving requests from a background thread
+import threading #< Running the server next to the siphon loop
+import json #< Encoding requests and responses
+import os #< Socket file permissions
+import decimal #< Encoding LPT/ETH amounts
+# Import our own libraries
+from lib import Balances, Contract, EarningsPool, History, Prefetch, State, User, Util
+
+
+# Read-only requests, answered from a cache where it makes sense
+READ_METHODS = ["getOrchestrators", "getStatus", "getProposals", "getVotes", "hasVoted", "getHasVoted", "getPolls", "getPollVotes", "getTranscoderPool",
+                "updateEarningsHistory", "getRoundSummary", "getYields", "getBalanceHistory"]
+# Requests which send transactions, these wait for the siphon loop to finish its current cycle
+WRITE_METHODS = ["doCastVote", "doCastVoteWithReason", "doCastVotes", "doCastPollVote", "doCastPollVotes", "doTranscoder"]
+# Governance scans are slow, these get answered from the data prefetched while siphoning
+PREFETCHED_METHODS = ["getProposals", "getPolls"]
+
+
+### Server side
+
+
+"""
+@brief Encodes values which JSON does not support out of the box
+"""
+def encodeValue(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError("Cannot encode {0}".format(type(value).__name__))
+
+def getOrchestrators():
+    return [{"source_address": orch.source_address, "source_checksum_address": orch.source_checksum_address} for orch in State.orchestrators]
+
+def getStatus():
+    return {
+        "round": State.current_round_num,
+        "locked": State.current_round_is_locked,
+        "orchestrators": [{
+            "source_address": orch.source_address,
+            "balance_LPT_pending": orch.balance_LPT_pending,
+            "balance_ETH_pending": orch.balance_ETH_pending,
+            "balance_ETH": orch.balance_ETH,
+            "previous_reward_round": orch.previous_reward_round
+        } for orch in State.orchestrators]
+    }
+
+def updateEarningsHistory():
+    # Only the siphon process scans for and writes the earnings data
+    History.updateIndex()
+    EarningsPool.update()
+
+def getRoundSummary(address, days):
+    return History.getRoundSummary(address, days)
+
+def getYields(address):
+    return EarningsPool.getYields(address)
+
+def getBalanceHistory(address, series, start, end):
+    return Balances.query(address, series, start, end)
+
+def getPollVotes(pollAddresses, voterAddresses):
+    # Tuple keys do not survive JSON, send a list of rows instead
+    votes = Contract.getPollVotes(pollAddresses, voterAddresses)
+    return [[poll, voter, choice] for (poll, voter), choice in votes.items()]
+
+"""
+@brief Executes a single request
+@return response dict with either a `result` or an `error`
+"""
+def dispatch(request):
+    method = request.get("method", "")
+    params = request.get("params", [])
+    if method not in READ_METHODS and method not in WRITE_METHODS:
+        return {"error": "Unknown method '{0}'".format(method)}
+    if method in ("getOrchestrators", "getStatus", "getPollVotes", "updateEarningsHistory", "getRoundSummary", "getYields", "getBalanceHistory"):
+        handler = globals()[method]
+    elif method in PREFETCHED_METHODS:
+        handler = getattr(Prefetch, method)
+    else:
+        handler = getattr(Contract, method)
+    try:
+        if method in WRITE_METHODS:
+            with State.tx_lock:
+                return {"result": handler(*params)}
+        return {"result": handler(*params)}
+    except Exception as e:
+        return {"error": str(e)}
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Handles newline delimited JSON requests until the client disconnects."""
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"error": "Invalid JSON"}
+            else:
+                Util.log("Control socket request: {0}".format(request.get("method")), 3)
+                response = dispatch(request)
+            self.wfile.write((json.dumps(response, default=encodeValue) + "\n").encode())
+            self.wfile.flush()
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+"""
+@brief Starts serving the control socket from a background thread
+@return the server, or None if the control socket is disabled or unavailable
+"""
+def startServer():
+    if not State.CONTROL_SOCKET or not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        if os.path.exists(State.CONTROL_SOCKET):
+            os.remove(State.CONTROL_SOCKET)
+        server = ControlServer(State.CONTROL_SOCKET, RequestHandler)
+        # Only our own user may talk to the siphon
+        os.chmod(State.CONTROL_SOCKET, 0o600)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        Util.log("Listening for interactive clients on {0}".format(State.CONTROL_SOCKET), 2)
+        return server
+    except Exception as e:
+        Util.log("Unable to start the control socket: {0}".format(e), 1)
+        return None
+
+
+### Client side
+
+
+class AttachedOrchestrator:
+    """The parts of an Orchestrator the menus need, as reported by the siphon process."""
+    def __init__(self, obj):
+        self.source_address = obj["source_address"]
+        self.source_checksum_address = obj["source_checksum_address"]
+
+class ControlClient:
+    """
+    Drop-in replacement for the Contract functions used by the interactive menus,
+    forwarding every call to a running siphon process.
+    """
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.reader = self.sock.makefile("r")
+
+    def call(self, method, *params):
+        self.sock.sendall((json.dumps({"method": method, "params": list(params)}) + "\n").encode())
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("The siphon closed the control socket")
+        response = json.loads(line)
+        if "error" in response:
+            Util.log("Siphon could not handle '{0}': {1}".format(method, response["error"]), 1)
+            return None
+        return response["result"]
+
+    def getProposals(self):
+        return self.call("getProposals") or []
+
+    def getVotes(self, proposalId):
+        return self.call("getVotes", proposalId)
+
+    def hasVoted(self, proposalId, address):
+        return self.call("hasVoted", proposalId, address)
+
+    def doCastVote(self, idx, proposalId, value):
+        return self.call("doCastVote", idx, proposalId, value)
+
+    def doCastVoteWithReason(self, idx, proposalId, value, reason):
+        return self.call("doCastVoteWithReason", idx, proposalId, value, reason)
+
+    def getHasVoted(self, proposalId, addresses):
+        return self.call("getHasVoted", proposalId, addresses) or {}
+
+    def doCastVotes(self, idxs, proposalId, value, reason=""):
+        return self.call("doCastVotes", idxs, proposalId, value, reason) or []
+
+    def getPolls(self):
+        return self.call("getPolls") or []
+
+    def getPollVotes(self, pollAddresses, voterAddresses):
+        rows = self.call("getPollVotes", pollAddresses, voterAddresses) or []
+        return {(poll, voter): choice for poll, voter, choice in rows}
+
+    def doCastPollVote(self, idx, pollAddress, choiceId):
+        return self.call("doCastPollVote", idx, pollAddress, choiceId)
+
+    def doCastPollVotes(self, idxs, pollAddress, choiceId):
+        return self.call("doCastPollVotes", idxs, pollAddress, choiceId) or []
+
+    def getTranscoderPool(self):
+        return self.call("getTranscoderPool")
+
+    def updateEarningsHistory(self):
+        return self.call("updateEarningsHistory")
+
+    def getRoundSummary(self, address, days):
+        return self.call("getRoundSummary", address, days)
+
+    def getYields(self, address):
+        return self.call("getYields", address)
+
+    def getBalanceHistory(self, address, series, start, end):
+        return self.call("getBalanceHistory", address, series, start, end)
+
+    def doTranscoder(self, idx, reward_percent_to_keep, fee_percent_to_keep):
+        return self.call("doTranscoder", idx, reward_percent_to_keep, fee_percent_to_keep)
+
+"""
+@brief Attaches to a running siphon and runs the interactive menus against it
+"""
+def runClient():
+    try:
+        client = ControlClient(State.CONTROL_SOCKET)
+    except Exception as e:
+        Util.log("Unable to attach to the siphon on {0}: {1}".format(State.CONTROL_SOCKET, e), 1)
+        return
+    status = client.call("getStatus")
+    orchestrators = client.call("getOrchestrators")
+    if status is None or orchestrators is None:
+        Util.log("Fatal error: the siphon on {0} did not report its status. Exiting...".format(State.CONTROL_SOCKET), 1)
+        exit(1)
+    State.orchestrators = [AttachedOrchestrator(obj) for obj in orchestrators]
+    Util.log("Attached to the siphon, round {0} ({1} Orchestrators)".format(status["round"], len(State.orchestrators)), 2)
+    User.backend = client
+    State.LOCK_INTERACTIVE = True
+    User.handleUserInput()
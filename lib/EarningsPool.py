@@ -0,0 +1,139 @@
+# Keeps a local copy of the per-round earnings pools of our Orchestrators
+# Earnings pools hold the cumulative reward and fee factors of a transcoder, which tell how much
+# every LPT staked to it earned. Finished rounds never change, so each one only gets fetched once
+# and appended to a compact file. Reward APR and fee yield get computed from there.
+import json #< Encoding rows of the pools file
+import os #< Flushing appended rows to disk
+# Import our own libraries
+from lib import Contract, State, Util
+
+
+POOLS_FILE = "earnings_pools.jsonl"
+# Rolling windows to compute yields over, in days
+YIELD_WINDOWS = [7, 30, 90]
+
+# Loaded lazily from disk: (address, round) -> [totalStake, rewardCut, feeShare, cumulativeRewardFactor, cumulativeFeeFactor]
+pools = None
+round_length = 0  # Length of a round in L1 blocks
+
+
+"""
+@brief Loads the pools file from disk if it isn't already
+Each line is a JSON array [address, round, totalStake, rewardCut, feeShare, cumulativeRewardFactor, cumulativeFeeFactor]
+"""
+def loadPools():
+    global pools
+    if pools is not None:
+        return pools
+    pools = {}
+    path = Util.getDataPath(POOLS_FILE)
+    if not Util.checkPath(path):
+        return pools
+    with open(path) as file:
+        for line in file:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # A crash while appending can leave a partial last line behind
+                continue
+            pools[(row[0], row[1])] = row[2:]
+    return pools
+
+"""
+@brief Appends rows to the pools file
+"""
+def appendRows(rows):
+    with open(Util.getDataPath(POOLS_FILE), 'a') as file:
+        for row in rows:
+            file.write(json.dumps(row, separators=(',', ':')) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+"""
+@brief Returns the amount of rounds in a day
+"""
+def roundsPerDay():
+    global round_length
+    if not round_length:
+        round_length = Contract.cachedCall(Contract.rounds_contract.functions.roundLength())
+    return 86400 / (round_length * Contract.L1_BLOCK_TIME)
+
+"""
+@brief Fetches the earnings pools of all finished rounds which are not stored yet
+The first update backfills HISTORY_DAYS worth of rounds, after that only new rounds get fetched
+"""
+def update():
+    loadPools()
+    try:
+        if not State.current_round_num:
+            Contract.refreshRound()
+        last_round = State.current_round_num - 1
+        first_round = max(1, last_round - int(State.HISTORY_DAYS * roundsPerDay()))
+        missing = []
+        for orch in State.orchestrators:
+            for round_num in range(first_round, last_round + 1):
+                if (orch.source_checksum_address, round_num) not in pools:
+                    missing.append((orch.source_checksum_address, round_num))
+        if not missing:
+            return
+        Util.log("Fetching {0} earnings pool(s) up to round {1}".format(len(missing), last_round), 2)
+        results = Contract.batchCalls([
+            Contract.bonding_contract.functions.getTranscoderEarningsPoolForRound(address, round_num)
+            for address, round_num in missing
+        ])
+        rows = []
+        for (address, round_num), pool in zip(missing, results):
+            pools[(address, round_num)] = list(pool)
+            rows.append([address, round_num] + list(pool))
+        appendRows(rows)
+    except Exception as e:
+        Util.log("Unable to update earnings pools: {0}".format(e), 1)
+
+"""
+@brief Returns the cumulative factors as of each round in a range
+The factors only get written in rounds where the Orchestrator called reward or received fees,
+in between the last written value still applies
+@return list of (cumulativeRewardFactor, cumulativeFeeFactor), or None for rounds before any were written
+"""
+def getFactors(address, first_round, last_round):
+    stored = [round_num for pool_address, round_num in pools if pool_address == address]
+    factors = []
+    reward_factor = 0
+    fee_factor = 0
+    # Start at the oldest stored round, so the range picks up factors written before it
+    for round_num in range(min(stored + [first_round]), last_round + 1):
+        pool = pools.get((address, round_num))
+        if pool is not None:
+            reward_factor = pool[3] or reward_factor
+            fee_factor = pool[4] or fee_factor
+        if round_num >= first_round:
+            factors.append((reward_factor, fee_factor) if reward_factor else None)
+    return factors
+
+"""
+@brief Computes the yield of stake delegated to an Orchestrator over rolling windows
+The cumulative reward factor grows by the share of rewards which goes to delegators, fees per staked LPT
+are the growth of the cumulative fee factor divided by the reward factor at the start of the window
+@param address: checksum address of the Orchestrator
+@return list of dicts with the window in `days`, the `rounds` it covers, the annualized `reward_APR` in %
+        and the `fee_yield` in ETH per 1000 LPT staked over the window
+"""
+def getYields(address):
+    loadPools()
+    rounds_per_day = roundsPerDay()
+    last_round = State.current_round_num - 1
+    yields = []
+    for days in YIELD_WINDOWS:
+        window = max(1, round(days * rounds_per_day))
+        factors = getFactors(address, last_round - window, last_round)
+        start, end = factors[0], factors[-1]
+        if start is None or end is None:
+            continue
+        reward_growth = end[0] / start[0] - 1
+        yields.append({
+            "days": days,
+            "rounds": window,
+            "reward_APR": reward_growth * 365 / days * 100,
+            "fee_yield": (end[1] - start[1]) / start[0] * 1000
+        })
+    return yields
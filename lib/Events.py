@@ -0,0 +1,104 @@
+# Minimal decoders for raw eth_getLogs results
+# These skip web3's generic event machinery and only decode the fields we actually use
+# NOTE: this file must not import Contract, so it can be used without an RPC connection
+import web3 #< Hashing event signatures & checksumming addresses
+from eth_abi import decode #< Full ABI decoding, only done lazily
+from web3.datastructures import AttributeDict #< Same shape as web3's decoded event args
+
+
+PROPOSAL_CREATED_SIGNATURE = "ProposalCreated(uint256,address,address[],uint256[],string[],bytes[],uint256,uint256,string)"
+PROPOSAL_CREATED_TOPIC = web3.Web3.to_hex(web3.Web3.keccak(text=PROPOSAL_CREATED_SIGNATURE))
+PROPOSAL_CREATED_NAMES = ["proposalId", "proposer", "targets", "values", "signatures", "calldatas", "voteStart", "voteEnd", "description"]
+PROPOSAL_CREATED_TYPES = ["uint256", "address", "address[]", "uint256[]", "string[]", "bytes[]", "uint256", "uint256", "string"]
+
+
+"""
+@brief Converts the data field of a raw log to bytes
+@param data: hex string or bytes
+"""
+def toBytes(data):
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    return bytes.fromhex(data[2:] if data.startswith("0x") else data)
+
+"""
+@brief Reads the 32-byte ABI word at position `index` as an unsigned integer
+"""
+def readWord(data, index):
+    return int.from_bytes(data[index * 32:(index + 1) * 32], "big")
+
+
+class ProposalCreatedLog:
+    """
+    Lazily decoded ProposalCreated log.
+    The static head words (id, proposer, vote window) are read directly from the log data.
+    The title only decodes the first line of the description, everything else is
+    ABI-decoded on first access of `args`.
+    """
+    __slots__ = ("address", "blockNumber", "transactionHash", "logIndex", "data", "_args", "_title")
+    event_name = "ProposalCreated"
+
+    def __init__(self, raw_log):
+        self.address = raw_log["address"]
+        self.blockNumber = raw_log["blockNumber"]
+        self.transactionHash = raw_log["transactionHash"]
+        self.logIndex = raw_log["logIndex"]
+        self.data = toBytes(raw_log["data"])
+        self._args = None
+        self._title = None
+
+    @property
+    def proposalId(self):
+        return readWord(self.data, 0)
+
+    @property
+    def proposer(self):
+        return web3.Web3.to_checksum_address(self.data[44:64])
+
+    @property
+    def voteStart(self):
+        return readWord(self.data, 6)
+
+    @property
+    def voteEnd(self):
+        return readWord(self.data, 7)
+
+    @property
+    def targets(self):
+        """Decodes only the targets array (head word 2 points to its length-prefixed body)."""
+        offset = readWord(self.data, 2)
+        length = int.from_bytes(self.data[offset:offset + 32], "big")
+        return [
+            web3.Web3.to_checksum_address(self.data[offset + 32 * (i + 1) + 12:offset + 32 * (i + 2)])
+            for i in range(length)
+        ]
+
+    @property
+    def title(self):
+        """First line of the description, without decoding the rest of the markdown body."""
+        if self._title is None:
+            offset = readWord(self.data, 8)
+            length = int.from_bytes(self.data[offset:offset + 32], "big")
+            start = offset + 32
+            end = self.data.find(b"\n", start, start + length)
+            if end == -1:
+                end = start + length
+            self._title = self.data[start:end].decode("utf-8", errors="replace")
+        return self._title
+
+    @property
+    def args(self):
+        """Fully decoded event arguments, decoded once on first use."""
+        if self._args is None:
+            values = decode(PROPOSAL_CREATED_TYPES, self.data)
+            args = dict(zip(PROPOSAL_CREATED_NAMES, values))
+            args["proposer"] = web3.Web3.to_checksum_address(args["proposer"])
+            args["targets"] = [web3.Web3.to_checksum_address(target) for target in args["targets"]]
+            self._args = AttributeDict(args)
+        return self._args
+
+
+# Raw decoders by topic0, used by the log scanners in place of web3's event decoding
+RAW_DECODERS = {
+    PROPOSAL_CREATED_TOPIC: ProposalCreatedLog
+}
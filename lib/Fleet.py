@@ -0,0 +1,130 @@
+# Columnar state of all Orchestrators in the fleet
+# Balances, refresh timestamps and reward rounds live in one array per field instead of on each Orchestrator,
+# so threshold and cache expiry checks run over the whole fleet at once and only return who needs action
+# NOTE: this file must not import Contract, so it can be used without an RPC connection
+import operator #< Comparison operators shared by both backends
+from array import array #< Fallback storage when numpy is not installed
+try:
+    import numpy #< Optional: vectorized checks for large fleets
+except ImportError:
+    numpy = None
+
+
+# All columns are stored as doubles, these get handed out as integers
+INT_COLUMNS = ["previous_reward_round"]
+COLUMNS = [
+    # LPT details
+    "previous_LPT_refresh",
+    "balance_LPT_pending",
+    "rate_LPT_pending",  # Smoothed accrual rate of pending stake in LPT/s
+    "next_LPT_refresh",
+    # ETH details
+    "previous_ETH_refresh",
+    "balance_ETH_pending",
+    "balance_ETH",
+    "rate_ETH_pending",  # Smoothed accrual rate of pending fees in ETH/s
+    "next_ETH_refresh",
+    # Round details
+    "previous_round_refresh",
+    "previous_reward_round"
+]
+# Refresh after this fraction of the time a balance is predicted to take to reach its threshold
+PREDICTION_MARGIN = 0.8
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+
+
+class FleetState:
+    """
+    Column store with one row per Orchestrator.
+    Uses numpy arrays when available, else falls back to plain Python arrays.
+    """
+    def __init__(self, capacity=16):
+        self.size = 0
+        self.capacity = capacity
+        if numpy is not None:
+            self.columns = {name: numpy.zeros(capacity, dtype=numpy.float64) for name in COLUMNS}
+        else:
+            self.columns = {name: array('d') for name in COLUMNS}
+
+    def add(self):
+        """Adds a row with all fields set to 0 and returns its index."""
+        if numpy is not None:
+            if self.size == self.capacity:
+                self.capacity *= 2
+                for name in COLUMNS:
+                    self.columns[name] = numpy.resize(self.columns[name], self.capacity)
+                    self.columns[name][self.size:] = 0
+        else:
+            for name in COLUMNS:
+                self.columns[name].append(0)
+        self.size += 1
+        return self.size - 1
+
+    def get(self, column, idx):
+        value = float(self.columns[column][idx])
+        return int(value) if column in INT_COLUMNS else value
+
+    def set(self, column, idx, value):
+        self.columns[column][idx] = float(value)
+
+    def view(self, column):
+        """The populated part of a column."""
+        return self.columns[column][:self.size]
+
+    def where(self, column, op, value):
+        """Returns the indices of all rows where `column op value` holds, in ascending order."""
+        compare = OPERATORS[op]
+        values = self.view(column)
+        if numpy is not None:
+            return numpy.flatnonzero(compare(values, value)).tolist()
+        return [idx for idx, field in enumerate(values) if compare(field, value)]
+
+    def recordSample(self, idx, value_column, time_column, rate_column, value, now):
+        """
+        Stores a new balance sample and updates the smoothed accrual rate per second.
+        Drops in the balance are sweeps, not accrual, so those don't update the rate.
+        """
+        previous = self.get(value_column, idx)
+        previous_time = self.get(time_column, idx)
+        if previous_time > 0 and now > previous_time and value >= previous:
+            rate = (float(value) - previous) / (now - previous_time)
+            smoothed = self.get(rate_column, idx)
+            self.set(rate_column, idx, rate if smoothed == 0 else (smoothed + rate) / 2)
+        self.set(value_column, idx, value)
+        self.set(time_column, idx, now)
+
+    def scheduleRefresh(self, idx, value_column, rate_column, next_column, threshold, now, min_interval, max_interval):
+        """
+        Schedules the next refresh of a balance for when it is predicted to reach `threshold` at its accrual rate,
+        a bit early as accrual comes in bursts. Without a rate, or once past the threshold, waits `max_interval`.
+        Returns the interval in seconds.
+        """
+        value = self.get(value_column, idx)
+        rate = self.get(rate_column, idx)
+        if rate > 0 and value < threshold:
+            interval = min(max((threshold - value) / rate * PREDICTION_MARGIN, min_interval), max_interval)
+        else:
+            interval = max_interval
+        self.set(next_column, idx, now + interval)
+        return interval
+
+    def expired(self, column, ttl, now):
+        """Returns the indices of all rows whose timestamp in `column` is older than `ttl` seconds."""
+        return self.where(column, "<=", now - ttl)
+
+
+"""
+@brief Returns a property which stores an Orchestrator field in the fleet state
+The Orchestrator needs a `fleet` and `fleet_idx` attribute
+@param name: name of the column in FleetState
+"""
+def column(name):
+    return property(
+        lambda self: self.fleet.get(name, self.fleet_idx),
+        lambda self, value: self.fleet.set(name, self.fleet_idx, value)
+    )
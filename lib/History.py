@@ -0,0 +1,193 @@
+# Keeps a local index of everything our Orchestrators earned or moved on chain
+# The index is built incrementally from BondingManager events, so looking up history never rescans the chain
+from datetime import datetime, timezone #< Filtering the history on age
+import bisect #< Looking up the round of a block
+import web3 #< Currency conversions
+# Import our own libraries
+from lib import Contract, State, Util
+
+
+INDEX_FILE = "earnings_history.json"
+# Bumped whenever rows in older indexes are wrong, which makes the index rebuild from scratch
+INDEX_VERSION = 2
+L2_BLOCKS_PER_DAY = 345600  # Arbitrum produces a block every ~0.25s
+# BondingManager events we index, with the position of the indexed argument which holds the Orchestrator
+# EarningsClaimed is indexed by delegate first, which would match every delegator claiming against our Orchestrator
+INDEXED_EVENTS = {
+    "Reward": 1,
+    "TreasuryReward": 1,
+    "WithdrawFees": 1,
+    "TransferBond": 1,
+    "EarningsClaimed": 2
+}
+
+# Loaded lazily from disk, layout:
+# version:   INDEX_VERSION the index was built with
+# cursor:    last block which has been indexed
+# start:     first block which has been indexed
+# addresses: checksum addresses covered by the index
+# rounds:    list of [round, start block, start timestamp], sorted by round
+# events:    list of [block, log index, event name, address, amount, fees], sorted by block
+index = None
+
+
+"""
+@brief Loads the index from disk if it isn't already
+"""
+def loadIndex():
+    global index
+    if index is None:
+        index = Util.readJson(Util.getDataPath(INDEX_FILE), {})
+        # Indexes before version 2 counted claims of other delegators as claims of our Orchestrators
+        if index and index.get("version") != INDEX_VERSION:
+            Util.log("Rebuilding the earnings history, as it was built by an older version", 2)
+            index = {}
+        index["version"] = INDEX_VERSION
+        index.setdefault("cursor", 0)
+        index.setdefault("start", 0)
+        index.setdefault("addresses", [])
+        index.setdefault("rounds", [])
+        index.setdefault("events", [])
+    return index
+
+"""
+@brief Converts a decoded BondingManager event to a compact index row
+"""
+def toRow(event_name, log):
+    args = log.args
+    if event_name == "Reward":
+        address, amount, fees = args.transcoder, args.amount, 0
+    elif event_name == "TreasuryReward":
+        address, amount, fees = args.transcoder, args.amount, 0
+    elif event_name == "WithdrawFees":
+        address, amount, fees = args.delegator, 0, args.amount
+    elif event_name == "TransferBond":
+        address, amount, fees = args.oldDelegator, args.amount, 0
+    else:
+        address, amount, fees = args.delegator, args.rewards, args.fees
+    return [log.blockNumber, log.logIndex, event_name, address, amount, fees]
+
+"""
+@brief Scans for our events and round boundaries between two blocks
+Fails as a whole if any block range could not be scanned, so the index never ends up with gaps
+@param addresses: checksum addresses to index events for
+@return (event rows, round rows) to add to the index
+"""
+def indexRange(addresses, from_block, to_block, with_rounds=True):
+    events = []
+    rounds = []
+    address_topics = [Contract.addressToTopic(address) for address in addresses]
+    # One scan per topic position the Orchestrator is in
+    for position in sorted(set(INDEXED_EVENTS.values())):
+        event_names = [event_name for event_name, event_position in INDEXED_EVENTS.items() if event_position == position]
+        logs = Contract.getMultiLogsInChunks(
+            [(Contract.bonding_contract, event_name) for event_name in event_names],
+            from_block,
+            to_block,
+            topic_filters=[None] * (position - 1) + [address_topics],
+            strict=True
+        )
+        for event_name in event_names:
+            for log in logs[event_name]:
+                events.append(toRow(event_name, log))
+    if not with_rounds:
+        return events, rounds
+    # Round boundaries, so we can group events per round
+    new_rounds = Contract.getMultiLogsInChunks([(Contract.rounds_contract, "NewRound")], from_block, to_block, strict=True)
+    for log in new_rounds["NewRound"]:
+        timestamp = Contract.w3.eth.get_block(log.blockNumber)["timestamp"]
+        rounds.append([log.args.round, log.blockNumber, timestamp])
+    return events, rounds
+
+"""
+@brief Brings the index up to date with the chain
+Only blocks after the last indexed block get scanned. Orchestrators which were added
+since the previous update get backfilled over the already indexed range first.
+Nothing gets added unless every scan succeeded, so a failed update can simply be retried
+"""
+def updateIndex():
+    loadIndex()
+    try:
+        current_block = Contract.currentBlock()
+        addresses = [orch.source_checksum_address for orch in State.orchestrators]
+        start = index["start"]
+        cursor = index["cursor"]
+        if not cursor:
+            start = max(0, current_block - int(State.HISTORY_DAYS * L2_BLOCKS_PER_DAY))
+            cursor = start - 1
+        events = []
+        rounds = []
+        new_addresses = [address for address in addresses if address not in index["addresses"]]
+        if new_addresses and index["addresses"] and cursor >= start:
+            Util.log("Backfilling earnings history for {0} new Orchestrator(s)".format(len(new_addresses)), 2)
+            events.extend(indexRange(new_addresses, start, cursor, with_rounds=False)[0])
+        if current_block > cursor:
+            Util.log("Indexing earnings history from block {0} to {1}".format(cursor + 1, current_block), 2)
+            new_events, new_rounds = indexRange(addresses, cursor + 1, current_block)
+            events.extend(new_events)
+            rounds.extend(new_rounds)
+        index["start"] = start
+        index["events"].extend(events)
+        index["rounds"].extend(rounds)
+        index["addresses"] = sorted(set(index["addresses"] + addresses))
+        index["cursor"] = current_block
+        index["events"].sort(key=lambda row: (row[0], row[1]))
+        index["rounds"].sort()
+        Util.writeJsonAtomic(Util.getDataPath(INDEX_FILE), index)
+    except Exception as e:
+        Util.log("Unable to update earnings history: {0}".format(e), 1)
+
+"""
+@brief Returns (round, start timestamp) of the round which contains a block
+@param round_starts: start blocks of index["rounds"], in the same order
+@return None if the block is before the first known round
+"""
+def roundForBlock(round_starts, block):
+    position = bisect.bisect_right(round_starts, block) - 1
+    if position < 0:
+        return None
+    round_num, _, timestamp = index["rounds"][position]
+    return (round_num, timestamp)
+
+"""
+@brief Returns per round totals for an Orchestrator straight from the index
+@param address: checksum address of the Orchestrator
+@param days: only include rounds which started in the last X days
+@return list of dicts sorted by round, amounts in LPT and ETH
+"""
+def getRoundSummary(address, days=90):
+    loadIndex()
+    min_timestamp = datetime.now(timezone.utc).timestamp() - days * 86400
+    round_starts = [start_block for _, start_block, _ in index["rounds"]]
+    summary = {}
+    for block, _, event_name, event_address, amount, fees in index["events"]:
+        if event_address != address:
+            continue
+        found = roundForBlock(round_starts, block)
+        if found is None or found[1] < min_timestamp:
+            continue
+        round_num, timestamp = found
+        if round_num not in summary:
+            summary[round_num] = {
+                "round": round_num,
+                "timestamp": timestamp,
+                "rewarded_LPT": 0,
+                "treasury_LPT": 0,
+                "transferred_LPT": 0,
+                "claimed_LPT": 0,
+                "withdrawn_ETH": 0,
+                "claimed_ETH": 0
+            }
+        row = summary[round_num]
+        if event_name == "Reward":
+            row["rewarded_LPT"] += web3.Web3.from_wei(amount, 'ether')
+        elif event_name == "TreasuryReward":
+            row["treasury_LPT"] += web3.Web3.from_wei(amount, 'ether')
+        elif event_name == "TransferBond":
+            row["transferred_LPT"] += web3.Web3.from_wei(amount, 'ether')
+        elif event_name == "WithdrawFees":
+            row["withdrawn_ETH"] += web3.Web3.from_wei(fees, 'ether')
+        else:
+            row["claimed_LPT"] += web3.Web3.from_wei(amount, 'ether')
+            row["claimed_ETH"] += web3.Web3.from_wei(fees, 'ether')
+    return [summary[round_num] for round_num in sorted(summary)]
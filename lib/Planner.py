@@ -0,0 +1,174 @@
+# Decides when sweeping funds is worth the gas
+# Instead of sweeping as soon as a fixed threshold is crossed, we compare the current cost of the transaction
+# against the amount it moves. Sweeps get delayed while gas is expensive, or brought forward while gas is cheap.
+# Also decides when pending balances need refreshing, based on how fast they approach their threshold.
+from datetime import datetime, timezone #< Tracking how long sweeps have been delayed
+import web3 #< Currency conversions
+# Import our own libraries
+from lib import Contract, State, Util
+
+
+# Sweep below the threshold if gas is this much cheaper than the target cost ratio
+BRING_FORWARD_FRACTION = 0.5
+# Only bring sweeps forward once at least this fraction of the threshold has accrued
+BRING_FORWARD_MIN = 0.5
+# transferBond moves LPT, which we can't weigh against ETH gas costs: it waits while the
+# base fee is this many times higher than the cheapest base fee seen during the past day
+BUSY_BASE_FEE_FACTOR = 2
+BASE_FEE_WINDOW = 86400
+# Gas used by a sweep hardly changes, so estimates get reused for this many seconds
+GAS_ESTIMATE_MAX_AGE = 86400
+
+base_fee = None       # Latest base fee in wei, refreshed every cycle
+base_fee_history = [] # (timestamp, base fee) over the past BASE_FEE_WINDOW seconds
+deferred_since = {}   # (Orch idx, action) -> timestamp the sweep was first delayed
+gas_estimates = {}    # (Orch idx, action) -> (timestamp, gas units) of the latest estimate
+
+
+"""
+@brief Refreshes the current base fee, should be called once per cycle
+"""
+def refreshBaseFee():
+    global base_fee, base_fee_history
+    try:
+        base_fee = Contract.w3.eth.get_block(Contract.readBlock())['baseFeePerGas']
+        now = datetime.now(timezone.utc).timestamp()
+        base_fee_history = [(t, fee) for t, fee in base_fee_history if t > now - BASE_FEE_WINDOW]
+        base_fee_history.append((now, base_fee))
+        Util.log("Current base fee is {0:.4f} gwei".format(web3.Web3.from_wei(base_fee, 'gwei')), 3)
+    except Exception as e:
+        base_fee = None
+        Util.log("Unable to get the base fee, sweeping on thresholds only: {0}".format(e), 1)
+
+"""
+@brief Returns the amount of ETH an action would sweep
+"""
+def sweepAmount(idx, action):
+    if action == "withdrawFees":
+        return float(State.orchestrators[idx].balance_ETH_pending)
+    return float(State.orchestrators[idx].balance_ETH) - State.ETH_MINVAL
+
+"""
+@brief Estimates the gas an action would use, reusing the previous estimate for up to GAS_ESTIMATE_MAX_AGE seconds
+@return gas units, or None if it can't be estimated
+"""
+def estimateGas(idx, action, amount):
+    orch = State.orchestrators[idx]
+    now = datetime.now(timezone.utc).timestamp()
+    cached = gas_estimates.get((idx, action))
+    if cached and now - cached[0] < GAS_ESTIMATE_MAX_AGE:
+        return cached[1]
+    try:
+        amount_wei = web3.Web3.to_wei(max(amount, 0), 'ether')
+        if action == "withdrawFees":
+            gas = Contract.bonding_contract.functions.withdrawFees(orch.source_checksum_address, amount_wei).estimate_gas(
+                {"from": orch.source_checksum_address}
+            )
+        else:
+            gas = Contract.w3.eth.estimate_gas({
+                "from": orch.source_checksum_address,
+                "to": orch.target_checksum_address_ETH,
+                "value": amount_wei
+            })
+        gas_estimates[(idx, action)] = (now, gas)
+        return gas
+    except Exception as e:
+        Util.log("Unable to estimate gas for {0}: {1}".format(action, e), 1)
+        return None
+
+"""
+@brief Clears the delay timer of a sweep and lets it through
+"""
+def allow(idx, action):
+    deferred_since.pop((idx, action), None)
+    return True
+
+"""
+@brief Returns whether it's worth sweeping ETH right now
+Sweeps past the threshold go out once gas costs at most MAX_GAS_COST_RATIO of the swept amount,
+or once they have been delayed for SWEEP_MAX_DELAY seconds. Sweeps which have not reached the
+threshold yet are brought forward if gas is cheap enough. Fees which are due go out right away while
+the Orchestrator's wallet is below ETH_MINVAL, as it needs them to pay for calling reward.
+@param idx: which Orch # in the set to check
+@param action: "withdrawFees" or "sendFees"
+"""
+def shouldSweepEth(idx, action):
+    orch = State.orchestrators[idx]
+    amount = sweepAmount(idx, action)
+    due = (orch.balance_ETH_pending if action == "withdrawFees" else orch.balance_ETH) >= State.ETH_THRESHOLD
+    if amount <= 0:
+        return False
+    if due and action == "withdrawFees" and orch.balance_ETH < State.ETH_MINVAL:
+        Util.log("{0} is low on ETH: withdrawing fees regardless of gas costs".format(orch.source_address), 2)
+        return allow(idx, action)
+    if base_fee is None:
+        return due
+    gas = estimateGas(idx, action, amount)
+    if gas is None:
+        return due
+    cost = float(web3.Web3.from_wei(gas * base_fee, 'ether'))
+    ratio = cost / amount
+    if not due:
+        if ratio <= State.MAX_GAS_COST_RATIO * BRING_FORWARD_FRACTION:
+            Util.log("Gas is cheap: bringing {0} of {1:.4f} ETH for {2} forward (costs {3:.3%})".format(action, amount, orch.source_address, ratio), 2)
+            return allow(idx, action)
+        return False
+    if ratio <= State.MAX_GAS_COST_RATIO:
+        return allow(idx, action)
+    now = datetime.now(timezone.utc).timestamp()
+    since = deferred_since.setdefault((idx, action), now)
+    if now - since >= State.SWEEP_MAX_DELAY:
+        Util.log("{0} for {1} has been delayed for too long, sweeping at a cost of {2:.3%}".format(action, orch.source_address, ratio), 2)
+        return allow(idx, action)
+    # Predict when enough fees have accrued to get below the target cost ratio
+    eta = ""
+    if action == "withdrawFees" and orch.rate_ETH_pending > 0:
+        seconds = (cost / State.MAX_GAS_COST_RATIO - amount) / orch.rate_ETH_pending
+        eta = ", at the current accrual rate in ~{0:.1f} hours".format(seconds / 3600)
+    Util.log("Delaying {0} of {1:.4f} ETH for {2}: gas would cost {3:.3%} > target of {4:.3%}{5}".format(
+        action, amount, orch.source_address, ratio, State.MAX_GAS_COST_RATIO, eta), 2)
+    return False
+
+"""
+@brief Returns whether it's a good moment to transfer bond
+Waits while the base fee is well above the cheapest base fee of the past day, up to SWEEP_MAX_DELAY
+@param idx: which Orch # in the set to check
+"""
+def shouldTransferBond(idx):
+    if base_fee is None or not base_fee_history:
+        return True
+    cheapest = min(fee for _, fee in base_fee_history)
+    if base_fee <= cheapest * BUSY_BASE_FEE_FACTOR:
+        return allow(idx, "transferBond")
+    now = datetime.now(timezone.utc).timestamp()
+    since = deferred_since.setdefault((idx, "transferBond"), now)
+    if now - since >= State.SWEEP_MAX_DELAY:
+        return allow(idx, "transferBond")
+    Util.log("Delaying transferBond for {0}: base fee of {1:.4f} gwei is over {2}x the daily low".format(
+        State.orchestrators[idx].source_address, web3.Web3.from_wei(base_fee, 'gwei'), BUSY_BASE_FEE_FACTOR), 2)
+    return False
+
+
+### Refresh scheduling
+
+
+"""
+@brief Stores a pending stake sample and schedules the next refresh for when the LPT threshold is expected to be reached
+@param idx: which Orch # in the set was refreshed
+"""
+def recordStake(idx, pending_lpt, now):
+    State.fleet.recordSample(idx, "balance_LPT_pending", "previous_LPT_refresh", "rate_LPT_pending", pending_lpt, now)
+    interval = State.fleet.scheduleRefresh(idx, "balance_LPT_pending", "rate_LPT_pending", "next_LPT_refresh",
+        State.LPT_THRESHOLD, now, State.REFRESH_MIN, State.WAIT_TIME_LPT_REFRESH)
+    Util.log("Next pending stake refresh for {0} in {1:.0f} minutes".format(State.orchestrators[idx].source_address, interval / 60), 3)
+
+"""
+@brief Stores a pending fees sample and schedules the next refresh for when fees could be withdrawn
+Fees can get withdrawn from BRING_FORWARD_MIN of the ETH threshold if gas is cheap, so that is what we aim for
+@param idx: which Orch # in the set was refreshed
+"""
+def recordFees(idx, pending_eth, now):
+    State.fleet.recordSample(idx, "balance_ETH_pending", "previous_ETH_refresh", "rate_ETH_pending", pending_eth, now)
+    interval = State.fleet.scheduleRefresh(idx, "balance_ETH_pending", "rate_ETH_pending", "next_ETH_refresh",
+        State.ETH_THRESHOLD * BRING_FORWARD_MIN, now, State.REFRESH_MIN, State.WAIT_TIME_ETH_REFRESH)
+    Util.log("Next pending fees refresh for {0} in {1:.0f} minutes".format(State.orchestrators[idx].source_address, interval / 60), 3)
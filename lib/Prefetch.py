@@ -0,0 +1,85 @@
+# Keeps governance proposals and LIP polls up to date in the background while siphoning
+# The first refresh scans the whole search window, after that only the blocks since the previous refresh get scanned.
+# The interactive menus read from here, so opening them does not need to wait for a cold scan.
+import threading #< Refreshing from a background thread
+from datetime import datetime, timezone #< Keeping track of the age of the data
+# Import our own libraries
+from lib import Contract, State, Util
+
+
+cursor = 0            # Last block which has been scanned
+raw_proposals = []    # ProposalCreated logs within the search window
+raw_polls = []        # PollCreated logs within the search window
+proposals = []        # Active proposals as of the last refresh
+polls = []            # Polls as of the last refresh
+refreshed_at = 0      # Timestamp of the last refresh
+refreshed_round = 0   # Round in which the last refresh happened
+refresh_lock = threading.Lock()
+
+
+"""
+@brief Scans the blocks since the previous refresh and re-checks proposal states
+@param background: throttle the scan and keep it off the terminal, for refreshes which nobody waits on
+"""
+def refresh(background=False):
+    global cursor, raw_proposals, raw_polls, proposals, polls, refreshed_at, refreshed_round
+    with refresh_lock:
+        try:
+            current_block = Contract.currentBlock()
+            proposal_start = Contract.getProposalSearchStart(current_block)
+            poll_start = max(0, current_block - Contract.getPollWindow())
+            from_block = max(cursor + 1, min(proposal_start, poll_start))
+            Util.log("Prefetching governance data from block {0} to {1}".format(from_block, current_block), 3)
+            logs = Contract.getMultiLogsInChunks(
+                [(Contract.treasury_contract, "ProposalCreated"), (Contract.poll_creator_contract, "PollCreated")],
+                from_block,
+                current_block,
+                background=background,
+                # A skipped block range would never get scanned again, so rather fail and retry the next refresh
+                strict=True
+            )
+            # Forget anything which dropped out of the search window
+            raw_proposals = [log for log in raw_proposals if log.blockNumber >= proposal_start] + logs["ProposalCreated"]
+            raw_polls = [log for log in raw_polls if log.blockNumber >= poll_start] + logs["PollCreated"]
+            cursor = current_block
+            # Proposal states change over time, so these get checked every refresh
+            proposals = Contract.parseProposals(raw_proposals)
+            polls = Contract.parsePolls(raw_polls)
+            refreshed_at = datetime.now(timezone.utc).timestamp()
+            refreshed_round = State.current_round_num
+        except Exception as e:
+            Util.log("Unable to prefetch governance data: {0}".format(e), 1)
+
+"""
+@brief Returns whether the governance data is older than GOVERNANCE_MAX_AGE
+"""
+def isStale():
+    return datetime.now(timezone.utc).timestamp() > refreshed_at + State.GOVERNANCE_MAX_AGE
+
+"""
+@brief Refreshes from a background thread once per round, or when the data is about to go stale
+Should be called every cycle of the siphon loop. Does nothing while a refresh is still running
+"""
+def refreshInBackground():
+    if refresh_lock.locked():
+        return
+    almost_stale = datetime.now(timezone.utc).timestamp() > refreshed_at + State.GOVERNANCE_MAX_AGE / 2
+    if refreshed_round == State.current_round_num and not almost_stale:
+        return
+    threading.Thread(target=refresh, args=(True,), daemon=True).start()
+
+"""
+@brief Returns all currently ACTIVE governance proposals, refreshing first if the data went stale
+"""
+def getProposals():
+    if isStale():
+        refresh()
+    return list(proposals)
+
+"""
+@brief Returns all LIP governance polls within the search window, refreshing first if the data went stale
+"""
+def getPolls():
+    if isStale():
+        refresh()
+    return list(polls)
@@ -0,0 +1,154 @@
+# Sampling profiler for the `--profile` launch flag
+# While running, a background thread takes a snapshot of the call stack of the profiled thread at a fixed interval.
+# Samples are written as collapsed stacks, which flamegraph.pl, speedscope or inferno can turn into a flame graph,
+# together with a summary of the functions which showed up the most. Nothing runs while profiling is off.
+# Every sample counts towards the wall clock profile, which includes waiting on the RPC provider. Where the platform
+# can read the CPU clock of another thread, each sample is also weighted by the CPU time the profiled thread used
+# since the previous sample, which leaves a CPU profile of only the time it was actually running.
+import sys #< Reading the stacks of other threads
+import os #< Shortening file names in stack frames
+import time #< Reading the CPU time of the profiled thread
+import threading #< Sampling from a background thread
+import collections #< Counting stacks
+from datetime import datetime #< Naming output files
+# Import our own libraries
+from lib import Util
+
+
+SAMPLE_INTERVAL = 0.005  # Seconds between samples
+TOP_FUNCTIONS = 40       # Amount of functions to list in the summary
+
+stacks = collections.Counter()      # Collapsed stack -> amount of samples
+cpu_stacks = collections.Counter()  # Collapsed stack -> microseconds of CPU time
+sample_count = 0
+cpu_time = 0                        # Microseconds of CPU time sampled
+sampler = None                  # (thread, stop event) while sampling
+
+
+"""
+@brief Returns a readable name for a stack frame, like `Contract.py:refreshRound`
+"""
+def frameName(frame):
+    return "{0}:{1}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+
+"""
+@brief Returns the ID of the CPU clock of a thread, or None if this platform can't read it
+"""
+def getCpuClock(target):
+    try:
+        return time.pthread_getcpuclockid(target)
+    except (AttributeError, OSError):
+        return None
+
+"""
+@brief Samples the stack of a thread until stopped
+"""
+def sample(target, stop):
+    global sample_count, cpu_time
+    clock = getCpuClock(target)
+    previous = time.clock_gettime(clock) if clock is not None else 0
+    while not stop.wait(SAMPLE_INTERVAL):
+        frame = sys._current_frames().get(target)
+        if frame is None:
+            continue
+        names = []
+        while frame is not None:
+            names.append(frameName(frame))
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        stacks[stack] += 1
+        sample_count += 1
+        if clock is not None:
+            now = time.clock_gettime(clock)
+            used = int((now - previous) * 1000000)
+            previous = now
+            # Threads which were waiting the whole time do not count towards the CPU profile at all
+            if used > 0:
+                cpu_stacks[stack] += used
+                cpu_time += used
+
+"""
+@brief Starts sampling the calling thread, adding to the samples collected so far
+"""
+def start():
+    global sampler
+    if sampler is not None:
+        return
+    stop = threading.Event()
+    thread = threading.Thread(target=sample, args=(threading.get_ident(), stop), daemon=True)
+    sampler = (thread, stop)
+    thread.start()
+
+"""
+@brief Stops sampling, keeping the samples until they are written
+"""
+def stop():
+    global sampler
+    if sampler is None:
+        return
+    thread, stop_event = sampler
+    stop_event.set()
+    thread.join()
+    sampler = None
+
+"""
+@brief Returns the functions which were sampled the most
+Self samples count where the function itself was running, total samples also count the functions it called
+@param samples: collapsed stack -> weight, the wall clock samples by default
+@return list of (function, self samples, total samples), sorted by total samples
+"""
+def getTopFunctions(samples=None):
+    own = collections.Counter()
+    total = collections.Counter()
+    for stack, count in (stacks if samples is None else samples).items():
+        names = stack.split(";")
+        own[names[-1]] += count
+        # Recursive functions count once per sample
+        for name in set(names):
+            total[name] += count
+    return [(name, own[name], count) for name, count in total.most_common(TOP_FUNCTIONS)]
+
+"""
+@brief Writes a top functions table to a summary file
+"""
+def writeTopFunctions(file, samples, weight_total, weight_name):
+    file.write("{0:>8} {1:>8} {2:>8}  {3}\n".format("self %", "total %", weight_name, "function"))
+    for name, own, total in getTopFunctions(samples):
+        file.write("{0:>7.1f}% {1:>7.1f}% {2:>8}  {3}\n".format(own * 100 / weight_total, total * 100 / weight_total, total, name))
+
+"""
+@brief Writes the collapsed stacks and a top functions summary to the data folder, then clears the samples
+The wall clock stacks go to <name>.folded, the CPU stacks (in microseconds) to <name>.cpu.folded
+@param label: what was profiled, used in the file names
+"""
+def write(label):
+    global stacks, cpu_stacks, sample_count, cpu_time
+    stop()
+    if not sample_count:
+        Util.log("No profile samples were taken of {0}".format(label), 1)
+        return
+    base = Util.getDataPath("profile_{0}_{1}".format(label, datetime.now().strftime('%Y%m%d-%H%M%S')))
+    try:
+        with open(base + ".folded", 'w') as file:
+            for stack, count in stacks.most_common():
+                file.write("{0} {1}\n".format(stack, count))
+        if cpu_time:
+            with open(base + ".cpu.folded", 'w') as file:
+                for stack, used in cpu_stacks.most_common():
+                    file.write("{0} {1}\n".format(stack, used))
+        with open(base + ".txt", 'w') as file:
+            file.write("Wall clock: {0} samples of {1} every {2:.0f} ms, so waiting on the RPC provider shows up as socket reads\n\n".format(
+                sample_count, label, SAMPLE_INTERVAL * 1000))
+            writeTopFunctions(file, stacks, sample_count, "samples")
+            if cpu_time:
+                file.write("\nCPU: {0:.0f} ms of CPU time, only while the profiled thread was running\n\n".format(cpu_time / 1000))
+                writeTopFunctions(file, cpu_stacks, cpu_time, "us")
+            else:
+                file.write("\nCPU: no CPU time was sampled, as this platform can't read the CPU clock of another thread\n")
+        Util.log("Wrote {0} profile samples to {1}.folded and {1}.txt".format(sample_count, base), 2)
+    except Exception as e:
+        Util.log("Unable to write profile: {0}".format(e), 1)
+    stacks = collections.Counter()
+    cpu_stacks = collections.Counter()
+    sample_count = 0
+    cpu_time = 0
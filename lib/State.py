@@ -2,6 +2,9 @@
 # Also parses the config on initialisation
 import configparser #< Parse the .ini file
 import os #< Used to get environment variables & for resolving relative file paths
+import threading #< Lock shared by everything which sends transactions
+# Import our own libraries
+from lib import Fleet
 
 
 ### Export path to be able to resolve the JSON and ini files correctly
@@ -71,14 +74,32 @@ ETH_THRESHOLD = float(os.getenv('SIPHON_ETH_THRESHOLD', config['thresholds']['et
 ETH_MINVAL = float(os.getenv('SIPHON_ETH_MINVAL', config['thresholds']['eth_minval']))
 ETH_WARN = float(os.getenv('SIPHON_ETH_WARN', config['thresholds']['eth_warn']))
 LPT_MINVAL = float(os.getenv('SIPHON_LPT_MINVAL', config['thresholds']['lpt_minval']))
+MAX_GAS_COST_RATIO = float(os.getenv('SIPHON_MAX_GAS_COST_RATIO', config['thresholds']['max_gas_cost_ratio']))
+TX_MAX_FEE = int(float(os.getenv('SIPHON_TX_MAX_FEE', config['thresholds']['tx_max_fee'])) * 1000000000)  # gwei -> wei
 # Timers
 WAIT_TIME_ROUND_REFRESH = float(os.getenv('SIPHON_CACHE_ROUNDS', config['timers']['cache_round_refresh']))
 WAIT_TIME_LPT_REFRESH = float(os.getenv('SIPHNO_CACHE_LPT', config['timers']['cache_pending_lpt']))
 WAIT_TIME_ETH_REFRESH = float(os.getenv('SIPHNO_CACHE_ETH', config['timers']['cache_pending_eth']))
+REFRESH_MIN = float(os.getenv('SIPHON_REFRESH_MIN', config['timers']['refresh_min']))
 WAIT_TIME_IDLE = float(os.getenv('SIPHNO_WAIT_IDLE', config['timers']['wait_idle']))
+SWEEP_MAX_DELAY = float(os.getenv('SIPHON_SWEEP_MAX_DELAY', config['timers']['sweep_max_delay']))
+GOVERNANCE_MAX_AGE = float(os.getenv('SIPHON_GOVERNANCE_MAX_AGE', config['timers']['governance_max_age']))
+BACKGROUND_SCAN_DELAY = float(os.getenv('SIPHON_BACKGROUND_SCAN_DELAY', config['timers']['background_scan_delay']))
+TX_BUMP_AFTER = float(os.getenv('SIPHON_TX_BUMP_AFTER', config['timers']['tx_bump_after']))
 # RPC
 L2_RPC_PROVIDER = os.getenv('SIPHON_RPC_L2', config['rpc']['l2'])
+L2_WS_PROVIDER = os.getenv('SIPHON_RPC_L2_WS', config['rpc']['l2_ws'])
+CASSETTE = os.getenv('SIPHON_CASSETTE', config['rpc']['cassette'])
+CASSETTE_MODE = os.getenv('SIPHON_CASSETTE_MODE', config['rpc']['cassette_mode'])
+CASSETTE_TIMING = float(os.getenv('SIPHON_CASSETTE_TIMING', config['rpc']['cassette_timing']))
+RPC_MAX_RATE = float(os.getenv('SIPHON_RPC_MAX_RATE', config['rpc']['max_requests_per_second']))
+# Storage
+DATA_DIR = os.path.join(SIPHON_ROOT, os.getenv('SIPHON_DATA_DIR', config['storage']['data_dir']))
+HISTORY_DAYS = float(os.getenv('SIPHON_HISTORY_DAYS', config['storage']['history_days']))
 # Other
+CONTROL_SOCKET = os.getenv('SIPHON_CONTROL_SOCKET', config['other']['control_socket'])
+if CONTROL_SOCKET:
+    CONTROL_SOCKET = os.path.join(DATA_DIR, CONTROL_SOCKET)
 LOG_VERBOSITY = int(os.getenv('SIPHON_VERBOSITY', config['other']['verbosity']))
 LOG_TIMESTAMPED = bool(os.getenv('SIPHON_TIMESTAMPED', config.getboolean('other', 'log_timestamped')))
 LOCK_INTERACTIVE = bool = False  # Tracks if the program is locked into interactive mode
@@ -87,6 +108,10 @@ LOCK_INTERACTIVE = bool = False  # Tracks if the program is locked into interact
 previous_round_refresh = 0
 current_round_num = 0
 current_round_is_locked = False
+next_round_eta = 0  # Estimated timestamp at which the next round starts
 current_time = 0
 orchestrators = []
+fleet = Fleet.FleetState()  # Balances, timers and reward rounds of all orchestrators, by index
 require_user_input = False
+worker_id = None  # Index of this process when the fleet is split over workers
+tx_lock = threading.RLock()  # Held while sending transactions, so the siphon loop and control socket don't race on nonces
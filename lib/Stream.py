@@ -0,0 +1,120 @@
+# Optional WebSocket subscriptions to new blocks and contract events
+# Instead of polling over HTTP to find out whether a round started or a transaction got mined,
+# a background thread listens to eth_subscribe notifications and wakes up the siphon loop.
+# All reads and transactions still go over HTTP, which is also what we fall back to while disconnected.
+import json #< Encoding JSON-RPC messages
+import threading #< Listening from a background thread
+import time #< Reconnect backoff
+from websockets.sync.client import connect #< Ships with web3
+# Import our own libraries
+from lib import State, Util
+
+
+RECONNECT_DELAY_MIN = 1
+RECONNECT_DELAY_MAX = 60
+# Amount of transaction hashes to remember from log notifications
+MAX_SEEN_TRANSACTIONS = 256
+
+connected = False
+latest_head = 0         # Latest block number announced by newHeads
+seen_transactions = {}  # Transaction hash -> block number, for transactions which emitted a subscribed log
+round_event = threading.Event()  # Set once a NewRound log arrives, cleared by waitForRound()
+condition = threading.Condition() # Notified on every new head or log
+
+
+"""
+@brief Starts listening in a background thread, reconnecting whenever the connection drops
+@param url: ws:// or wss:// RPC endpoint
+@param log_filters: list of eth_subscribe("logs") filters, each with an `address` and `topics`
+@param round_topic: topic0 of the event which signals the start of a new round
+"""
+def start(url, log_filters, round_topic):
+    thread = threading.Thread(target=run, args=(url, log_filters, round_topic), daemon=True)
+    thread.start()
+    return thread
+
+def run(url, log_filters, round_topic):
+    global connected
+    delay = RECONNECT_DELAY_MIN
+    while True:
+        try:
+            with connect(url, open_timeout=10, close_timeout=2) as websocket:
+                subscriptions = subscribe(websocket, log_filters)
+                connected = True
+                delay = RECONNECT_DELAY_MIN
+                Util.log("Subscribed to new blocks and {0} log filter(s) over WebSocket".format(len(log_filters)), 2)
+                for message in websocket:
+                    handleMessage(json.loads(message), subscriptions, round_topic)
+            Util.log("WebSocket connection closed, falling back to HTTP polling", 1)
+        except Exception as e:
+            Util.log("WebSocket connection failed, falling back to HTTP polling: {0}".format(e), 1)
+        connected = False
+        with condition:
+            condition.notify_all()
+        time.sleep(delay)
+        delay = min(delay * 2, RECONNECT_DELAY_MAX)
+
+"""
+@brief Subscribes to newHeads and each log filter
+@return dict of subscription id -> "newHeads" or "logs"
+"""
+def subscribe(websocket, log_filters):
+    requests = [["newHeads"]] + [["logs", log_filter] for log_filter in log_filters]
+    subscriptions = {}
+    for request_id, params in enumerate(requests):
+        websocket.send(json.dumps({"jsonrpc": "2.0", "id": request_id, "method": "eth_subscribe", "params": params}))
+        # Notifications can arrive before the last subscription is confirmed, skip those
+        while True:
+            response = json.loads(websocket.recv(timeout=10))
+            if response.get("id") == request_id:
+                break
+        if "error" in response:
+            raise ConnectionError("eth_subscribe {0} was rejected: {1}".format(params[0], response["error"]))
+        subscriptions[response["result"]] = params[0]
+    return subscriptions
+
+"""
+@brief Handles a single eth_subscription notification
+"""
+def handleMessage(message, subscriptions, round_topic):
+    global latest_head
+    params = message.get("params", {})
+    kind = subscriptions.get(params.get("subscription"))
+    result = params.get("result")
+    if kind is None or result is None:
+        return
+    with condition:
+        if kind == "newHeads":
+            latest_head = max(latest_head, int(result["number"], 16))
+        elif not result.get("removed", False):
+            seen_transactions[result["transactionHash"]] = int(result["blockNumber"], 16)
+            while len(seen_transactions) > MAX_SEEN_TRANSACTIONS:
+                seen_transactions.pop(next(iter(seen_transactions)))
+            if result["topics"] and result["topics"][0] == round_topic:
+                Util.log("A new round started at block {0}".format(int(result["blockNumber"], 16)), 2)
+                # Makes the siphon loop refresh the round right away
+                State.next_round_eta = 0
+                round_event.set()
+        condition.notify_all()
+
+"""
+@brief Waits until a block newer than `head` has been announced, or a log of one of the given transactions came in
+@return the latest head, or None if we are not (or no longer) connected
+"""
+def waitForHead(head, timeout, tx_hashes=()):
+    with condition:
+        condition.wait_for(lambda: not connected or latest_head > head or any(tx_hash in seen_transactions for tx_hash in tx_hashes), timeout)
+        return latest_head if connected else None
+
+"""
+@brief Sleeps for up to `timeout` seconds, returning early when a new round starts
+@return True if a new round started
+"""
+def waitForRound(timeout):
+    if not connected:
+        time.sleep(timeout)
+    elif not round_event.wait(timeout):
+        return False
+    started = round_event.is_set()
+    round_event.clear()
+    return started
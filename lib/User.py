@@ -1,12 +1,76 @@
 # All logic related to direct interaction with the user
 # Like asking the user for a password or voting on a proposal
+from datetime import datetime, timezone #< Printing dates in the earnings history
 # Import our own libraries
-from lib import State, Contract
+from lib import State, Contract, History, Prefetch, EarningsPool, Balances
+
+# Where the menus get their data from and send their transactions through
+# This is the Contract module itself, or a Control.ControlClient when attached to a running siphon
+backend = Contract
 
 
 ### Main logic for user handling
 
 
+"""
+@brief Returns active proposals, from the prefetched governance data when running locally
+"""
+def getProposals():
+    if backend is Contract:
+        return Prefetch.getProposals()
+    return backend.getProposals()
+
+"""
+@brief Returns LIP polls, from the prefetched governance data when running locally
+"""
+def getPolls():
+    if backend is Contract:
+        return Prefetch.getPolls()
+    return backend.getPolls()
+
+"""
+@brief Brings the earnings history and earnings pools up to date, in the siphon process when attached to one
+"""
+def updateEarningsHistory():
+    if backend is Contract:
+        History.updateIndex()
+        EarningsPool.update()
+        return
+    backend.updateEarningsHistory()
+
+"""
+@brief Returns the per round earnings of an Orchestrator from the earnings history
+"""
+def getRoundSummary(address, days):
+    if backend is Contract:
+        return History.getRoundSummary(address, days)
+    return backend.getRoundSummary(address, days) or []
+
+"""
+@brief Returns the yields of an Orchestrator from the earnings pools
+"""
+def getYields(address):
+    if backend is Contract:
+        return EarningsPool.getYields(address)
+    return backend.getYields(address) or []
+
+"""
+@brief Returns the recorded history of a balance of an Orchestrator
+"""
+def getBalanceHistory(address, series, start, end):
+    if backend is Contract:
+        return Balances.query(address, series, start, end)
+    return backend.getBalanceHistory(address, series, start, end) or []
+
+"""
+@brief Calls a backend method which sends transactions
+Holds the transaction lock only while sending, like the control socket does, so siphoning goes on while a menu is open
+"""
+def send(method, *args):
+    with State.tx_lock:
+        return getattr(backend, method)(*args)
+
+
 """
 @brief Print all user choices
 """
@@ -39,7 +103,9 @@ def handleUserInput():
         options = [
             "1. Treasury proposals",
             "2. Governance proposals (LIP)",
-            "3. Set commission rates"
+            "3. Set commission rates",
+            "4. Earnings history",
+            "5. Transcoder pool ranking"
         ]
         if not State.LOCK_INTERACTIVE:
             options.append("0. Start siphoning. Press `CTRL + z`or `CTRL + \\` if you want to switch back to interactive mode")
@@ -59,6 +125,10 @@ def handleUserInput():
                 handleGovernance()
             elif choice == 3:
                 handleCommissionRates()
+            elif choice == 4:
+                handleEarningsHistory()
+            elif choice == 5:
+                printPoolStandings()
             else:
                 print("UNIMPL: chose {0}".format(choice))
     
@@ -155,25 +225,168 @@ def handleSetRates(idx):
 
     confirmChoice = getInputAsInt()
     if confirmChoice == 1:
-        Contract.doTranscoder(idx, reward_percent, fee_percent)
+        send("doTranscoder", idx, reward_percent, fee_percent)
     else:
         print("Transaction aborted")
 
 
+### Earnings history
+
+
+"""
+@brief Handler for choosing which Orchestrator's earnings history to show
+"""
+def handleEarningsHistory():
+    # Bring the index up to date, only scans blocks since the last update
+    updateEarningsHistory()
+    while True:
+        options = []
+        for orchIdx in range(len(State.orchestrators)):
+            options.append("{0}. Show history of {1}".format(orchIdx + 1, State.orchestrators[orchIdx].source_address))
+        options.append("0. Back to menu")
+        printOptions(options)
+        choice = getInputAsInt()
+
+        if choice == 0:
+            return
+        elif choice == -1:
+            continue
+        else:
+            orchIdx = choice - 1
+            if orchIdx < len(State.orchestrators):
+                printEarningsHistory(orchIdx)
+            else:
+                print("UNIMPL: chose {0}".format(choice))
+
+"""
+@brief Prints LPT rewarded and ETH swept per round over the indexed history
+"""
+def printEarningsHistory(idx):
+    rows = getRoundSummary(State.orchestrators[idx].source_checksum_address, State.HISTORY_DAYS)
+    if not rows:
+        print("\nNo earnings found for {0} in the last {1:.0f} days.".format(State.orchestrators[idx].source_address, State.HISTORY_DAYS))
+        printYields(idx)
+        printBalanceHistory(idx)
+        return
+    print("\nEarnings of {0} in the last {1:.0f} days:".format(State.orchestrators[idx].source_address, State.HISTORY_DAYS))
+    print("{0:>6} {1:>10} {2:>12} {3:>12} {4:>12}".format("Round", "Date", "Rewarded", "Transferred", "Swept"))
+    total_rewarded = 0
+    total_swept = 0
+    for row in rows:
+        date = datetime.fromtimestamp(row["timestamp"], timezone.utc).strftime('%Y-%m-%d')
+        swept = row["withdrawn_ETH"]
+        print("{0:>6} {1:>10} {2:>8.2f} LPT {3:>8.2f} LPT {4:>8.4f} ETH".format(row["round"], date, row["rewarded_LPT"], row["transferred_LPT"], swept))
+        total_rewarded += row["rewarded_LPT"]
+        total_swept += swept
+    print("Total: {0:.2f} LPT rewarded, {1:.4f} ETH swept over {2} rounds".format(total_rewarded, total_swept, len(rows)))
+    printYields(idx)
+    printBalanceHistory(idx)
+
+"""
+@brief Prints the reward APR and fee yield of stake delegated to an Orchestrator
+"""
+def printYields(idx):
+    yields = getYields(State.orchestrators[idx].source_checksum_address)
+    if not yields:
+        return
+    print("\nYield for delegators, from the earnings pools:")
+    print("{0:>8} {1:>7} {2:>11} {3:>22}".format("Window", "Rounds", "Reward APR", "Fees per 1000 LPT"))
+    for row in yields:
+        print("{0:>4} days {1:>7} {2:>10.2f}% {3:>18.6f} ETH".format(row["days"], row["rounds"], row["reward_APR"], row["fee_yield"]))
+
+"""
+@brief Prints the balances recorded while siphoning, as of the end of each day
+"""
+def printBalanceHistory(idx):
+    end = datetime.now(timezone.utc).timestamp()
+    start = end - State.HISTORY_DAYS * 86400
+    # Date -> series -> last recorded value of that day
+    days = {}
+    for series in Balances.SERIES:
+        for timestamp, value in getBalanceHistory(State.orchestrators[idx].source_checksum_address, series, start, end):
+            date = datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+            days.setdefault(date, {})[series] = value
+    if not days:
+        return
+    print("\nBalances at the end of each day:")
+    print("{0:>10} {1:>16} {2:>16} {3:>16}".format("Date", "Pending stake", "Pending fees", "Wallet"))
+    for date in sorted(days):
+        values = [days[date].get(series) for series in Balances.SERIES]
+        print("{0:>10} {1:>16} {2:>16} {3:>16}".format(date, *[
+            "-" if value is None else "{0:.4f} {1}".format(value, unit) for value, unit in zip(values, ["LPT", "ETH", "ETH"])
+        ]))
+
+
+### Transcoder pool
+
+
+"""
+@brief Returns the median of a non-empty list of numbers
+"""
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+"""
+@brief Prints the rank, stake margin to the activation cutoff and commission of each Orchestrator against the rest of the pool
+"""
+def printPoolStandings():
+    snapshot = backend.getTranscoderPool()
+    transcoders = snapshot["transcoders"] if snapshot else []
+    if not transcoders:
+        print("\nUnable to load the transcoder pool.")
+        return
+    is_full = len(transcoders) >= snapshot["max_size"]
+    cutoff = transcoders[-1]["stake"]
+    median_reward_cut = median([transcoder["reward_cut"] for transcoder in transcoders])
+    median_fee_cut = median([transcoder["fee_cut"] for transcoder in transcoders])
+    print("\nTranscoder pool in round {0}: {1} of {2} slots taken".format(snapshot["round"], len(transcoders), snapshot["max_size"]))
+    if is_full:
+        print("Activation cutoff is {0:.2f} LPT".format(cutoff))
+    print("Pool median keeps {0:.2f}% of rewards and {1:.2f}% of fees".format(median_reward_cut, median_fee_cut))
+    ranks = {transcoder["address"]: rank for rank, transcoder in enumerate(transcoders, start=1)}
+    for orch in State.orchestrators:
+        rank = ranks.get(orch.source_checksum_address)
+        print("\n{0}".format(orch.source_address))
+        if rank is None:
+            if is_full:
+                print("  Not in the pool, needs more than {0:.2f} LPT to get in".format(cutoff))
+            else:
+                print("  Not in the pool, which still has a free slot")
+            continue
+        transcoder = transcoders[rank - 1]
+        print("  Rank {0} of {1} with {2:.2f} LPT{3}".format(rank, len(transcoders), transcoder["stake"], "" if transcoder["active"] else " (not active this round)"))
+        if not is_full:
+            print("  The pool has free slots, so there is no cutoff to stay above")
+        elif rank == len(transcoders):
+            print("  Lowest stake in the pool, anyone bonding more than {0:.2f} LPT takes this slot".format(cutoff))
+        else:
+            print("  {0:.2f} LPT above the cutoff".format(transcoder["stake"] - cutoff))
+        cheaper_reward = len([other for other in transcoders if other["reward_cut"] < transcoder["reward_cut"]])
+        cheaper_fee = len([other for other in transcoders if other["fee_cut"] < transcoder["fee_cut"]])
+        print("  Keeps {0:.2f}% of rewards ({1} transcoders keep less) and {2:.2f}% of fees ({3} transcoders keep less)".format(
+            transcoder["reward_cut"], cheaper_reward, transcoder["fee_cut"], cheaper_fee))
+
+
 ### Treasury proposals
 
 
 """
-@brief Handler for voting on a proposal
+@brief Asks how to vote on a proposal
+@param who: description of who is voting, like a wallet address
+@return (vote value, reason) where 0 = Against, 1 = For, 2 = Abstain, or None to go back
 """
-def handleVote(idx, proposalId):
+def askProposalVote(who):
     while True:
-        print("{0} wants to vote".format(State.orchestrators[idx].source_address))
+        print("{0} wants to vote".format(who))
         options = ["3. Abstain", "2. Vote for the proposal", "1. Vote against the proposal", "0. Back to wallet selection"]
         printOptions(options)
         voteChoice = getInputAsInt()
         if voteChoice == 0:
-            return
+            return None
         elif voteChoice == -1:
             continue
         else:
@@ -181,7 +394,7 @@ def handleVote(idx, proposalId):
                 voteVal = -1 #< 0 = Against, 1 = For, 2 = Abstain
                 reason = input("Type in a reason or leave empty to vote without reason: ")
                 # Finally ask them to confirm
-                reasonString = State.orchestrators[idx].source_address + " is about to "
+                reasonString = who + " is about to "
                 if voteChoice == 3:
                     reasonString += "vote ABSTAIN this proposal "
                     voteVal = 2
@@ -200,15 +413,47 @@ def handleVote(idx, proposalId):
                 confirmChoice = getInputAsInt()
                 if (confirmChoice != 1):
                     continue
-                # And cast the vote
-                if reason == "":
-                    Contract.doCastVote(idx, proposalId, voteVal)
-                else:
-                    Contract.doCastVoteWithReason(idx, proposalId, voteVal, reason)
-                return
+                return (voteVal, reason)
             else:
                 print("UNIMPL: chose {0}".format(voteChoice))
 
+"""
+@brief Handler for voting on a proposal
+"""
+def handleVote(idx, proposalId):
+    vote = askProposalVote(State.orchestrators[idx].source_address)
+    if vote is None:
+        return
+    voteVal, reason = vote
+    # And cast the vote
+    if reason == "":
+        send("doCastVote", idx, proposalId, voteVal)
+    else:
+        send("doCastVoteWithReason", idx, proposalId, voteVal, reason)
+
+"""
+@brief Prints a single overview of a vote cast by multiple Orchestrators
+@param results: as returned by doCastVotes or doCastPollVotes
+"""
+def printVoteSummary(results):
+    if not results:
+        print("\nNo votes were cast.")
+        return
+    confirmed = sum(1 for result in results if result["status"] == "confirmed")
+    print("\n{0} of {1} votes confirmed:".format(confirmed, len(results)))
+    for result in results:
+        print("  {0} - {1} {2}".format(State.orchestrators[result["idx"]].source_address, result["status"].upper(), result["hash"] or ""))
+
+"""
+@brief Handler for voting on a proposal with all eligible Orchestrators at once
+"""
+def handleVoteAll(idxs, proposalId):
+    vote = askProposalVote("{0} Orchestrators".format(len(idxs)))
+    if vote is None:
+        return
+    voteVal, reason = vote
+    printVoteSummary(send("doCastVotes", idxs, proposalId, voteVal, reason))
+
 """
 @brief Handler for choosing a wallet to vote with
 """
@@ -216,7 +461,7 @@ def handleProposal(proposals, proposalIdx):
     proposal = proposals[proposalIdx]
     while True:
         # Refresh votes
-        currentVotes = Contract.getVotes(proposal["proposalId"])
+        currentVotes = backend.getVotes(proposal["proposalId"])
         sumVotes = currentVotes[0] + currentVotes[1] + currentVotes[2]
         amountAgainst = currentVotes[0]
         amountFor = currentVotes[1]
@@ -224,16 +469,20 @@ def handleProposal(proposals, proposalIdx):
         print("Currently {0:.0f} LPT ({1:.0f}%) is in favour, {2:.0f} LPT ({3:.0f}%) is in against, {4:.0f} LPT ({5:.0f}%) has abstained".format(
             amountFor, amountFor/sumVotes * 100, amountAgainst, amountAgainst/sumVotes * 100, amountAbstained, amountAbstained/sumVotes * 100
         ))
-        # First build a list of eligible orchs
+        # First build a list of eligible orchs, checking all of them in a single request
         canVoteIdx = []
         options = []
+        voted = backend.getHasVoted(proposal["proposalId"], [orch.source_checksum_address for orch in State.orchestrators])
         for orchIdx in range(len(State.orchestrators)):
-            hasVoted = Contract.hasVoted(proposal["proposalId"], State.orchestrators[orchIdx].source_checksum_address)
+            hasVoted = voted.get(State.orchestrators[orchIdx].source_checksum_address)
             if hasVoted:
                 options.append("{0}. {1} has already voted on this proposal".format(orchIdx + 1, State.orchestrators[orchIdx].source_address))
             else:
                 canVoteIdx.append(orchIdx)
                 options.append("{0}. Vote with {1}".format(orchIdx + 1, State.orchestrators[orchIdx].source_address))
+        voteAllChoice = len(State.orchestrators) + 1
+        if len(canVoteIdx) > 1:
+            options.append("{0}. Vote with all {1} eligible Orchestrators".format(voteAllChoice, len(canVoteIdx)))
         options.append("0. Back to proposals")
         # Ask which wallet to vote with
         printOptions(options)
@@ -242,6 +491,8 @@ def handleProposal(proposals, proposalIdx):
             return
         elif choice == -1:
             continue
+        elif choice == voteAllChoice and len(canVoteIdx) > 1:
+            handleVoteAll(canVoteIdx, proposal["proposalId"])
         else:
             orchIdx = choice - 1
             if orchIdx < len(State.orchestrators):
@@ -256,7 +507,7 @@ def handleProposal(proposals, proposalIdx):
 @brief Handler for choosing a treasury proposal
 """
 def handleTreasury():
-    proposals = Contract.getProposals()
+    proposals = getProposals()
 
     if not proposals:
         print("\nNo active proposals found.")
@@ -286,45 +537,69 @@ def handleTreasury():
 
 
 """
-@brief Handler for voting on a LIP poll
+@brief Asks how to vote on a LIP poll
+@param who: description of who is voting, like a wallet address
+@return 0 for YES, 1 for NO, or None to go back
 """
-def handlePollVote(idx, pollAddress):
+def askPollVote(who):
     while True:
-        print("{0} wants to vote on poll".format(State.orchestrators[idx].source_address))
+        print("{0} wants to vote on poll".format(who))
         options = ["1. Vote YES", "2. Vote NO", "0. Back to wallet selection"]
         printOptions(options)
         voteChoice = getInputAsInt()
         if voteChoice == 0:
-            return
+            return None
         elif voteChoice == -1:
             continue
         elif voteChoice in [1, 2]:
             choiceId = 0 if voteChoice == 1 else 1  # 0=Yes, 1=No
             choiceName = "YES" if choiceId == 0 else "NO"
-            print("{0} is about to vote {1} on this poll".format(
-                State.orchestrators[idx].source_address, choiceName))
+            print("{0} is about to vote {1} on this poll".format(who, choiceName))
             print("Enter 1 to confirm. Enter anything else to abort.")
             confirmChoice = getInputAsInt()
             if confirmChoice == 1:
-                Contract.doCastPollVote(idx, pollAddress, choiceId)
-            return
+                return choiceId
+            return None
         else:
             print("UNIMPL: chose {0}".format(voteChoice))
 
+"""
+@brief Handler for voting on a LIP poll
+"""
+def handlePollVote(idx, pollAddress):
+    choiceId = askPollVote(State.orchestrators[idx].source_address)
+    if choiceId is not None:
+        send("doCastPollVote", idx, pollAddress, choiceId)
+
+"""
+@brief Handler for voting on a LIP poll with all Orchestrators which have not voted yet
+"""
+def handlePollVoteAll(idxs, pollAddress):
+    choiceId = askPollVote("{0} Orchestrators".format(len(idxs)))
+    if choiceId is not None:
+        printVoteSummary(send("doCastPollVotes", idxs, pollAddress, choiceId))
+
 """
 @brief Handler for choosing a wallet to vote on a poll
 """
 def handlePoll(polls, pollIdx):
     poll = polls[pollIdx]
     while True:
+        # Look up the votes of all orchs in a single scan
+        votes = backend.getPollVotes([poll["pollAddress"]], [orch.source_checksum_address for orch in State.orchestrators])
         options = []
+        canVoteIdx = []
         for orchIdx in range(len(State.orchestrators)):
-            hasVoted, choiceId = Contract.getVoteStatus(poll["pollAddress"], State.orchestrators[orchIdx].source_checksum_address)
-            if hasVoted:
+            choiceId = votes.get((poll["pollAddress"], State.orchestrators[orchIdx].source_checksum_address))
+            if choiceId is not None:
                 voteName = "YES" if choiceId == 0 else "NO"
                 options.append("{0}. {1} - Voted {2}".format(orchIdx + 1, State.orchestrators[orchIdx].source_address, voteName))
             else:
+                canVoteIdx.append(orchIdx)
                 options.append("{0}. {1} - Can vote".format(orchIdx + 1, State.orchestrators[orchIdx].source_address))
+        voteAllChoice = len(State.orchestrators) + 1
+        if len(canVoteIdx) > 1:
+            options.append("{0}. Vote with all {1} Orchestrators which can vote".format(voteAllChoice, len(canVoteIdx)))
         options.append("0. Back to polls")
         printOptions(options)
         choice = getInputAsInt()
@@ -332,11 +607,12 @@ def handlePoll(polls, pollIdx):
             return
         elif choice == -1:
             continue
+        elif choice == voteAllChoice and len(canVoteIdx) > 1:
+            handlePollVoteAll(canVoteIdx, poll["pollAddress"])
         else:
             orchIdx = choice - 1
             if orchIdx < len(State.orchestrators):
-                hasVoted, _ = Contract.getVoteStatus(poll["pollAddress"], State.orchestrators[orchIdx].source_checksum_address)
-                if hasVoted:
+                if (poll["pollAddress"], State.orchestrators[orchIdx].source_checksum_address) in votes:
                     print("{0} has already voted on this poll".format(State.orchestrators[orchIdx].source_address))
                 else:
                     handlePollVote(orchIdx, poll["pollAddress"])
@@ -347,7 +623,7 @@ def handlePoll(polls, pollIdx):
 @brief Handler for choosing a LIP governance poll
 """
 def handleGovernance():
-    polls = Contract.getPolls()
+    polls = getPolls()
 
     if not polls:
         print("\nNo LIP polls found.")
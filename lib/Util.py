@@ -3,6 +3,7 @@
 from datetime import datetime #< Used to print the current time
 import sys #< Used to flush STDOUT or exit
 import os #< Check if a filepath is valid
+import json #< Reading and writing data files
 import web3 #< Handling wallet addresses
 # Import our own libraries
 from lib import Contract, State
@@ -24,6 +25,8 @@ def log(info, log_level = 1):
             level_string = "😕"
     if (log_level > State.LOG_VERBOSITY):
         return
+    if State.worker_id is not None:
+        info = "[worker {0}] {1}".format(State.worker_id, info)
     if State.LOG_TIMESTAMPED:
         now = datetime.now()
         now_trimmed = now.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
@@ -88,3 +91,42 @@ def getPrivateKey(keystore_path, password):
     except Exception as e:
         log("Unable to decrypt key: {0}".format(e), 1)
         return ""
+
+"""
+@brief Returns the absolute path to a file in the data folder, creating the folder if needed
+@param file_name: name of the file inside the data folder
+"""
+def getDataPath(file_name):
+    os.makedirs(State.DATA_DIR, exist_ok=True)
+    return os.path.join(State.DATA_DIR, file_name)
+
+"""
+@brief Reads a JSON data file
+@param file_path: absolute/relative path to a JSON file
+@param default: returned if the file does not exist or cannot be parsed
+"""
+def readJson(file_path, default):
+    if not checkPath(file_path):
+        return default
+    try:
+        with open(file_path) as file:
+            return json.load(file)
+    except Exception as e:
+        log("Unable to read {0}: {1}".format(file_path, e), 1)
+        return default
+
+"""
+@brief Writes a JSON data file atomically, so a crash never leaves a half written file behind
+@param file_path: absolute/relative path to a JSON file
+@param data: JSON serializable object
+"""
+def writeJsonAtomic(file_path, data):
+    tmp_path = file_path + ".tmp"
+    try:
+        with open(tmp_path, 'w') as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        log("Unable to write {0}: {1}".format(file_path, e), 1)
@@ -0,0 +1,262 @@
+# Shards the fleet over worker processes for the `--workers` launch flag
+# A single process runs every Orchestrator in one loop on one core. With workers, the coordinator forks N processes
+# once all keystores are decrypted, each running the siphon loop for its own share of the Orchestrators.
+# The coordinator keeps the round and lock state up to date for all of them through shared memory, so workers
+# never query it themselves. All processes draw from one shared budget of RPC requests per second.
+# NOTE: this file must not import Contract, which wraps its provider with the budget on import
+import os #< Forking workers and watching over them
+import signal #< Leaving interactive mode to the coordinator
+import time #< Refilling the budget and polling for round changes
+import asyncio #< Waiting for the budget from async code
+import multiprocessing #< Locks and memory shared between processes
+# Import our own libraries
+from lib import Fleet, State, Util
+
+
+# Workers get forked so they inherit the decrypted keys, which needs a platform with fork()
+CONTEXT = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else multiprocessing.get_context()
+# Round state which the coordinator shares with its workers, in this order
+ROUND_FIELDS = ["current_round_num", "current_round_is_locked", "previous_round_refresh", "next_round_eta"]
+# Seconds between checks of idle workers for a new round
+ROUND_POLL_INTERVAL = 1
+
+worker_pids = []    # Process IDs of all workers, in the coordinator
+coordinator_pid = 0 # Process ID of the coordinator, in a worker
+shared_round = None # Round state published by the coordinator
+shard_locks = []    # Transaction lock of each shard
+
+
+### Shared RPC budget
+
+
+class RateBudget:
+    """
+    Token bucket shared by all processes, refilled at `rate` requests per second up to a burst of one second.
+    Requests take their tokens right away, which can leave the bucket in debt. The caller then waits until
+    the debt is paid off, so concurrent callers queue up fairly instead of retrying.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = CONTEXT.Lock()
+        self.tokens = CONTEXT.RawValue('d', rate)
+        self.updated = CONTEXT.RawValue('d', time.monotonic())
+
+    def reserve(self, amount):
+        """Takes `amount` tokens and returns how many seconds to wait before using them."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens.value = min(self.rate, self.tokens.value + (now - self.updated.value) * self.rate) - amount
+            self.updated.value = now
+            return max(0, -self.tokens.value / self.rate)
+
+    def take(self, amount=1):
+        time.sleep(self.reserve(amount))
+
+    async def takeAsync(self, amount=1):
+        await asyncio.sleep(self.reserve(amount))
+
+# Created before any worker gets forked, so all of them share it
+budget = RateBudget(State.RPC_MAX_RATE) if State.RPC_MAX_RATE > 0 else None
+
+"""
+@brief Makes every request sent through a provider wait for the shared RPC budget
+A batch costs as many requests as it contains
+@return the same provider
+"""
+def limitProvider(provider):
+    if budget is None:
+        return provider
+    make_request = provider.make_request
+    make_batch_request = provider.make_batch_request
+    def limitedRequest(method, params):
+        budget.take()
+        return make_request(method, params)
+    def limitedBatchRequest(batch_requests):
+        budget.take(len(batch_requests))
+        return make_batch_request(batch_requests)
+    provider.make_request = limitedRequest
+    provider.make_batch_request = limitedBatchRequest
+    return provider
+
+"""
+@brief Async version of limitProvider()
+"""
+def limitAsyncProvider(provider):
+    if budget is None:
+        return provider
+    make_request = provider.make_request
+    make_batch_request = provider.make_batch_request
+    async def limitedRequest(method, params):
+        await budget.takeAsync()
+        return await make_request(method, params)
+    async def limitedBatchRequest(batch_requests):
+        await budget.takeAsync(len(batch_requests))
+        return await make_batch_request(batch_requests)
+    provider.make_request = limitedRequest
+    provider.make_batch_request = limitedBatchRequest
+    return provider
+
+
+### Sharding
+
+
+class ShardLocks:
+    """
+    Holds the transaction locks of all shards at once.
+    Used as the transaction lock of the coordinator, whose interactive menus and control socket
+    can send transactions for any Orchestrator.
+    """
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        # Always in the same order, so two holders can't deadlock
+        for lock in self.locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        for lock in reversed(self.locks):
+            lock.release()
+
+"""
+@brief Returns whether this process is the coordinator of a set of workers
+"""
+def isCoordinator():
+    return bool(worker_pids)
+
+"""
+@brief Returns whether this process is a worker
+"""
+def isWorker():
+    return State.worker_id is not None
+
+"""
+@brief Forks `count` workers, each of which continues with every `count`th Orchestrator
+Should be called once all keystores are decrypted, and before any background threads get started
+@return True in the coordinator, False in a worker or if workers are not supported here
+"""
+def start(count):
+    global shared_round, shard_locks, coordinator_pid
+    if not hasattr(os, "fork"):
+        Util.log("Running workers requires a platform which supports fork(). Continuing in a single process", 1)
+        return False
+    count = min(count, len(State.orchestrators))
+    if count < 2:
+        Util.log("Not enough Orchestrators to split over multiple workers. Continuing in a single process", 1)
+        return False
+    shared_round = CONTEXT.Array('d', len(ROUND_FIELDS))
+    shard_locks = [CONTEXT.RLock() for _ in range(count)]
+    publishRound()
+    coordinator_pid = os.getpid()
+    for worker_id in range(count):
+        pid = os.fork()
+        if pid == 0:
+            initWorker(worker_id, count)
+            return False
+        worker_pids.append(pid)
+    State.tx_lock = ShardLocks(shard_locks)
+    Util.log("Started {0} workers for {1} Orchestrators".format(count, len(State.orchestrators)), 2)
+    return True
+
+"""
+@brief Narrows down the state of a freshly forked worker to its own shard
+"""
+def initWorker(worker_id, count):
+    State.worker_id = worker_id
+    State.tx_lock = shard_locks[worker_id]
+    # Only the coordinator switches to interactive mode
+    signal.signal(signal.SIGQUIT, signal.SIG_IGN)
+    signal.signal(signal.SIGTSTP, signal.SIG_IGN)
+    State.require_user_input = False
+    # Move our Orchestrators into a fleet of their own, keeping their cached values
+    orchestrators = State.orchestrators[worker_id::count]
+    fleet = Fleet.FleetState(capacity=max(1, len(orchestrators)))
+    for orch in orchestrators:
+        idx = fleet.add()
+        for name in Fleet.COLUMNS:
+            fleet.set(name, idx, orch.fleet.get(name, orch.fleet_idx))
+        orch.fleet = fleet
+        orch.fleet_idx = idx
+    State.orchestrators = orchestrators
+    State.fleet = fleet
+    Util.log("Handling {0} Orchestrator(s)".format(len(orchestrators)), 2)
+
+"""
+@brief Exits the coordinator if any worker stopped, taking down the other workers with it
+Lets whatever supervises the siphon restart it as a whole, instead of running with part of the fleet unattended
+"""
+def checkWorkers():
+    for pid in worker_pids:
+        try:
+            exited, status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            exited, status = pid, 0
+        if exited:
+            Util.log("Fatal error: worker process {0} stopped with exit status {1}. Exiting...".format(pid, os.waitstatus_to_exitcode(status)), 1)
+            stopWorkers()
+            exit(1)
+
+"""
+@brief Stops all workers
+"""
+def stopWorkers():
+    for pid in worker_pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+"""
+@brief Exits a worker whose coordinator is gone
+"""
+def checkCoordinator():
+    if os.getppid() != coordinator_pid:
+        Util.log("Fatal error: the coordinator process stopped. Exiting...", 1)
+        exit(1)
+
+
+### Round state
+
+
+"""
+@brief Shares the round state of the coordinator with all workers
+"""
+def publishRound():
+    if shared_round is None:
+        return
+    with shared_round.get_lock():
+        for field, name in enumerate(ROUND_FIELDS):
+            shared_round[field] = float(getattr(State, name))
+
+"""
+@brief Takes over the round state published by the coordinator
+"""
+def syncRound():
+    # Right after starting, the coordinator might not know the round yet
+    while not shared_round[0]:
+        checkCoordinator()
+        time.sleep(ROUND_POLL_INTERVAL)
+    checkCoordinator()
+    with shared_round.get_lock():
+        values = shared_round[:]
+    State.current_round_num = int(values[0])
+    State.current_round_is_locked = bool(values[1])
+    State.previous_round_refresh = values[2]
+    State.next_round_eta = values[3]
+    Util.log("(shared) Round status: round {0} ({1})".format(State.current_round_num, "locked" if State.current_round_is_locked else "unlocked"), 3)
+
+"""
+@brief Sleeps for up to `timeout` seconds in a worker, returning early when the coordinator publishes a new round
+@return True if a new round started
+"""
+def waitForRound(timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        checkCoordinator()
+        if int(shared_round[0]) > State.current_round_num:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(ROUND_POLL_INTERVAL, remaining))
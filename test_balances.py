@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Simple test script for the balance history - no private key or RPC provider needed.
+Records two months of samples into a balance file, then checks how they got folded into hourly and daily samples.
+Runs against a tiny stand-in HTTP JSON-RPC server, as importing our libraries connects to the RPC provider.
+"""
+import os
+import json
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SAMPLE_INTERVAL = 600  # Seconds between recorded samples
+DAYS = 60
+
+
+# Stand-in HTTP JSON-RPC server, just enough for web3 to connect
+class RpcHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        results = {
+            "web3_clientVersion": "test_balances",
+            "eth_chainId": "0xa4b1"
+        }
+        body = json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": results.get(request["method"])}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+http_server = ThreadingHTTPServer(("127.0.0.1", 0), RpcHandler)
+threading.Thread(target=http_server.serve_forever, daemon=True).start()
+os.environ["SIPHON_RPC_L2"] = "http://127.0.0.1:{0}".format(http_server.server_address[1])
+os.environ["SIPHON_DATA_DIR"] = tempfile.mkdtemp(prefix="test_balances_")
+
+# Now import (State.py will use the env vars)
+from lib import Balances
+
+path = os.path.join(os.environ["SIPHON_DATA_DIR"], "balances.bin")
+series = Balances.SERIES[0]
+raw_capacity = Balances.TIERS[0][1]
+hourly_capacity = Balances.TIERS[1][1]
+
+print("Testing the balance history...\n")
+store = Balances.BalanceStore(path)
+timestamps = [step * SAMPLE_INTERVAL for step in range(DAYS * 86400 // SAMPLE_INTERVAL)]
+for timestamp in timestamps:
+    # The value tells which sample it came from
+    store.record(series, timestamp, timestamp / 10)
+# Samples of the other series don't mix in
+store.record(Balances.SERIES[1], timestamps[-1], -1)
+assert os.path.getsize(path) == Balances.FILE_SIZE, "The file should never grow"
+
+samples = store.query(series, 0, timestamps[-1])
+print("  Recorded {0} samples, kept {1}".format(len(timestamps), len(samples)))
+assert all(value == timestamp / 10 for timestamp, value in samples), "Values should stay with their timestamps"
+assert [timestamp for timestamp, _ in samples] == sorted(set(timestamp for timestamp, _ in samples)), "Samples should be oldest first"
+
+# The newest samples are kept as they are
+raw = timestamps[-raw_capacity:]
+assert [timestamp for timestamp, _ in samples[-raw_capacity:]] == raw
+older = [timestamp for timestamp, _ in samples[:-raw_capacity]]
+# Before those, the last sample of each hour. The newest hour is only partly folded, up to where the raw samples start
+hourly = older[-hourly_capacity:]
+assert all(timestamp % 3600 == 3600 - SAMPLE_INTERVAL for timestamp in hourly[:-1])
+assert all(later - earlier == 3600 for earlier, later in zip(hourly, hourly[1:-1]))
+assert hourly[-1] + SAMPLE_INTERVAL == raw[0]
+# And before those, the last sample of each day, the newest one up to where the hourly samples start
+daily = older[:-hourly_capacity]
+assert len(daily) > 1
+assert all(timestamp % 86400 == 86400 - SAMPLE_INTERVAL for timestamp in daily[:-1])
+assert all(later - earlier == 86400 for earlier, later in zip(daily, daily[1:-1]))
+assert daily[-1] + 3600 == hourly[0]
+print("  {0} raw, {1} hourly and {2} daily samples".format(len(raw), len(hourly), len(daily)))
+
+# Ranges only return what falls within them, whichever rings that spans
+start, end = daily[-1], hourly[2]
+assert store.query(series, start, end) == [sample for sample in samples if start <= sample[0] <= end]
+assert store.query(series, timestamps[-1] + 1, timestamps[-1] + 86400) == []
+assert store.query(Balances.SERIES[1], 0, timestamps[-1]) == [(timestamps[-1], -1)]
+
+# Everything survives reopening the file
+store.close()
+store = Balances.BalanceStore(path)
+assert store.query(series, 0, timestamps[-1]) == samples
+print("  Samples survive reopening the file")
+
+# With workers, another process records while we query: new samples show up without reopening
+reader = Balances.BalanceStore(path)
+store.record(series, timestamps[-1] + SAMPLE_INTERVAL, 1.5)
+assert reader.query(series, timestamps[-1] + 1, timestamps[-1] + SAMPLE_INTERVAL) == [(timestamps[-1] + SAMPLE_INTERVAL, 1.5)]
+reader.close()
+store.close()
+print("  Samples recorded through another mapping of the file show up right away")
+
+print("\nAll good.")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Simple test script for recording and replaying RPC traffic - no private key or RPC provider needed.
+Records a session against a tiny stand-in HTTP JSON-RPC server, then replays it with the server gone.
+Each session imports our libraries in a fresh process, in the same order as the entry point does.
+"""
+import os
+import sys
+import json
+import gzip
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Same imports as OrchestratorSiphon.py, then a few requests
+SESSION = """
+from lib import Util, Contract, AsyncContract, User, State, Control, Fleet, Planner, Checkpoint, Stream, Prefetch, Profiler, Workers, Cassette
+Cassette.announce()
+print(Contract.currentBlock(), Contract.currentBlock())
+"""
+
+
+# Stand-in HTTP JSON-RPC server, which answers with a higher block number every time
+class RpcHandler(BaseHTTPRequestHandler):
+    block = 100
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        results = {
+            "web3_clientVersion": "test_cassette",
+            "eth_chainId": "0xa4b1"
+        }
+        if request["method"] == "eth_blockNumber":
+            RpcHandler.block += 1
+            result = hex(RpcHandler.block)
+        else:
+            result = results.get(request["method"])
+        body = json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def runSession(mode, rpc_url, cassette):
+    env = dict(os.environ,
+        SIPHON_RPC_L2=rpc_url,
+        SIPHON_CASSETTE=cassette,
+        SIPHON_CASSETTE_MODE=mode,
+        SIPHON_DATA_DIR=tempfile.mkdtemp(prefix="test_cassette_")
+    )
+    result = subprocess.run([sys.executable, "-c", SESSION], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, "{0} session failed:\n{1}".format(mode, result.stderr)
+    # The block numbers come after whatever got logged
+    output = result.stdout.strip().splitlines()
+    print("  {0}: {1}".format(mode, output[-1]))
+    return output[-1]
+
+
+http_server = ThreadingHTTPServer(("127.0.0.1", 0), RpcHandler)
+threading.Thread(target=http_server.serve_forever, daemon=True).start()
+rpc_url = "http://127.0.0.1:{0}".format(http_server.server_address[1])
+cassette = os.path.join(tempfile.mkdtemp(prefix="test_cassette_"), "session.jsonl.gz")
+
+print("Testing RPC cassettes...\n")
+recorded = runSession("record", rpc_url, cassette)
+assert recorded == "101 102", "The stand-in server should have answered"
+with gzip.open(cassette, "rt") as file:
+    methods = [method for line in file for method, _, _ in json.loads(line)["q"]]
+assert methods.count("eth_blockNumber") == 2
+print("  Recorded {0} requests".format(len(methods)))
+
+# Nothing listens on the RPC url anymore, so every answer has to come from the cassette
+http_server.shutdown()
+http_server.server_close()
+replayed = runSession("replay", rpc_url, cassette)
+assert replayed == recorded, "Replay should answer in the recorded order"
+
+print("\nAll good.")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Simple test script for the earnings history index - no private key or RPC provider needed.
+Runs against a tiny stand-in HTTP JSON-RPC server which filters logs on address and topics like a real node.
+"""
+import os
+import json
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from eth_abi import encode
+
+ORCH = "0x" + "aa" * 20
+DELEGATOR = "0x" + "bb" * 20
+logs = []
+failing = threading.Event()
+
+
+def matches(log, query):
+    addresses = query.get("address") or []
+    if isinstance(addresses, str):
+        addresses = [addresses]
+    if addresses and log["address"].lower() not in [address.lower() for address in addresses]:
+        return False
+    for position, wanted in enumerate(query.get("topics") or []):
+        if wanted is None:
+            continue
+        wanted = wanted if isinstance(wanted, list) else [wanted]
+        if position >= len(log["topics"]) or log["topics"][position] not in wanted:
+            return False
+    return True
+
+# Stand-in HTTP JSON-RPC server, just enough for web3 and eth_getLogs
+class RpcHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        results = {
+            "web3_clientVersion": "test_history",
+            "eth_chainId": "0xa4b1",
+            "eth_blockNumber": "0x64"
+        }
+        response = {"jsonrpc": "2.0", "id": request["id"]}
+        if request["method"] == "eth_getLogs" and failing.is_set():
+            response["error"] = {"code": -32603, "message": "internal error"}
+        elif request["method"] == "eth_getLogs":
+            response["result"] = [log for log in logs if matches(log, request["params"][0])]
+        else:
+            response["result"] = results.get(request["method"])
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+http_server = ThreadingHTTPServer(("127.0.0.1", 0), RpcHandler)
+threading.Thread(target=http_server.serve_forever, daemon=True).start()
+os.environ["SIPHON_RPC_L2"] = "http://127.0.0.1:{0}".format(http_server.server_address[1])
+os.environ["SIPHON_DATA_DIR"] = tempfile.mkdtemp(prefix="test_history_")
+
+# Now import (State.py will use the env vars)
+from lib import Util, Contract, History, State
+
+def addLog(event_name, block, topics, types, values):
+    logs.append({
+        "address": Contract.bonding_contract.address,
+        "topics": [Contract.bonding_contract.events[event_name]().topic] + [Contract.addressToTopic(topic) for topic in topics],
+        "data": "0x" + encode(types, values).hex(),
+        "blockNumber": hex(block), "blockHash": "0x" + "{0:064x}".format(block), "transactionHash": "0x" + "{0:064x}".format(block),
+        "transactionIndex": "0x0", "logIndex": "0x0", "removed": False
+    })
+
+# Someone else delegating to us claims their earnings: delegate is our Orchestrator, delegator is not
+addLog("EarningsClaimed", 10, [ORCH, DELEGATOR], ["uint256", "uint256", "uint256", "uint256"], [5 * 10**18, 10**17, 1, 2])
+# Our Orchestrator claims its own earnings
+addLog("EarningsClaimed", 11, [ORCH, ORCH], ["uint256", "uint256", "uint256", "uint256"], [3 * 10**18, 2 * 10**17, 1, 2])
+addLog("Reward", 12, [ORCH], ["uint256"], [7 * 10**18])
+
+print("Testing the earnings history index...\n")
+History.loadIndex()
+rows, _ = History.indexRange([Util.getChecksumAddr(ORCH)], 0, 100, with_rounds=False)
+rows.sort()
+for row in rows:
+    print("  ", row)
+claims = [row for row in rows if row[2] == "EarningsClaimed"]
+assert len(claims) == 1, "Only our own claim should be indexed"
+assert claims[0][0] == 11 and claims[0][4] == 3 * 10**18 and claims[0][5] == 2 * 10**17
+assert [row[2] for row in rows] == ["EarningsClaimed", "Reward"]
+print("\n  Claims of other delegators are left out")
+
+class Orchestrator:
+    source_checksum_address = Util.getChecksumAddr(ORCH)
+State.orchestrators = [Orchestrator()]
+# A range which keeps failing leaves the index as it was, instead of skipping past it
+failing.set()
+History.updateIndex()
+assert History.index["cursor"] == 0 and History.index["events"] == [], "A failed update should not change the index"
+failing.clear()
+History.updateIndex()
+assert History.index["cursor"] == 100
+assert [row[2] for row in History.index["events"]] == ["EarningsClaimed", "Reward"], "Retrying should not add rows twice"
+print("  Failed updates leave the index untouched until they succeed")
+
+print("\nAll good.")
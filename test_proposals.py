@@ -2,6 +2,9 @@
 """
 Simple test script for getProposals() - no private key needed.
 Just tests the read-only proposal fetching.
+To make it reproducible, record the RPC traffic once and replay it offline afterwards:
+    SIPHON_CASSETTE=proposals.jsonl.gz python3 test_proposals.py
+    SIPHON_CASSETTE=proposals.jsonl.gz SIPHON_CASSETTE_MODE=replay python3 test_proposals.py
 """
 import os
 
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Simple test script for the WebSocket subscriptions - no private key or RPC provider needed.
+Runs against local stand-in servers: a WebSocket server which pushes newHeads and log notifications,
+and a tiny HTTP JSON-RPC server which hands out a receipt once the transaction is "mined".
+"""
+import os
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from websockets.sync.server import serve
+
+TX_HASH = "0x" + "ab" * 32
+mined = threading.Event()
+connections = []
+
+
+# Stand-in HTTP JSON-RPC server, just enough for web3 and receipts
+class RpcHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        results = {
+            "eth_chainId": "0xa4b1",
+            "eth_blockNumber": "0x3",
+            "eth_getTransactionReceipt": {
+                "transactionHash": TX_HASH, "transactionIndex": "0x0", "blockHash": "0x" + "cd" * 32,
+                "blockNumber": "0x3", "from": "0x" + "11" * 20, "to": "0x" + "22" * 20, "cumulativeGasUsed": "0x5208",
+                "gasUsed": "0x5208", "effectiveGasPrice": "0x1", "contractAddress": None, "logs": [], "logsBloom": "0x" + "00" * 256,
+                "status": "0x1", "type": "0x2"
+            } if mined.is_set() else None
+        }
+        body = json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": results.get(request["method"])}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Stand-in WebSocket server, confirms every eth_subscribe and keeps the connection around so we can push notifications
+def wsHandler(websocket):
+    subscriptions = []
+    for message in websocket:
+        request = json.loads(message)
+        subscriptions.append("0x{0:x}".format(len(subscriptions) + 1))
+        websocket.send(json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": subscriptions[-1]}))
+        if len(subscriptions) == 3:
+            connections.append((websocket, subscriptions))
+
+def push(subscription, result):
+    websocket, subscriptions = connections[-1]
+    websocket.send(json.dumps({"jsonrpc": "2.0", "method": "eth_subscription", "params": {"subscription": subscriptions[subscription], "result": result}}))
+
+def waitFor(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.05)
+
+
+http_server = ThreadingHTTPServer(("127.0.0.1", 0), RpcHandler)
+threading.Thread(target=http_server.serve_forever, daemon=True).start()
+ws_server = serve(wsHandler, "127.0.0.1", 0)
+threading.Thread(target=ws_server.serve_forever, daemon=True).start()
+os.environ["SIPHON_RPC_L2"] = "http://127.0.0.1:{0}".format(http_server.server_address[1])
+os.environ["SIPHON_RPC_L2_WS"] = "ws://127.0.0.1:{0}".format(ws_server.socket.getsockname()[1])
+
+# Now import (State.py will use the env vars)
+from lib import Contract, Stream, State
+Stream.RECONNECT_DELAY_MIN = 0.1
+
+print("Testing subscriptions...\n")
+Contract.startStream()
+waitFor(lambda: Stream.connected and connections)
+print("  Connected and subscribed")
+
+push(0, {"number": "0x2"})
+waitFor(lambda: Stream.latest_head == 2)
+print("  New head:", Stream.latest_head)
+
+State.next_round_eta = time.time() + 3600
+push(1, {"transactionHash": "0x" + "ef" * 32, "blockNumber": "0x2", "topics": [Contract.rounds_contract.events.NewRound.topic]})
+assert Stream.waitForRound(5), "NewRound should wake up the siphon loop"
+assert State.next_round_eta == 0
+print("  New round woke up the siphon loop")
+
+# The receipt only shows up over HTTP once the next head came in
+def mine():
+    time.sleep(0.5)
+    mined.set()
+    push(0, {"number": "0x3"})
+threading.Thread(target=mine).start()
+receipt = Contract.waitForReceipt(bytes.fromhex(TX_HASH[2:]), timeout=10)
+assert receipt["blockNumber"] == 3
+print("  Got receipt in block", receipt["blockNumber"])
+
+# Drop the connection, the stream should fall back and reconnect by itself
+connections[-1][0].close()
+waitFor(lambda: len(connections) == 2 and Stream.connected)
+print("  Reconnected after the connection dropped")
+
+print("\nAll good.")